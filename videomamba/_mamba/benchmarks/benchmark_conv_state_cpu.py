@@ -0,0 +1,72 @@
+# Copyright (c) 2023, Tri Dao, Albert Gu.
+"""CPU per-token cost of the causal conv state update: shifted vs circular (ring) conv_state.
+
+"roll" is the torch.roll + sum update of Mamba.step without causal_conv1d, "shift" the linear
+causal_conv1d_update_ref (concatenate and copy the state back), "ring" the circular update with a shared
+write pointer (one column written, taps read in place). The last columns time a whole Mamba.step.
+
+    python benchmarks/benchmark_conv_state_cpu.py --batch 1 8 --dim 384 768 --width 4
+"""
+
+import argparse
+import itertools
+import time
+
+import torch
+import torch.nn.functional as F
+
+from causal_conv1d.causal_conv1d_interface import causal_conv1d_update_ref
+from mamba_ssm.modules.mamba_simple import Mamba
+
+
+parser = argparse.ArgumentParser(description="Conv state update CPU benchmarking")
+parser.add_argument("--batch", type=int, nargs="+", default=[1, 8, 64])
+parser.add_argument("--dim", type=int, nargs="+", default=[384, 768])
+parser.add_argument("--width", type=int, nargs="+", default=[4])
+parser.add_argument("--tokens", type=int, default=2000)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+
+def roll_update(x, conv_state, weight, bias, cache_seqlens):
+    conv_state.copy_(torch.roll(conv_state, shifts=-1, dims=-1))
+    conv_state[:, :, -1] = x
+    return F.silu(torch.sum(conv_state * weight, dim=-1) + bias)
+
+
+def shift_update(x, conv_state, weight, bias, cache_seqlens):
+    return causal_conv1d_update_ref(x, conv_state, weight, bias, "silu")[0]
+
+
+def ring_update(x, conv_state, weight, bias, cache_seqlens):
+    return causal_conv1d_update_ref(x, conv_state, weight, bias, "silu", cache_seqlens=cache_seqlens)[0]
+
+
+def per_token_us(fn, *inputs):
+    with torch.no_grad():
+        for i in range(10):  # warmup
+            fn(*inputs, i)
+        start = time.perf_counter()
+        for i in range(args.tokens):
+            fn(*inputs, i)
+    return (time.perf_counter() - start) / args.tokens * 1e6
+
+
+print(f"{'B':>3} {'D':>5} {'W':>2} | {'roll us':>8} {'shift us':>9} {'ring us':>8} | "
+      f"{'step us':>8} {'ring step us':>12} | speedup")
+for batch, dim, width in itertools.product(args.batch, args.dim, args.width):
+    torch.random.manual_seed(0)
+    x = torch.randn(batch, dim)
+    weight, bias = torch.randn(dim, width), torch.randn(dim)
+    times = [per_token_us(fn, x, torch.zeros(batch, dim, width), weight, bias)
+             for fn in (roll_update, shift_update, ring_update)]
+    model = Mamba(dim // 2, d_conv=width, layer_idx=0, bimamba=False)
+    hidden_states = torch.randn(batch, 1, dim // 2)
+    step = per_token_us(lambda states, i: model.step(hidden_states, *states), model.allocate_inference_cache(batch, 1))
+    ring_step = per_token_us(lambda states, i: model.step(hidden_states, *states, cache_seqlens=i),
+                             model.allocate_inference_cache(batch, 1))
+    print(f"{batch:>3} {dim:>5} {width:>2} | {times[0]:>8.1f} {times[1]:>9.1f} {times[2]:>8.1f} | "
+          f"{step:>8.1f} {ring_step:>12.1f} | {times[1] / times[2]:.2f}x")
@@ -0,0 +1,104 @@
+# Copyright (c) 2023, Tri Dao, Albert Gu.
+"""CPU wall-clock / peak memory of the chunked selective_scan_ref vs the per-timestep loop.
+
+With --backward, forward + backward of autograd through selective_scan_ref vs the chunk-boundary
+recomputation of selective_scan_recompute_fn.
+
+Peak memory is the growth of the process high-water mark (VmHWM, reset through /proc/self/clear_refs)
+over the resident set before the call, after handing freed heap memory back with malloc_trim, so it is
+only reported on Linux / glibc.
+
+    python benchmarks/benchmark_selective_scan_cpu.py --seqlen 197 3152 --dim 384 768 --dstate 16
+"""
+
+import argparse
+import ctypes
+import itertools
+import time
+
+import torch
+
+from mamba_ssm.ops.selective_scan_interface import selective_scan_ref, selective_scan_sequential_ref
+from mamba_ssm.ops.selective_scan_interface import selective_scan_recompute_fn
+
+
+parser = argparse.ArgumentParser(description="Selective scan CPU benchmarking")
+parser.add_argument("--batch", type=int, default=1)
+parser.add_argument("--seqlen", type=int, nargs="+", default=[197, 1576, 3152])
+parser.add_argument("--dim", type=int, nargs="+", default=[384, 768])
+parser.add_argument("--dstate", type=int, nargs="+", default=[16])
+parser.add_argument("--chunk-size", type=int, default=None)
+parser.add_argument("--repeats", type=int, default=3)
+parser.add_argument("--threads", type=int, default=None)
+parser.add_argument("--backward", action="store_true")
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+
+def reset_peak_memory():
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def memory_mb(field="VmHWM"):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def run(fn, *inputs, **kwargs):
+    if not args.backward:
+        with torch.no_grad():
+            return fn(*inputs, **kwargs)
+    inputs = [t.requires_grad_() for t in inputs]
+    fn(*inputs, **kwargs).sum().backward()
+    for t in inputs:
+        t.grad = None
+
+
+def benchmark(fn, *inputs, **kwargs):
+    run(fn, *inputs, **kwargs)  # warmup
+    reset_peak_memory()
+    rss = memory_mb("VmRSS")
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        run(fn, *inputs, **kwargs)
+    elapsed = (time.perf_counter() - start) / args.repeats
+    return elapsed, memory_mb() - rss
+
+
+if args.backward:
+    baseline, baseline_name, candidate, candidate_name = selective_scan_ref, "autograd", selective_scan_recompute_fn, "recompute"
+else:
+    baseline, baseline_name, candidate, candidate_name = selective_scan_sequential_ref, "loop", selective_scan_ref, "chunked"
+print(f"{'L':>6} {'D':>5} {'N':>3} | {baseline_name + ' ms':>12} {'peak MB':>8} | "
+      f"{candidate_name + ' ms':>12} {'peak MB':>8} | speedup")
+for seqlen, dim, dstate in itertools.product(args.seqlen, args.dim, args.dstate):
+    torch.random.manual_seed(0)
+    u = torch.randn(args.batch, dim, seqlen)
+    delta = torch.rand(args.batch, dim, seqlen)
+    A = -torch.rand(dim, dstate)
+    B = torch.randn(args.batch, dstate, seqlen)
+    C = torch.randn(args.batch, dstate, seqlen)
+    D = torch.randn(dim)
+    z = torch.randn(args.batch, dim, seqlen)
+    inputs = (u, delta, A, B, C, D, z)
+    t_new, mem_new = benchmark(candidate, *inputs, delta_softplus=True, chunk_size=args.chunk_size)
+    t_base, mem_base = benchmark(baseline, *inputs, delta_softplus=True,
+                                 **({} if baseline is selective_scan_sequential_ref else {"chunk_size": args.chunk_size}))
+    print(f"{seqlen:>6} {dim:>5} {dstate:>3} | {t_base * 1e3:>12.1f} {mem_base:>8.1f} | "
+          f"{t_new * 1e3:>12.1f} {mem_new:>8.1f} | {t_base / t_new:.2f}x")
@@ -1,5 +1,21 @@
 __version__ = "1.0.1"
 
-from .ops.selective_scan_interface import selective_scan_fn, mamba_inner_fn
-from .modules.mamba_simple import Mamba
-from .models.mixer_seq_simple import MambaLMHeadModel
+# Imported on first access, so that importing a submodule (e.g. mamba_ssm.modules.mamba_simple) does not
+# load the language model and its generation utilities (transformers)
+_LAZY_ATTRIBUTES = {
+    "selective_scan_fn": ".ops.selective_scan_interface",
+    "mamba_inner_fn": ".ops.selective_scan_interface",
+    "Mamba": ".modules.mamba_simple",
+    "MambaLMHeadModel": ".models.mixer_seq_simple",
+}
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
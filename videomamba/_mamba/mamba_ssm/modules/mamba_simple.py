@@ -10,31 +10,16 @@ from torch import Tensor
 
 from einops import rearrange, repeat
 
-# try:
 from causal_conv1d import causal_conv1d_fn, causal_conv1d_update
-# except ImportError:
-#     causal_conv1d_fn, causal_conv1d_update = None
-from causal_conv1d import causal_conv1d_fn
-import causal_conv1d_cuda
-import selective_scan_cuda
 
-import sys
-sys.path.append('/home/tqy/endomamba/videomamba/_mamba/mamba_ssm')
+# The fused functions below dispatch to the CUDA kernels or to the pure-PyTorch reference ops
+# depending on the input device and on what is installed, see ops/backend.py.
+from ..ops.selective_scan_interface import selective_scan_fn, mamba_inner_fn, bimamba_inner_fn, mamba_inner_fn_no_out_proj
+from ..utils.state_cache import allocate_states, load_states, store_states_
+from ..ops.backend import OptionalModule, RMSNorm, layer_norm_fn, rms_norm_fn
 
-try:
-    from ops.selective_scan_interface import selective_scan_fn, mamba_inner_fn, bimamba_inner_fn, mamba_inner_fn_no_out_proj
-except ImportError:
-    selective_scan_fn, mamba_inner_fn, bimamba_inner_fn, mamba_inner_fn_no_out_proj = None, None, None, None
-
-try:
-    from ops.triton.selective_state_update import selective_state_update
-except ImportError:
-    selective_state_update = None
-
-try:
-    from ops.triton.layernorm import RMSNorm, layer_norm_fn, rms_norm_fn
-except ImportError:
-    RMSNorm, layer_norm_fn, rms_norm_fn = None, None, None
+# Triton kernel of the single-step update, imported on the first CUDA step
+triton_state_update = OptionalModule("..ops.triton.selective_state_update", __package__)
 
 
 class Mamba(nn.Module):
@@ -174,15 +159,30 @@ class Mamba(nn.Module):
         else:
             conv_state, ssm_state = self._get_states_from_cache(inference_params, batch)
 
-        # We do matmul and transpose BLH -> HBL at the same time
-        # NOTE: same as in_proj(hidden_states) but memory-efficient with the following operations
-        xz = rearrange(
-            self.in_proj.weight @ rearrange(hidden_states, "b l d -> d (b l)"),
-            "d (b l) -> b d l",
-            l=seqlen,
-        )
-        if self.in_proj.bias is not None:
-            xz = xz + rearrange(self.in_proj.bias.to(dtype=xz.dtype), "d -> d 1")
+        ring_offset = None
+        if inference_params is not None and inference_params.conv_state_ring and not self.bimamba:
+            # conv_state is a circular buffer written at the token count seqlen_offset (see step): a single
+            # token is stepped in place, a longer call scans from and back to the linear layout
+            ring_offset = inference_params.seqlen_offset
+            if seqlen == 1:
+                out, _, _ = self.step(hidden_states, conv_state, ssm_state, cache_seqlens=ring_offset)
+                self._cache_states(inference_params, (conv_state, ssm_state))
+                return out, inference_params
+            conv_state = conv_state.roll(-(ring_offset % self.d_conv), dims=-1)
+
+        if type(self.in_proj) is not nn.Linear:
+            # Replaced by another layer (e.g. the int8 QuantizedLinear): call it, in the (B L D) layout
+            xz = rearrange(self.in_proj(hidden_states), "b l d -> b d l")
+        else:
+            # We do matmul and transpose BLH -> HBL at the same time
+            # NOTE: same as in_proj(hidden_states) but memory-efficient with the following operations
+            xz = rearrange(
+                self.in_proj.weight @ rearrange(hidden_states, "b l d -> d (b l)"),
+                "d (b l) -> b d l",
+                l=seqlen,
+            )
+            if self.in_proj.bias is not None:
+                xz = xz + rearrange(self.in_proj.bias.to(dtype=xz.dtype), "d -> d 1")
 
         A = -torch.exp(self.A_log.float())  # (d_inner, d_state)
         # In the backward pass we write dx and dz next to each other to avoid torch.cat
@@ -201,9 +201,6 @@ class Mamba(nn.Module):
                     self.D.float(),
                     delta_bias=self.dt_proj.bias.float(),
                     delta_softplus=True,
-                    ssm_state=ssm_state,
-                    conv_state=conv_state,
-                    return_last_state=return_last_state
                 )
                 out_b = mamba_inner_fn_no_out_proj(
                     xz.flip([-1]),
@@ -217,13 +214,28 @@ class Mamba(nn.Module):
                     self.D_b.float(),
                     delta_bias=self.dt_proj_b.bias.float(),
                     delta_softplus=True,
-                    ssm_state=ssm_state_b,
-                    conv_state=conv_state_b,
+                )
+                out = self.out_proj(rearrange(out + out_b.flip([-1]), "b d l -> b l d"))
+            elif type(self.out_proj) is not nn.Linear:
+                out = mamba_inner_fn_no_out_proj(
+                    xz,
+                    self.conv1d.weight,
+                    self.conv1d.bias,
+                    self.x_proj.weight,
+                    self.dt_proj.weight,
+                    A,
+                    None,  # input-dependent B
+                    None,  # input-dependent C
+                    self.D.float(),
+                    delta_bias=self.dt_proj.bias.float(),
+                    delta_softplus=True,
+                    ssm_state=ssm_state,
+                    conv_state=conv_state,
                     return_last_state=return_last_state
                 )
-                    
-                out = F.linear(rearrange(out + out_b.flip([-1]), "b d l -> b l d"), self.out_proj.weight, self.out_proj.bias)
-                # out = F.linear(rearrange(out, "b d l -> b l d"), self.out_proj.weight, self.out_proj.bias)
+                if return_last_state:
+                    out, ssm_state, conv_state = out
+                out = self.out_proj(rearrange(out, "b d l -> b l d"))
             else:
                 out = mamba_inner_fn(
                     xz,
@@ -289,38 +301,47 @@ class Mamba(nn.Module):
             y = rearrange(y, "b d l -> b l d")
             out = self.out_proj(y)
             
+        if ring_offset is not None:
+            conv_state = conv_state.roll((ring_offset + seqlen) % self.d_conv, dims=-1)
         if inference_params is not None:
             # The states are updated inplace
             if self.bimamba:
-                inference_params.key_value_memory_dict[self.layer_idx] = (conv_state, ssm_state, conv_state_b, ssm_state_b)
+                self._cache_states(inference_params, (conv_state, ssm_state, conv_state_b, ssm_state_b))
             else:
-                inference_params.key_value_memory_dict[self.layer_idx] = (conv_state, ssm_state)
+                self._cache_states(inference_params, (conv_state, ssm_state))
             return out, inference_params
         else:
             return out
 
-    def step(self, hidden_states, conv_state, ssm_state):
+    def _cache_states(self, inference_params, states):
+        if not self.bimamba and inference_params.state_dtype is not None:
+            # Round the fp32 states back into the reduced-precision storage
+            store_states_(inference_params.key_value_memory_dict[self.layer_idx], states)
+        else:
+            inference_params.key_value_memory_dict[self.layer_idx] = states
+
+    def step(self, hidden_states, conv_state, ssm_state, cache_seqlens=None):
+        """
+        hidden_states: (B, 1, D)
+        cache_seqlens: number of tokens seen so far (int). If given, conv_state is a circular buffer
+            written at cache_seqlens % d_conv instead of being shifted by one every token. A conv_state
+            in the linear layout (as left by the parallel forward or by steps without cache_seqlens) must
+            first be rolled by cache_seqlens % d_conv; forward does this for InferenceParams.conv_state_ring.
+        """
         dtype = hidden_states.dtype
         assert hidden_states.shape[1] == 1 # "Only support decoding with 1 token at a time for now"
         xz = self.in_proj(hidden_states.squeeze(1))  # (B 2D)
         x, z = xz.chunk(2, dim=-1)  # (B D)
 
         # Conv step
-        if causal_conv1d_update is None:
-            conv_state.copy_(torch.roll(conv_state, shifts=-1, dims=-1))  # Update state (B D W)
-            conv_state[:, :, -1] = x
-            x = torch.sum(conv_state * rearrange(self.conv1d.weight, "d 1 w -> d w"), dim=-1)  # (B D)
-            if self.conv1d.bias is not None:
-                x = x + self.conv1d.bias
-            x = self.act(x).to(dtype=dtype)
-        else:
-            x = causal_conv1d_update(
-                x,
-                conv_state,
-                rearrange(self.conv1d.weight, "d 1 w -> d w"),
-                self.conv1d.bias,
-                self.activation,
-            )
+        x = causal_conv1d_update(
+            x,
+            conv_state,
+            rearrange(self.conv1d.weight, "d 1 w -> d w"),
+            self.conv1d.bias,
+            self.activation,
+            cache_seqlens=cache_seqlens,
+        )
         x_db = self.x_proj(x)  # (B dt_rank+2*d_state)
         dt, B, C = torch.split(x_db, [self.dt_rank, self.d_state, self.d_state], dim=-1)
         # Don't add dt_bias here
@@ -328,7 +349,7 @@ class Mamba(nn.Module):
         A = -torch.exp(self.A_log.float())  # (d_inner, d_state)
 
         # SSM step
-        if selective_state_update is None:
+        if not ssm_state.is_cuda or not triton_state_update:
             # Discretize A and B
             dt = F.softplus(dt + self.dt_proj.bias.to(dtype=dt.dtype))
             dA = torch.exp(torch.einsum("bd,dn->bdn", dt, A))
@@ -338,7 +359,7 @@ class Mamba(nn.Module):
             y = y + self.D.to(dtype) * x
             y = y * self.act(z)  # (B D)
         else:
-            y = selective_state_update(
+            y = triton_state_update.selective_state_update(
                 ssm_state, x, dt, A, B, C, self.D, z=z, dt_bias=self.dt_proj.bias, dt_softplus=True
             )
 
@@ -346,7 +367,12 @@ class Mamba(nn.Module):
         return out.unsqueeze(1), conv_state, ssm_state
     
     def allocate_inference_cache(self, batch_size, max_seqlen, dtype=None, **kwargs):
+        """(conv_state, ssm_state), or with dtype=torch.int8 the stored states of utils/state_cache.py."""
         device = self.out_proj.weight.device
+        if dtype == torch.int8:
+            return allocate_states(
+                ((batch_size, self.d_inner, self.d_conv), (batch_size, self.d_inner, self.d_state)), dtype, device
+            )
         conv_dtype = self.conv1d.weight.dtype if dtype is None else dtype
         conv_state = torch.zeros(
             batch_size, self.d_model * self.expand, self.d_conv, device=device, dtype=conv_dtype
@@ -382,11 +408,22 @@ class Mamba(nn.Module):
                 if inference_params is not None:
                     if self.bimamba:
                         inference_params.key_value_memory_dict[self.layer_idx] = (conv_state, ssm_state, conv_state_b, ssm_state_b)
+                    elif inference_params.state_dtype is not None:
+                        inference_params.key_value_memory_dict[self.layer_idx] = allocate_states(
+                            (conv_state.shape, ssm_state.shape), inference_params.state_dtype, conv_state.device
+                        )
                     else:
                         inference_params.key_value_memory_dict[self.layer_idx] = (conv_state, ssm_state)
             else:
                 if self.bimamba:
                     conv_state, ssm_state, conv_state_b, ssm_state_b = inference_params.key_value_memory_dict[self.layer_idx]
+                elif inference_params.state_dtype is not None:
+                    stored_states = inference_params.key_value_memory_dict[self.layer_idx]
+                    if initialize_states:
+                        for state in stored_states:
+                            state.zero_()
+                    # fp32 working copies, stored back by forward
+                    conv_state, ssm_state = load_states(stored_states, torch.float32)
                 else:
                     conv_state, ssm_state = inference_params.key_value_memory_dict[self.layer_idx]
                 # TODO: What if batch size changes between generation, and we reuse the same states?
@@ -0,0 +1,154 @@
+# Copyright (c) 2023, Tri Dao, Albert Gu.
+"""Inference-only Mamba mixer that runs into preallocated buffers.
+
+StaticMamba computes the same function as Mamba.forward (bidirectional, or causal continuing from
+conv_state / ssm_state) with the out= / inplace variants of the reference ops, every intermediate
+tensor coming from a Workspace. Once the workspace has seen the (batch, seqlen) shape, a call does no
+tensor allocation; layers with the same d_model share the buffers.
+
+Tensors stay channel-last, (batch, seqlen, channels), and the scan is time-major, so that no layout
+conversion is ever materialized. The two directions of a bidirectional layer are stacked on the
+channel dimension: the second one sees the flipped sequence.
+"""
+import torch
+import torch.nn.functional as F
+
+from ..utils.workspace import Workspace
+
+
+class StaticMamba:
+    def __init__(self, mixer, workspace=None):
+        """
+        Args:
+            mixer (Mamba): an fp32 Mamba layer. in_proj / out_proj weights are shared, the per-direction
+                weights are stacked once here (so later changes to the layer are not seen).
+            workspace (Workspace): where the intermediate buffers live.
+        """
+        assert mixer.in_proj.weight.dtype == torch.float32, "StaticMamba only runs fp32 layers"
+        self.workspace = workspace if workspace is not None else Workspace(mixer.in_proj.weight.device)
+        self.bimamba = mixer.bimamba
+        self.d_inner, self.d_state, self.d_conv, self.dt_rank = mixer.d_inner, mixer.d_state, mixer.d_conv, mixer.dt_rank
+        with torch.no_grad():
+            directions = [(mixer.conv1d, mixer.x_proj, mixer.dt_proj, mixer.A_log, mixer.D)]
+            if self.bimamba:
+                directions.append((mixer.conv1d_b, mixer.x_proj_b, mixer.dt_proj_b, mixer.A_b_log, mixer.D_b))
+            convs, x_projs, dt_projs, A_logs, Ds = zip(*directions)
+            self.in_proj_weight = mixer.in_proj.weight.detach().t()  # (d_model, 2 * d_inner)
+            self.in_proj_bias = mixer.in_proj.bias.detach() if mixer.in_proj.bias is not None else None
+            # (d_conv, K, 1, 1, d_inner): tap k of every channel of every direction
+            self.conv_weight = torch.stack([conv.weight[:, 0].t() for conv in convs], dim=1)[:, :, None, None].contiguous()
+            self.conv_bias = (torch.stack([conv.bias for conv in convs])[:, None, None] if convs[0].bias is not None
+                              else None)
+            self.x_proj_weight = torch.stack([x_proj.weight.t() for x_proj in x_projs])  # (K, d_inner, dt_rank + 2 * d_state)
+            self.dt_proj_weight = torch.stack([dt_proj.weight.t() for dt_proj in dt_projs])  # (K, dt_rank, d_inner)
+            self.dt_proj_bias = torch.stack([dt_proj.bias for dt_proj in dt_projs])[:, None]  # (K, 1, d_inner)
+            self.A = -torch.exp(torch.stack(A_logs).float())  # (K, d_inner, d_state)
+            self.D = torch.stack(Ds).float()  # (K, d_inner)
+            self.out_proj_weight = mixer.out_proj.weight.detach().t()  # (d_inner, d_model)
+            self.out_proj_bias = mixer.out_proj.bias.detach() if mixer.out_proj.bias is not None else None
+            # softplus(x) = x above this, as in F.softplus
+            self.softplus_threshold = torch.tensor(20.0, device=self.A.device)
+        self.reversed_indices = {}  # seqlen -> (seqlen,) index flipping the sequence
+
+    def _reversed_index(self, seqlen):
+        if seqlen not in self.reversed_indices:
+            self.reversed_indices[seqlen] = torch.arange(seqlen - 1, -1, -1, device=self.A.device)
+        return self.reversed_indices[seqlen]
+
+    def __call__(self, hidden_states, out, conv_state=None, ssm_state=None):
+        """
+        hidden_states: (batch, seqlen, d_model), contiguous
+        out: (batch, seqlen, d_model), written
+        conv_state: (batch, d_inner, d_conv), ssm_state: (batch, d_inner, d_state), for a causal layer:
+            the states of the previous call, updated inplace (as Mamba.forward with return_last_state)
+
+        Returns out.
+        """
+        ws = self.workspace
+        batch, seqlen, d_model = hidden_states.shape
+        d, n, w, r = self.d_inner, self.d_state, self.d_conv, self.dt_rank
+        K = 2 if self.bimamba else 1
+        L = seqlen
+        rows = batch * seqlen
+
+        xz = ws.get("xz", (batch, L, 2 * d))
+        torch.mm(hidden_states.view(rows, d_model), self.in_proj_weight, out=xz.view(rows, 2 * d))
+        if self.in_proj_bias is not None:
+            xz.add_(self.in_proj_bias)
+        x, z = xz[..., :d], xz[..., d:]
+
+        # Causal depthwise conv over the previous w - 1 inputs and the new ones, one multiply-add per tap:
+        # (K, batch, w - 1 + L, d) -> u (K, batch, L, d)
+        x_pad = ws.get("x_pad", (K, batch, w - 1 + L, d))
+        if self.bimamba:
+            x_pad[:, :, :w - 1].zero_()
+            x_pad[0, :, w - 1:].copy_(x)
+            xz_flip = ws.get("xz_flip", (batch, L, 2 * d))  # index_select would copy a strided x first
+            torch.index_select(xz, 1, self._reversed_index(L), out=xz_flip)
+            x_pad[1, :, w - 1:].copy_(xz_flip[..., :d])
+        else:
+            x_pad[0, :, :w - 1].copy_(conv_state[:, :, -(w - 1):].transpose(1, 2))
+            x_pad[0, :, w - 1:].copy_(x)
+            conv_state.copy_(x_pad[0, :, -w:].transpose(1, 2))
+        u = ws.get("u", (K, batch, L, d))
+        torch.mul(x_pad[:, :, :L], self.conv_weight[0], out=u)
+        for k in range(1, w):
+            u.addcmul_(x_pad[:, :, k:k + L], self.conv_weight[k])
+        if self.conv_bias is not None:
+            u.add_(self.conv_bias)
+        F.silu(u, inplace=True)
+
+        # delta, B, C per direction: (K, batch * L, .)
+        x_dbl = ws.get("x_dbl", (K, rows, r + 2 * n))
+        torch.bmm(u.view(K, rows, d), self.x_proj_weight, out=x_dbl)
+        delta = ws.get("delta", (K, rows, d))
+        torch.bmm(x_dbl[:, :, :r], self.dt_proj_weight, out=delta)
+        delta.add_(self.dt_proj_bias)
+        softplus = ws.get("softplus", (K, rows, d))
+        above = ws.get("above", (K, rows, d), dtype=torch.bool)
+        torch.gt(delta, self.softplus_threshold, out=above)
+        torch.exp(delta, out=softplus)
+        softplus.log1p_()
+        torch.where(above, delta, softplus, out=delta)
+
+        # Time-major scan: (L, batch, K, d, n)
+        def time_major(t, channels):  # (K, batch * L, channels) -> (L, batch, K, channels)
+            return t.view(K, batch, L, channels).permute(2, 1, 0, 3)
+
+        delta_t, u_t = time_major(delta, d), time_major(u, d)
+        B_t, C_t = time_major(x_dbl[:, :, r:r + n], n), time_major(x_dbl[:, :, r + n:], n)
+        deltaA = ws.get("deltaA", (L, batch, K, d, n))
+        torch.mul(delta_t.unsqueeze(-1), self.A, out=deltaA)
+        deltaA.exp_()
+        delta_u = ws.get("delta_u", (L, batch, K, d))
+        torch.mul(delta_t, u_t, out=delta_u)
+        states = ws.get("states", (L, batch, K, d, n))
+        torch.mul(delta_u.unsqueeze(-1), B_t.unsqueeze(3), out=states)
+        if ssm_state is not None:
+            states[0].addcmul_(deltaA[0], ssm_state.view(batch, K, d, n))
+        for t in range(1, L):
+            states[t].addcmul_(deltaA[t], states[t - 1])
+        if ssm_state is not None:
+            ssm_state.view(batch, K, d, n).copy_(states[-1])
+        torch.mul(states, C_t.unsqueeze(3), out=deltaA)
+        y = ws.get("y", (L, batch, K, d))
+        torch.sum(deltaA, dim=-1, out=y)
+        y.addcmul_(u_t, self.D)
+
+        # Backward direction flipped back, gated by silu(z)
+        gate = ws.get("gate", (batch, L, d))
+        torch.sigmoid(z, out=gate)
+        gate.mul_(z)
+        y_out = ws.get("y_out", (L, batch, d))
+        if self.bimamba:
+            torch.index_select(y[:, :, 1], 0, self._reversed_index(L), out=y_out)
+            y_out.add_(y[:, :, 0])
+        else:
+            y_out.copy_(y[:, :, 0])
+        y_gated = ws.get("y_gated", (batch, L, d))
+        torch.mul(y_out.transpose(0, 1), gate, out=y_gated)
+
+        torch.mm(y_gated.view(rows, d), self.out_proj_weight, out=out.view(rows, d_model))
+        if self.out_proj_bias is not None:
+            out.add_(self.out_proj_bias)
+        return out
@@ -0,0 +1,90 @@
+# Copyright (c) 2023, Tri Dao, Albert Gu.
+"""int8 drop-in replacement for nn.Linear, for CPU inference.
+
+The weight is stored as int8 with one fp32 scale per output channel (symmetric). QuantizedLinear runs
+either
+
+- dynamic: the activations are quantized on the fly, per call, and the GEMM runs in int8
+  (torch.ops.quantized.linear_dynamic, fbgemm / onednn / qnnpack);
+- weight-only: the GEMM runs in fp32 on the dequantized weight. Only the checkpoint shrinks.
+
+weight gives the dequantized fp32 weight, computed on each access and not kept (the layer holds no fp32
+weight), so code that reads layer.weight directly (e.g. the fused Mamba ops, which take the raw x_proj /
+dt_proj weights) keeps working, as weight-only. Dynamic quantization falls back to weight-only when no quantized engine is available.
+
+The int8 GEMM takes its weight packed from a torch.qint8 tensor; PyTorch has deprecated the quantized
+tensor types, so the weight is only built as one when it is packed, and dynamic quantization also falls
+back to weight-only on a PyTorch without them.
+"""
+import warnings
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+INT8_MAX = 127
+
+
+def has_dynamic_int8():
+    return (hasattr(torch, "quantize_per_channel")
+            and any(engine != "none" for engine in torch.backends.quantized.supported_engines))
+
+
+def quantize_weight(weight):
+    """Symmetric per-output-channel int8: (qweight int8, scale fp32 (out_features,))."""
+    weight = weight.detach().float()
+    scale = (weight.abs().amax(dim=1) / INT8_MAX).clamp_(min=torch.finfo(torch.float32).tiny)
+    qweight = torch.round(weight / scale[:, None]).clamp_(-INT8_MAX, INT8_MAX).to(torch.int8)
+    return qweight, scale
+
+
+class QuantizedLinear(nn.Module):
+    def __init__(self, in_features, out_features, bias=True, dynamic=True, device=None):
+        super().__init__()
+        self.in_features = in_features
+        self.out_features = out_features
+        self.dynamic = dynamic
+        self.register_buffer("qweight", torch.zeros(out_features, in_features, dtype=torch.int8, device=device))
+        self.register_buffer("weight_scale", torch.ones(out_features, device=device))
+        self.register_buffer("bias", torch.zeros(out_features, device=device) if bias else None)
+        self._packed = None
+
+    @classmethod
+    def from_float(cls, linear, dynamic=True):
+        layer = cls(linear.in_features, linear.out_features, bias=linear.bias is not None, dynamic=dynamic,
+                    device=linear.weight.device)
+        layer.qweight, layer.weight_scale = quantize_weight(linear.weight)
+        if linear.bias is not None:
+            layer.bias = linear.bias.detach().float().clone()
+        return layer
+
+    @property
+    def weight(self):
+        return self.qweight.float() * self.weight_scale[:, None]
+
+    def _load_from_state_dict(self, *args, **kwargs):
+        self._packed = None
+        super()._load_from_state_dict(*args, **kwargs)
+
+    def _packed_weight(self):
+        if self._packed is None:
+            # Requantizing the dequantized weight with its own scales gives back qweight exactly
+            with warnings.catch_warnings():
+                warnings.filterwarnings("ignore", message=".*quantized tensor creation functions.*deprecated")
+                qweight = torch.quantize_per_channel(
+                    self.weight.cpu(), self.weight_scale.cpu().double(),
+                    torch.zeros(self.out_features, dtype=torch.long), 0, torch.qint8,
+                )
+            self._packed = torch.ops.quantized.linear_prepack(qweight, self.bias)
+        return self._packed
+
+    def forward(self, x):
+        if self.dynamic and not x.is_cuda and has_dynamic_int8():
+            out = torch.ops.quantized.linear_dynamic(x.reshape(-1, self.in_features).float(), self._packed_weight())
+            return out.view(*x.shape[:-1], self.out_features).to(x.dtype)
+        weight = self.weight.to(x.dtype)  # dequantized for this call only
+        return F.linear(x, weight, self.bias.to(x.dtype) if self.bias is not None else None)
+
+    def extra_repr(self):
+        return (f"in_features={self.in_features}, out_features={self.out_features}, "
+                f"bias={self.bias is not None}, dynamic={self.dynamic}")
@@ -0,0 +1,143 @@
+# Copyright (c) 2023, Tri Dao, Albert Gu.
+"""Runtime selection between the compiled CUDA kernels and the pure-PyTorch reference ops.
+
+The CUDA extensions (``selective_scan_cuda``, ``causal_conv1d_cuda``) and the Triton norm kernels
+are optional: on CPU-only installs (e.g. ``MAMBA_SKIP_CUDA_BUILD=TRUE``) they are simply missing,
+and CPU tensors can never be fed to them anyway. Every fused entry point asks
+``use_cuda_kernels`` / ``use_triton_kernels`` and falls back to the ``*_ref`` implementation.
+
+The choice can be forced with the ``MAMBA_BACKEND`` environment variable or ``set_backend``:
+    "auto" (default): CUDA kernels for CUDA tensors when available, reference ops otherwise.
+    "ref": always use the reference ops (useful to check the kernels on GPU).
+
+The extensions and Triton are only imported the first time a CUDA tensor asks for them (OptionalModule):
+importing the ops, or running on CPU, does not load them.
+"""
+
+import importlib
+import os
+
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+
+class OptionalModule:
+    """An optional module imported on first use: truthy if it is installed, its attributes are the module's."""
+
+    def __init__(self, name, package=None):
+        self.name = name
+        self.package = package
+        self._module = None
+        self._missing = False
+
+    def load(self):
+        """The module, or None if it is not installed."""
+        if self._module is None and not self._missing:
+            try:
+                self._module = importlib.import_module(self.name, self.package)
+            except ImportError:
+                self._missing = True
+        return self._module
+
+    def __bool__(self):
+        return self.load() is not None
+
+    def __getattr__(self, name):
+        module = self.load()
+        if module is None:
+            raise ImportError(f"{self.name} is not installed")
+        return getattr(module, name)
+
+
+selective_scan_cuda = OptionalModule("selective_scan_cuda")
+causal_conv1d_cuda = OptionalModule("causal_conv1d_cuda")
+triton_layernorm = OptionalModule(".triton.layernorm", __package__)
+
+
+_BACKENDS = ("auto", "ref")
+_backend = os.getenv("MAMBA_BACKEND", "auto")
+assert _backend in _BACKENDS, f"MAMBA_BACKEND must be one of {_BACKENDS}, got {_backend}"
+
+
+def set_backend(backend):
+    global _backend
+    assert backend in _BACKENDS, f"backend must be one of {_BACKENDS}, got {backend}"
+    _backend = backend
+
+
+def get_backend():
+    return _backend
+
+
+def use_cuda_kernels(x, kernel=selective_scan_cuda):
+    """True if x should go through the compiled kernel `kernel` (a CUDA extension module)."""
+    return _backend == "auto" and x.is_cuda and bool(kernel)
+
+
+def use_triton_kernels(x):
+    return _backend == "auto" and x.is_cuda and bool(triton_layernorm)
+
+
+def layer_norm_ref_fn(x, weight, bias, residual=None, eps=1e-6, prenorm=False, residual_in_fp32=False,
+                      is_rms_norm=False):
+    """Same semantics as the fused Triton add + LayerNorm/RMSNorm, written with plain torch ops.
+
+    The residual is accumulated in residual.dtype (or fp32 if residual_in_fp32 and there is
+    no residual yet), the normalization is computed in fp32.
+    """
+    dtype = x.dtype
+    if residual is not None:
+        residual_dtype = residual.dtype
+        x = x.to(residual_dtype) + residual
+    elif residual_in_fp32:
+        x = x.to(torch.float32)
+    residual_out = x
+    x = x.float()
+    if is_rms_norm:
+        out = x * torch.rsqrt(x.square().mean(dim=-1, keepdim=True) + eps) * weight.float()
+        if bias is not None:
+            out = out + bias.float()
+    else:
+        out = F.layer_norm(x, x.shape[-1:], weight=weight.float(),
+                           bias=bias.float() if bias is not None else None, eps=eps)
+    out = out.to(dtype)
+    return out if not prenorm else (out, residual_out)
+
+
+def layer_norm_fn(x, weight, bias, residual=None, eps=1e-6, prenorm=False, residual_in_fp32=False,
+                  is_rms_norm=False):
+    if use_triton_kernels(x):
+        return triton_layernorm.layer_norm_fn(x, weight, bias, residual, eps, prenorm, residual_in_fp32,
+                                              is_rms_norm)
+    return layer_norm_ref_fn(x, weight, bias, residual, eps, prenorm, residual_in_fp32, is_rms_norm)
+
+
+def rms_norm_fn(x, weight, bias, residual=None, prenorm=False, residual_in_fp32=False, eps=1e-6):
+    return layer_norm_fn(x, weight, bias, residual, eps, prenorm, residual_in_fp32, True)
+
+
+class RMSNorm(nn.Module):
+    """Drop-in for ops.triton.layernorm.RMSNorm that also runs without Triton / on CPU."""
+
+    def __init__(self, hidden_size, eps=1e-5, device=None, dtype=None):
+        factory_kwargs = {"device": device, "dtype": dtype}
+        super().__init__()
+        self.eps = eps
+        self.weight = nn.Parameter(torch.empty(hidden_size, **factory_kwargs))
+        self.register_parameter("bias", None)
+        self.reset_parameters()
+
+    def reset_parameters(self):
+        nn.init.ones_(self.weight)
+
+    def forward(self, x, residual=None, prenorm=False, residual_in_fp32=False):
+        return rms_norm_fn(
+            x,
+            self.weight,
+            self.bias,
+            residual=residual,
+            eps=self.eps,
+            prenorm=prenorm,
+            residual_in_fp32=residual_in_fp32,
+        )
@@ -1,4 +1,5 @@
 # Copyright (c) 2023, Tri Dao, Albert Gu.
+from typing import Optional, Tuple
 
 import torch
 import torch.nn.functional as F
@@ -7,9 +8,9 @@ from torch.cuda.amp import custom_bwd, custom_fwd
 from einops import rearrange, repeat
 
 from causal_conv1d import causal_conv1d_fn
-from causal_conv1d.causal_conv1d_interface import causal_conv1d_update_ref
-import causal_conv1d_cuda
-import selective_scan_cuda
+from causal_conv1d.causal_conv1d_interface import causal_conv1d_ref, causal_conv1d_update_ref
+
+from .backend import causal_conv1d_cuda, selective_scan_cuda, use_cuda_kernels
 
 
 class SelectiveScanFn(torch.autograd.Function):
@@ -91,12 +92,295 @@ def selective_scan_fn(u, delta, A, B, C, D=None, z=None, delta_bias=None, delta_
     last_state has shape (batch, dim, dstate). Note that the gradient of the last state and prev_state (if provided) is
     not considered in the backward pass.
     """
+    if not use_cuda_kernels(u):
+        return selective_scan_recompute_fn(u, delta, A, B, C, D, z, delta_bias, delta_softplus, return_last_state,
+                                           prev_state)
     return SelectiveScanFn.apply(u, delta, A, B, C, D, z, delta_bias, delta_softplus, return_last_state, prev_state)
 
 
+def _scan_chunk_size(batch, dim, dstate, itemsize=4, budget=1 << 22):
+    """Chunk length such that the per-chunk deltaA / deltaB_u / state workspaces stay cache-sized.
+
+    Power of two in [8, 256]; the scan is memory-bound on CPU, so keeping the chunk in cache matters
+    more than the number of Python-level steps.
+    """
+    chunk_size = 256
+    while chunk_size > 8 and 3 * chunk_size * batch * dim * dstate * itemsize > budget:
+        chunk_size //= 2
+    return chunk_size
+
+
+def _scan_inputs_ref(u, delta, A, B, C, delta_bias=None, delta_softplus=False):
+    """fp32 u / delta (bias and softplus applied) and B / C, as complex tensors if A is complex."""
+    u = u.float()
+    delta = delta.float()
+    if delta_bias is not None:
+        delta = delta + delta_bias[..., None].float()
+    if delta_softplus:
+        delta = F.softplus(delta)
+    if A.is_complex():
+        if B.dim() >= 3:
+            B = torch.view_as_complex(rearrange(B.float(), "... (L two) -> ... L two", two=2))
+        if C.dim() >= 3:
+            C = torch.view_as_complex(rearrange(C.float(), "... (L two) -> ... L two", two=2))
+    else:
+        B = B.float()
+        C = C.float()
+    return u, delta, B, C
+
+
+def _scan_chunk_ref(x, u, delta, A, B, C):
+    """Runs the recurrence over one chunk starting from state x.
+
+    u, delta: (batch, dim, l); B, C: (dim, dstate) or the (..., l) slices of the variable B / C.
+    Returns y (batch, dim, l), before D and z, and the state after the last step.
+    """
+    delta = rearrange(delta, "b d l -> l b d 1")
+    deltaA = torch.exp(delta * A)  # (l b d n)
+    deltaB_u = delta * rearrange(u, "b d l -> l b d 1")
+    if B.dim() == 2:
+        deltaB_u = deltaB_u * B
+    elif B.dim() == 3:
+        deltaB_u = deltaB_u * rearrange(B, "b n l -> l b 1 n")
+    else:
+        deltaB_u = deltaB_u.unflatten(2, (B.shape[1], -1)) * rearrange(B, "b g n l -> l b g 1 n")
+        deltaB_u = deltaB_u.flatten(2, 3)
+    states = []
+    for i in range(u.shape[2]):
+        x = torch.addcmul(deltaB_u[i], deltaA[i], x)
+        states.append(x)
+    states = torch.stack(states)  # (l b d n)
+    # Contracted with an elementwise product and a reduction over dstate rather than an einsum: the
+    # matmul kernels it lowers to change with the batch size and chunk length, this does not, so
+    # splitting a batch or a sequence into several calls gives bit-identical outputs
+    if C.dim() == 2:
+        y = (states * C).sum(-1)
+    elif C.dim() == 3:
+        y = (states * rearrange(C, "b n l -> l b 1 n")).sum(-1)
+    else:
+        y = (states.unflatten(2, (C.shape[1], -1)) * rearrange(C, "b g n l -> l b g 1 n")).sum(-1).flatten(2)
+    y = rearrange(y, "l b d -> b d l")
+    if y.is_complex():
+        y = y.real * 2
+    return y, x
+
+
+def _chunk_slice(B, start, end):
+    return B if B.dim() == 2 else B[..., start:end]
+
+
+def _scan_chunks_ref(u, delta, A, B, C, prev_state=None, chunk_size=None):
+    """Runs _scan_chunk_ref over the sequence, chunk after chunk, carrying the state.
+
+    Takes the inputs prepared by _scan_inputs_ref. Returns y (before D and z), the last state and the
+    list of the states at the start of every chunk.
+    """
+    batch, dim, dstate = u.shape[0], A.shape[0], A.shape[1]
+    seqlen = u.shape[2]
+    if chunk_size is None:
+        chunk_size = _scan_chunk_size(batch, dim, dstate, itemsize=8 if A.is_complex() else 4)
+    x = A.new_zeros((batch, dim, dstate)) if prev_state is None else prev_state
+    boundary_states, ys = [], []
+    for start in range(0, seqlen, chunk_size):
+        end = min(start + chunk_size, seqlen)
+        boundary_states.append(x)
+        y, x = _scan_chunk_ref(x, u[:, :, start:end], delta[:, :, start:end], A,
+                               _chunk_slice(B, start, end), _chunk_slice(C, start, end))
+        ys.append(y)
+    return torch.cat(ys, dim=2), x, boundary_states
+
+
 def selective_scan_ref(u, delta, A, B, C, D=None, z=None, delta_bias=None, delta_softplus=False,
-                      return_last_state=False, prev_state=None):
+                      return_last_state=False, prev_state=None, chunk_size=None):
     """
+    u: r(B D L)
+    delta: r(B D L)
+    A: c(D N) or r(D N)
+    B: c(D N) or r(B N L) or r(B N 2L) or r(B G N L) or (B G N L)
+    C: c(D N) or r(B N L) or r(B N 2L) or r(B G N L) or (B G N L)
+    D: r(D)
+    z: r(B D L)
+    delta_bias: r(D), fp32
+    prev_state: r(B D N), fp32
+    chunk_size: number of timesteps discretized at once, picked from the problem size if None
+
+    out: r(B D L)
+    last_state (optional): r(B D dstate) or c(B D dstate)
+
+    Chunked version of selective_scan_sequential_ref with the same recurrence: deltaA / deltaB_u are
+    only built for one chunk at a time (memory is O(chunk_size) instead of O(L)), laid out time-major
+    so that every step of the recurrence reads and writes contiguous (B D N) slices. Within a chunk the
+    timesteps are still a Python loop (one addcmul each); the chunk's states are then multiplied by C
+    elementwise and summed over dstate in one go, and the state is carried over to the next chunk.
+    """
+    dtype_in = u.dtype
+    u, delta, B, C = _scan_inputs_ref(u, delta, A, B, C, delta_bias, delta_softplus)
+    y, last_state, _ = _scan_chunks_ref(u, delta, A, B, C, prev_state, chunk_size)  # y: (batch dim L)
+    out = y if D is None else y + u * rearrange(D, "d -> d 1")
+    if z is not None:
+        # z is usually a strided half of xz: made contiguous, every element goes through the vectorized
+        # silu (rows of a strided view end in scalar tails), whatever the sequence length
+        out = out * F.silu(z.contiguous())
+    out = out.to(dtype=dtype_in)
+    return out if not return_last_state else (out, last_state)
+
+
+class SelectiveScanRecomputeFn(torch.autograd.Function):
+    """Chunked reference scan that only keeps the states at chunk boundaries for backward.
+
+    Autograd through selective_scan_ref saves deltaA, deltaB_u and every intermediate state, i.e.
+    O(B D L N) activations. Here forward saves the inputs and L / chunk_size states; backward walks
+    the chunks in reverse, recomputes each one from its boundary state and backpropagates through
+    it, carrying the state gradient to the previous chunk.
+    Takes the inputs already prepared by _scan_inputs_ref, returns y (before D and z) and last_state.
+    """
+
+    @staticmethod
+    def forward(ctx, u, delta, A, B, C, prev_state=None, chunk_size=None):
+        if chunk_size is None:
+            chunk_size = _scan_chunk_size(u.shape[0], A.shape[0], A.shape[1], itemsize=8 if A.is_complex() else 4)
+        y, x, boundary_states = _scan_chunks_ref(u, delta, A, B, C, prev_state, chunk_size)
+        ctx.save_for_backward(u, delta, A, B, C, torch.stack(boundary_states))
+        ctx.chunk_size = chunk_size
+        ctx.has_prev_state = prev_state is not None
+        return y, x
+
+    @staticmethod
+    def backward(ctx, dout, dlast_state):
+        u, delta, A, B, C, boundary_states = ctx.saved_tensors
+        du, ddelta, dA, dB, dC, dx = _scan_chunks_backward_ref(
+            dout, dlast_state, u, delta, A, B, C, boundary_states, ctx.chunk_size
+        )
+        return du, ddelta, dA, dB, dC, dx if ctx.has_prev_state else None, None
+
+
+def _scan_chunks_backward_ref(dout, dlast_state, u, delta, A, B, C, boundary_states, chunk_size):
+    """Backward of _scan_chunks_ref from its chunk boundary states, see SelectiveScanRecomputeFn.
+
+    Returns du, ddelta, dA, dB, dC and the gradient of the initial state.
+    """
+    seqlen = u.shape[2]
+    du, ddelta = torch.zeros_like(u), torch.zeros_like(delta)
+    dA = torch.zeros_like(A)
+    dB, dC = torch.zeros_like(B), torch.zeros_like(C)
+    dx = dlast_state
+    for chunk_idx in reversed(range(boundary_states.shape[0])):
+        start = chunk_idx * chunk_size
+        end = min(start + chunk_size, seqlen)
+        # torch.func.vjp rather than torch.autograd.grad: it also works inside the custom op below,
+        # which runs under the autograd dispatch key
+        _, chunk_vjp = torch.func.vjp(
+            _scan_chunk_ref, boundary_states[chunk_idx], u[:, :, start:end], delta[:, :, start:end], A,
+            _chunk_slice(B, start, end), _chunk_slice(C, start, end),
+        )
+        dx, du_c, ddelta_c, dA_c, dB_c, dC_c = chunk_vjp((dout[:, :, start:end], dx))
+        du[:, :, start:end] = du_c
+        ddelta[:, :, start:end] = ddelta_c
+        dA += dA_c
+        if B.dim() == 2:
+            dB += dB_c
+        else:
+            dB[..., start:end] = dB_c
+        if C.dim() == 2:
+            dC += dC_c
+        else:
+            dC[..., start:end] = dC_c
+    return du, ddelta, dA, dB, dC, dx
+
+
+def _has_op(name):
+    try:
+        getattr(torch.ops.mamba_ssm, name)
+        return True
+    except (AttributeError, RuntimeError):
+        return False
+
+
+# The chunked scan as a torch.library custom op, with the recompute backward: torch.compile sees it as
+# one opaque node instead of unrolling the recurrence (and breaking the graph on the autograd.Function).
+# Registered once per process, even if this file is imported under several module names.
+if hasattr(torch.library, "custom_op") and not _has_op("selective_scan_chunks"):
+
+    @torch.library.custom_op("mamba_ssm::selective_scan_chunks", mutates_args=())
+    def _selective_scan_chunks_op(
+        u: torch.Tensor, delta: torch.Tensor, A: torch.Tensor, B: torch.Tensor, C: torch.Tensor,
+        prev_state: Optional[torch.Tensor], chunk_size: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor]:
+        y, last_state, boundary_states = _scan_chunks_ref(u, delta, A, B, C, prev_state, chunk_size)
+        # Contiguous, as the fake kernel declares them (inductor checks the strides)
+        return y.contiguous(), last_state.contiguous(), torch.stack(boundary_states)
+
+    @_selective_scan_chunks_op.register_fake
+    def _(u, delta, A, B, C, prev_state, chunk_size):
+        batch, dim, seqlen = u.shape
+        num_chunks = (seqlen + chunk_size - 1) // chunk_size
+        return (u.new_empty(batch, dim, seqlen), A.new_empty(batch, dim, A.shape[1]),
+                A.new_empty(num_chunks, batch, dim, A.shape[1]))
+
+    @torch.library.custom_op("mamba_ssm::selective_scan_chunks_backward", mutates_args=())
+    def _selective_scan_chunks_backward_op(
+        dout: torch.Tensor, dlast_state: torch.Tensor, u: torch.Tensor, delta: torch.Tensor, A: torch.Tensor,
+        B: torch.Tensor, C: torch.Tensor, boundary_states: torch.Tensor, chunk_size: int,
+    ) -> Tuple[torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor, torch.Tensor]:
+        grads = _scan_chunks_backward_ref(dout, dlast_state, u, delta, A, B, C, boundary_states, chunk_size)
+        # Custom ops may not return their inputs (dx is dlast_state for an empty sequence); contiguous, as the
+        # fake kernel declares them
+        return tuple(grad.clone(memory_format=torch.contiguous_format) if grad is dlast_state else grad.contiguous()
+                     for grad in grads)
+
+    @_selective_scan_chunks_backward_op.register_fake
+    def _(dout, dlast_state, u, delta, A, B, C, boundary_states, chunk_size):
+        return tuple(x.new_empty(x.shape) for x in (u, delta, A, B, C, boundary_states[0]))
+
+    def _selective_scan_chunks_setup_context(ctx, inputs, output):
+        u, delta, A, B, C, prev_state, chunk_size = inputs
+        ctx.save_for_backward(u, delta, A, B, C, output[2])
+        ctx.chunk_size = chunk_size
+        ctx.has_prev_state = prev_state is not None
+
+    def _selective_scan_chunks_backward(ctx, dout, dlast_state, dboundary_states):
+        u, delta, A, B, C, boundary_states = ctx.saved_tensors
+        du, ddelta, dA, dB, dC, dx = torch.ops.mamba_ssm.selective_scan_chunks_backward(
+            dout, dlast_state, u, delta, A, B, C, boundary_states, ctx.chunk_size
+        )
+        return du, ddelta, dA, dB, dC, dx if ctx.has_prev_state else None, None
+
+    _selective_scan_chunks_op.register_autograd(
+        _selective_scan_chunks_backward, setup_context=_selective_scan_chunks_setup_context
+    )
+
+has_selective_scan_op = _has_op("selective_scan_chunks")
+
+
+def selective_scan_recompute_fn(u, delta, A, B, C, D=None, z=None, delta_bias=None, delta_softplus=False,
+                                return_last_state=False, prev_state=None, chunk_size=None):
+    """Same arguments and results as selective_scan_ref, with chunk-boundary recomputation in backward
+    (see SelectiveScanRecomputeFn). Used by the CPU backend, where it bounds training memory.
+    Without autograd, the chunks run as plain tensor ops (no autograd.Function), so that the scan can
+    be traced by torch.jit.trace and exported to ONNX. Under torch.compile, the scan is the opaque
+    mamba_ssm::selective_scan_chunks op.
+    """
+    dtype_in = u.dtype
+    u, delta, B, C = _scan_inputs_ref(u, delta, A, B, C, delta_bias, delta_softplus)
+    if has_selective_scan_op and torch.compiler.is_compiling():
+        if chunk_size is None:
+            chunk_size = _scan_chunk_size(u.shape[0], A.shape[0], A.shape[1], itemsize=8 if A.is_complex() else 4)
+        y, last_state, _ = torch.ops.mamba_ssm.selective_scan_chunks(u, delta, A, B, C, prev_state, chunk_size)
+    elif torch.is_grad_enabled() and any(t is not None and t.requires_grad for t in (u, delta, A, B, C, prev_state)):
+        y, last_state = SelectiveScanRecomputeFn.apply(u, delta, A, B, C, prev_state, chunk_size)
+    else:
+        y, last_state, _ = _scan_chunks_ref(u, delta, A, B, C, prev_state, chunk_size)
+    out = y if D is None else y + u * rearrange(D, "d -> d 1")
+    if z is not None:
+        out = out * F.silu(z.contiguous())
+    out = out.to(dtype=dtype_in)
+    return out if not return_last_state else (out, last_state)
+
+
+def selective_scan_sequential_ref(u, delta, A, B, C, D=None, z=None, delta_bias=None, delta_softplus=False,
+                                  return_last_state=False, prev_state=None):
+    """Original per-timestep loop, kept as the baseline for selective_scan_ref.
+
     u: r(B D L)
     delta: r(B D L)
     A: c(D N) or r(D N)
@@ -635,6 +919,11 @@ def mamba_inner_fn(
     C_proj_bias=None, delta_softplus=True
     , ssm_state=None, conv_state=None, return_last_state=False
 ):
+    if not use_cuda_kernels(xz):
+        return mamba_inner_ref(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+                               out_proj_weight, out_proj_bias,
+                               A, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus,
+                               ssm_state, conv_state, return_last_state)
     return MambaInnerFn.apply(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
                               out_proj_weight, out_proj_bias,
                               A, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus,
@@ -646,6 +935,10 @@ def bimamba_inner_fn(
     A, A_b, B=None, C=None, D=None, delta_bias=None, B_proj_bias=None,
     C_proj_bias=None, delta_softplus=True
 ):
+    if not use_cuda_kernels(xz):
+        return bimamba_inner_ref(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+                                 out_proj_weight, out_proj_bias,
+                                 A, A_b, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus)
     return BiMambaInnerFn.apply(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
                               out_proj_weight, out_proj_bias,
                               A, A_b, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus)
@@ -656,21 +949,24 @@ def mamba_inner_fn_no_out_proj(
     A, B=None, C=None, D=None, delta_bias=None, B_proj_bias=None,
     C_proj_bias=None, delta_softplus=True, ssm_state=None, conv_state=None, return_last_state=False
 ):
+    """ssm_state, conv_state and return_last_state are as in mamba_inner_fn (used by layers whose out_proj
+    runs separately, e.g. int8). The fused CUDA kernel does not carry state, so a call with states runs the
+    reference ops, on any device (the recurrent steps of a quantized temporal layer).
+    """
+    if not use_cuda_kernels(xz) or return_last_state:
+        return mamba_inner_no_out_proj_ref(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+                                           A, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus,
+                                           ssm_state, conv_state, return_last_state)
     return MambaInnerFnNoOutProj.apply(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
                               A, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus)
 
-def mamba_inner_ref(
-    xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
-    out_proj_weight, out_proj_bias,
-    A, B=None, C=None, D=None, delta_bias=None, B_proj_bias=None,
-    C_proj_bias=None, delta_softplus=True
-):
-    assert causal_conv1d_fn is not None, "causal_conv1d_fn is not available. Please install causal-conv1d."
-    L = xz.shape[-1]
+
+def _ssm_params_ref(x, x_proj_weight, delta_proj_weight, A, B=None, C=None, B_proj_bias=None,
+                    C_proj_bias=None):
+    """x: (batch, dim, seqlen), the conv1d output. Returns delta (batch, dim, seqlen) and B, C."""
+    L = x.shape[-1]
     delta_rank = delta_proj_weight.shape[1]
     d_state = A.shape[-1] * (1 if not A.is_complex() else 2)
-    x, z = xz.chunk(2, dim=1)
-    x = causal_conv1d_fn(x, rearrange(conv1d_weight, "d 1 w -> d w"), conv1d_bias, activation="silu")
     # We're being very careful here about the layout, to avoid extra transposes.
     # We want delta to have d as the slowest moving dimension
     # and L as the fastest moving dimension, since those are what the ssm_scan kernel expects.
@@ -693,5 +989,67 @@ def mamba_inner_ref(
             C = rearrange(C, "(b l) dstate -> b dstate l", l=L).contiguous()
         else:
             C = rearrange(C, "(b l) (dstate two) -> b dstate (l two)", l=L, two=2).contiguous()
-    y = selective_scan_fn(x, delta, A, B, C, D, z=z, delta_bias=delta_bias, delta_softplus=True)
-    return F.linear(rearrange(y, "b d l -> b l d"), out_proj_weight, out_proj_bias)
\ No newline at end of file
+    return delta, B, C
+
+
+def mamba_inner_no_out_proj_ref(
+    xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+    A, B=None, C=None, D=None, delta_bias=None, B_proj_bias=None,
+    C_proj_bias=None, delta_softplus=True, ssm_state=None, conv_state=None, return_last_state=False
+):
+    """Pure-PyTorch version of MambaInnerFnNoOutProj, also used as the CPU backend.
+
+    xz: (batch, 2 * dim, seqlen)
+    return_last_state=True needs ssm_state (batch, dim, dstate) and conv_state (batch, dim, width)
+    holding the previous states; conv_state is updated inplace.
+
+    out: (batch, dim, seqlen), or (out, last_state, conv_state) if return_last_state
+    """
+    x, z = xz.chunk(2, dim=1)
+    conv1d_weight = rearrange(conv1d_weight, "d 1 w -> d w")
+    if return_last_state:
+        x, conv_state = causal_conv1d_update_ref(x, conv_state, conv1d_weight, conv1d_bias, activation="silu")
+    else:
+        x = causal_conv1d_ref(x, conv1d_weight, conv1d_bias, activation="silu")
+    delta, B, C = _ssm_params_ref(x, x_proj_weight, delta_proj_weight, A, B, C, B_proj_bias, C_proj_bias)
+    if not return_last_state:
+        return selective_scan_recompute_fn(x, delta, A, B, C, D, z=z, delta_bias=delta_bias,
+                                           delta_softplus=delta_softplus)
+    y, last_state = selective_scan_recompute_fn(x, delta, A, B, C, D, z=z, delta_bias=delta_bias,
+                                                delta_softplus=delta_softplus, return_last_state=True,
+                                                prev_state=ssm_state)
+    return y, last_state.detach(), conv_state.detach()
+
+
+def mamba_inner_ref(
+    xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+    out_proj_weight, out_proj_bias,
+    A, B=None, C=None, D=None, delta_bias=None, B_proj_bias=None,
+    C_proj_bias=None, delta_softplus=True, ssm_state=None, conv_state=None, return_last_state=False
+):
+    y = mamba_inner_no_out_proj_ref(xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+                                    A, B, C, D, delta_bias, B_proj_bias, C_proj_bias, delta_softplus,
+                                    ssm_state, conv_state, return_last_state)
+    if return_last_state:
+        y, last_state, conv_state = y
+    out = F.linear(rearrange(y, "b d l -> b l d"), out_proj_weight, out_proj_bias)
+    return out if not return_last_state else (out, last_state, conv_state)
+
+
+def bimamba_inner_ref(
+    xz, conv1d_weight, conv1d_bias, x_proj_weight, delta_proj_weight,
+    out_proj_weight, out_proj_bias,
+    A, A_b, B=None, C=None, D=None, delta_bias=None, B_proj_bias=None,
+    C_proj_bias=None, delta_softplus=True
+):
+    # Same as BiMambaInnerFn: the backward scan runs on the flipped conv1d output and projections.
+    x, z = xz.chunk(2, dim=1)
+    x = causal_conv1d_ref(x, rearrange(conv1d_weight, "d 1 w -> d w"), conv1d_bias, activation="silu")
+    delta, B, C = _ssm_params_ref(x, x_proj_weight, delta_proj_weight, A, B, C, B_proj_bias, C_proj_bias)
+    y_f = selective_scan_recompute_fn(x, delta, A, B, C, D, z=z, delta_bias=delta_bias,
+                                      delta_softplus=delta_softplus)
+    B_b = B.flip([-1]) if B.dim() >= 3 else B
+    C_b = C.flip([-1]) if C.dim() >= 3 else C
+    y_b = selective_scan_recompute_fn(x.flip([-1]), delta.flip([-1]), A_b, B_b, C_b, D,
+                                      z=z.flip([-1]), delta_bias=delta_bias, delta_softplus=delta_softplus)
+    return F.linear(rearrange(y_f + y_b.flip([-1]), "b d l -> b l d"), out_proj_weight, out_proj_bias)
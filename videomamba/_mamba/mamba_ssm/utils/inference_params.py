@@ -0,0 +1,35 @@
+# Copyright (c) 2023, Albert Gu, Tri Dao.
+"""InferenceParams, the recurrent cache passed to the layers.
+
+This module imports nothing (not even torch) so that a streaming worker can build its cache without the
+generation utilities of utils/generation.py (transformers), which re-exports it.
+"""
+from dataclasses import dataclass, field
+from typing import Optional
+
+
+@dataclass
+class InferenceParams:
+    """Inference parameters that are passed to the main model in order
+    to efficienly calculate and store the context during inference."""
+
+    max_seqlen: int
+    max_batch_size: int
+    seqlen_offset: int = 0
+    batch_size_offset: int = 0
+    key_value_memory_dict: dict = field(default_factory=dict)
+    lengths_per_sample: Optional["torch.Tensor"] = None
+    # Storage dtype of the recurrent states of the causal layers between calls (see utils/state_cache.py);
+    # None keeps them in the layer dtype
+    state_dtype: Optional["torch.dtype"] = None
+    # The conv states of the causal layers are circular buffers written at seqlen_offset, which then counts
+    # the tokens seen by the layers: single tokens update them in place instead of shifting them (see
+    # Mamba.step). Fixed when the states are allocated: the two layouts cannot be mixed
+    conv_state_ring: bool = False
+
+    def reset(self, max_seqlen, max_batch_size):
+        self.max_seqlen = max_seqlen
+        self.max_batch_size = max_batch_size
+        self.seqlen_offset = 0
+        if self.lengths_per_sample is not None:
+            self.lengths_per_sample.zero_()
@@ -0,0 +1,111 @@
+# Copyright (c) 2023, Albert Gu, Tri Dao.
+"""Batch-row operations on the recurrent states held by an InferenceParams.
+
+inference_params.key_value_memory_dict maps layer_idx -> tuple of state tensors (conv_state, ssm_state,
+...) whose first dim is the batch. Each batch row is one stream, so these operations let a caller
+reset, checkpoint, move, duplicate or drop streams without touching the layers.
+"""
+import io
+
+import torch
+
+
+class InferenceStateManager:
+    def __init__(self, inference_params):
+        self.inference_params = inference_params
+
+    @property
+    def states(self):
+        return self.inference_params.key_value_memory_dict
+
+    @property
+    def batch_size(self):
+        for layer_states in self.states.values():
+            return layer_states[0].shape[0]
+        return self.inference_params.max_batch_size
+
+    def _index(self, rows, device):
+        return torch.as_tensor(rows, dtype=torch.long, device=device).reshape(-1)
+
+    def reset(self, rows):
+        """Zeroes the states (and lengths_per_sample, if used) of the given batch rows."""
+        for layer_states in self.states.values():
+            for state in layer_states:
+                state.index_fill_(0, self._index(rows, state.device), 0)
+        lengths = self.inference_params.lengths_per_sample
+        if lengths is not None:
+            lengths.index_fill_(0, self._index(rows, lengths.device), 0)
+
+    def snapshot(self, rows):
+        """Serializes the states of the given rows, in that order, to bytes."""
+        states = {
+            layer_idx: [state.index_select(0, self._index(rows, state.device)).cpu() for state in layer_states]
+            for layer_idx, layer_states in self.states.items()
+        }
+        lengths = self.inference_params.lengths_per_sample
+        blob = {
+            "states": states,
+            "seqlen_offset": self.inference_params.seqlen_offset,
+            "conv_state_ring": self.inference_params.conv_state_ring,
+            "lengths_per_sample": (lengths.index_select(0, self._index(rows, lengths.device)).cpu()
+                                   if lengths is not None else None),
+        }
+        buffer = io.BytesIO()
+        torch.save(blob, buffer)
+        return buffer.getvalue()
+
+    def restore(self, blob, rows):
+        """Writes the rows saved by snapshot into the given rows of this batch.
+
+        Layers without states yet are allocated with max_batch_size rows, zero except for the restored ones.
+        The restored rows keep the positions they were saved at, in lengths_per_sample (created from the
+        batch's seqlen_offset if not used yet): seqlen_offset, shared by the other rows, is left as it is.
+        Circular conv states (InferenceParams.conv_state_ring) are written at seqlen_offset, so they can only
+        be restored into a batch of that layout at the seqlen_offset they were saved at.
+        """
+        blob = torch.load(io.BytesIO(blob), map_location="cpu", weights_only=True)
+        conv_state_ring = blob.get("conv_state_ring", False)
+        if conv_state_ring != self.inference_params.conv_state_ring:
+            raise ValueError(f"Cannot restore {'circular' if conv_state_ring else 'linear'} conv states into a batch "
+                             f"with {'circular' if self.inference_params.conv_state_ring else 'linear'} conv states")
+        if conv_state_ring and blob["seqlen_offset"] != self.inference_params.seqlen_offset:
+            raise ValueError(f"Circular conv states saved at seqlen_offset {blob['seqlen_offset']} cannot be "
+                             f"restored at seqlen_offset {self.inference_params.seqlen_offset}")
+        batch_size = self.batch_size
+        device = None
+        for layer_idx, saved_states in blob["states"].items():
+            if layer_idx not in self.states:
+                self.states[layer_idx] = tuple(
+                    saved.new_zeros((batch_size,) + saved.shape[1:]) for saved in saved_states
+                )
+            for state, saved in zip(self.states[layer_idx], saved_states):
+                state.index_copy_(0, self._index(rows, state.device), saved.to(device=state.device, dtype=state.dtype))
+                device = state.device
+        saved_lengths = blob["lengths_per_sample"]
+        if saved_lengths is None:
+            saved_lengths = torch.full((len(self._index(rows, "cpu")),), blob["seqlen_offset"], dtype=torch.long)
+        if self.inference_params.lengths_per_sample is None:
+            self.inference_params.lengths_per_sample = torch.full(
+                (batch_size,), self.inference_params.seqlen_offset, dtype=torch.long, device=device
+            )
+        lengths = self.inference_params.lengths_per_sample
+        lengths.index_copy_(0, self._index(rows, lengths.device), saved_lengths.to(lengths.device))
+
+    def select(self, rows):
+        """Rebuilds the batch from the given rows, in that order (rows may repeat)."""
+        for layer_idx, layer_states in self.states.items():
+            self.states[layer_idx] = tuple(state.index_select(0, self._index(rows, state.device)) for state in layer_states)
+        lengths = self.inference_params.lengths_per_sample
+        if lengths is not None:
+            self.inference_params.lengths_per_sample = lengths.index_select(0, self._index(rows, lengths.device))
+        self.inference_params.max_batch_size = len(rows)
+
+    def fork(self, row, num_copies):
+        """Appends num_copies copies of a row to the batch. Returns the indices of the copies."""
+        batch_size = self.batch_size
+        self.select(list(range(batch_size)) + [row] * num_copies)
+        return list(range(batch_size, batch_size + num_copies))
+
+    def compact(self, keep_rows):
+        """Drops every row not in keep_rows; the kept rows are renumbered 0..len(keep_rows)-1 in that order."""
+        self.select(list(keep_rows))
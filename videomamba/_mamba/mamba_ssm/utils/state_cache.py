@@ -0,0 +1,66 @@
+# Copyright (c) 2023, Albert Gu, Tri Dao.
+"""Reduced-precision storage of the recurrent states (conv_state, ssm_state) between calls.
+
+The states are stored in a lower precision dtype and only expanded to the compute dtype (fp32) for the
+update, then rounded back into the storage:
+
+- torch.bfloat16 / torch.float16: a plain cast, 2x smaller than fp32.
+- torch.int8: symmetric per-channel quantization, one fp32 scale per (batch row, channel), i.e. per row
+  of the last dim. About 3.5x smaller than fp32 for d_state=16, d_conv=4.
+
+Stored states are a tuple of batch-first tensors, so that InferenceStateManager can reset, snapshot
+and move streams without knowing about the storage: (conv_state, ssm_state) for a float dtype, and
+(conv_state, ssm_state, conv_scale, ssm_scale) for int8, with the scales of shape (batch, d_inner, 1).
+"""
+import torch
+
+STATE_DTYPES = {
+    "fp32": torch.float32,
+    "bf16": torch.bfloat16,
+    "fp16": torch.float16,
+    "int8": torch.int8,
+}
+
+INT8_MAX = 127
+
+
+def is_quantized(stored_states):
+    return stored_states[0].dtype == torch.int8
+
+
+def allocate_states(shapes, dtype, device=None):
+    """Zero stored states of the given shapes (e.g. conv_state, ssm_state)."""
+    states = tuple(torch.zeros(shape, dtype=dtype, device=device) for shape in shapes)
+    if dtype != torch.int8:
+        return states
+    return states + tuple(torch.zeros(shape[:-1] + (1,), dtype=torch.float32, device=device) for shape in shapes)
+
+
+def load_states(stored_states, dtype=torch.float32):
+    """The states expanded to dtype, as new tensors."""
+    if not is_quantized(stored_states):
+        return tuple(state.to(dtype=dtype, copy=True) for state in stored_states)
+    num_states = len(stored_states) // 2
+    return tuple(
+        (state.to(dtype=dtype) * scale).to(dtype=dtype)
+        for state, scale in zip(stored_states[:num_states], stored_states[num_states:])
+    )
+
+
+def store_states_(stored_states, states):
+    """Rounds the states into the stored tensors, inplace (recomputing the int8 scales)."""
+    if not is_quantized(stored_states):
+        for stored, state in zip(stored_states, states):
+            stored.copy_(state)
+        return stored_states
+    num_states = len(stored_states) // 2
+    for stored, scale, state in zip(stored_states[:num_states], stored_states[num_states:], states):
+        state = state.float()
+        torch.amax(state.abs(), dim=-1, keepdim=True, out=scale)
+        scale.div_(INT8_MAX).clamp_(min=torch.finfo(torch.float32).tiny)
+        stored.copy_(torch.round(state / scale).clamp_(-INT8_MAX, INT8_MAX))
+    return stored_states
+
+
+def state_nbytes(stored_states):
+    return sum(state.numel() * state.element_size() for state in stored_states)
@@ -0,0 +1,66 @@
+# Copyright (c) 2023, Albert Gu, Tri Dao.
+"""Preallocated buffers for static-shape inference, and a counter of the tensor allocations of a step.
+
+A static-shape runner asks its Workspace for every intermediate buffer by name and shape; the first
+call allocates, later calls with the same shape return the same tensor. Once warmed up, a step should
+not allocate at all, which AllocationCounter checks by counting the allocator events of the profiler:
+
+    with AllocationCounter() as counter:
+        runner.step(frame)
+    assert counter.count == 0
+"""
+import torch
+from torch.profiler import ProfilerActivity, profile
+
+
+class Workspace:
+    def __init__(self, device=None):
+        self.device = device
+        self.buffers = {}
+        # Number of buffers allocated so far; constant once every shape has been seen
+        self.num_allocations = 0
+
+    def get(self, name, shape, dtype=torch.float32):
+        """Buffer `name` of the given shape and dtype, allocated on first use. Its content is undefined."""
+        key = (name, tuple(shape), dtype)
+        buffer = self.buffers.get(key)
+        if buffer is None:
+            buffer = torch.empty(shape, dtype=dtype, device=self.device)
+            self.buffers[key] = buffer
+            self.num_allocations += 1
+        return buffer
+
+    @property
+    def nbytes(self):
+        return sum(buffer.numel() * buffer.element_size() for buffer in self.buffers.values())
+
+    def clear(self):
+        self.buffers.clear()
+
+
+class AllocationCounter:
+    """Counts the tensor allocations (CPU and CUDA caching allocator) made inside the context.
+
+    count: number of allocations; nbytes: their total size. Frees are not counted.
+    """
+
+    def __init__(self):
+        activities = [ProfilerActivity.CPU]
+        if torch.cuda.is_available():
+            activities.append(ProfilerActivity.CUDA)
+        self.profiler = profile(activities=activities, profile_memory=True)
+        self.count = 0
+        self.nbytes = 0
+
+    def __enter__(self):
+        self.profiler.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.__exit__(*exc)
+        # The raw events: profiler.events() folds the allocations made inside an op into its net usage
+        for event in self.profiler.profiler.kineto_results.events():
+            if event.name() == "[memory]" and event.nbytes() > 0:
+                self.count += 1
+                self.nbytes += event.nbytes()
+        return False
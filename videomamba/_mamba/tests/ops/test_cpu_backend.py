@@ -0,0 +1,288 @@
+# Copyright (C) 2023, Tri Dao.
+
+import torch
+import torch.nn.functional as F
+import pytest
+
+from einops import rearrange
+
+from mamba_ssm.ops.backend import layer_norm_fn, rms_norm_fn
+from mamba_ssm.ops.selective_scan_interface import mamba_inner_fn
+from mamba_ssm.ops.selective_scan_interface import selective_scan_ref, selective_scan_sequential_ref
+from mamba_ssm.ops.selective_scan_interface import selective_scan_recompute_fn
+from mamba_ssm.modules.mamba_simple import Mamba
+from mamba_ssm.utils.generation import InferenceParams
+from causal_conv1d.causal_conv1d_interface import causal_conv1d_update_ref
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 5, 64])
+@pytest.mark.parametrize("BC_shape", ["fixed", "variable", "grouped"])
+@pytest.mark.parametrize("is_complex", [False, True])
+def test_selective_scan_chunked(is_complex, BC_shape, chunk_size):
+    """The chunked scan matches the per-timestep loop, including state carried in and out."""
+    torch.random.manual_seed(0)
+    batch_size, dim, dstate, seqlen = 2, 8, 4, 37
+    dtype = torch.complex64 if is_complex else torch.float32
+    A = -0.5 * torch.rand(dim, dstate, dtype=dtype)
+    if BC_shape == "fixed":
+        B, C = torch.randn(dim, dstate, dtype=dtype), torch.randn(dim, dstate, dtype=dtype)
+    else:
+        shape = (batch_size, dstate, seqlen * (2 if is_complex else 1))
+        if BC_shape == "grouped":
+            shape = (batch_size, 2) + shape[1:]
+        B, C = torch.randn(shape), torch.randn(shape)
+    u, delta, z = torch.randn(batch_size, dim, seqlen), torch.rand(batch_size, dim, seqlen), torch.randn(batch_size, dim, seqlen)
+    prev_state = torch.randn(batch_size, dim, dstate, dtype=dtype)
+    kwargs = dict(D=torch.randn(dim), z=z, delta_bias=torch.rand(dim), delta_softplus=True,
+                  return_last_state=True, prev_state=prev_state)
+    out, last_state = selective_scan_ref(u, delta, A, B, C, chunk_size=chunk_size, **kwargs)
+    out_ref, last_state_ref = selective_scan_sequential_ref(u, delta, A, B, C, **kwargs)
+    assert torch.allclose(out, out_ref, rtol=1e-4, atol=1e-5)
+    assert torch.allclose(last_state, last_state_ref, rtol=1e-4, atol=1e-5)
+
+
+def test_selective_scan_chunked_backward():
+    torch.random.manual_seed(0)
+    batch_size, dim, dstate, seqlen = 2, 8, 4, 21
+    inputs = [torch.randn(batch_size, dim, seqlen), torch.rand(batch_size, dim, seqlen),
+              -torch.rand(dim, dstate), torch.randn(batch_size, dstate, seqlen),
+              torch.randn(batch_size, dstate, seqlen), torch.randn(dim), torch.randn(batch_size, dim, seqlen)]
+    grads = []
+    for fn, kwargs in ((selective_scan_ref, dict(chunk_size=8)), (selective_scan_sequential_ref, {})):
+        leaves = [t.clone().requires_grad_() for t in inputs]
+        fn(*leaves, delta_softplus=True, **kwargs).sum().backward()
+        grads.append([t.grad for t in leaves])
+    for g, g_ref in zip(*grads):
+        assert torch.allclose(g, g_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("chunk_size", [None, 1, 6])
+@pytest.mark.parametrize("BC_shape", ["fixed", "variable", "grouped"])
+@pytest.mark.parametrize("is_complex", [False, True])
+def test_selective_scan_recompute(is_complex, BC_shape, chunk_size):
+    """Recomputing chunks in backward gives the gradients of autograd through selective_scan_ref."""
+    torch.random.manual_seed(0)
+    batch_size, dim, dstate, seqlen = 2, 8, 4, 23
+    dtype = torch.complex64 if is_complex else torch.float32
+    A = -0.5 * torch.rand(dim, dstate, dtype=dtype)
+    if BC_shape == "fixed":
+        B, C = torch.randn(dim, dstate, dtype=dtype), torch.randn(dim, dstate, dtype=dtype)
+    else:
+        shape = (batch_size, dstate, seqlen * (2 if is_complex else 1))
+        if BC_shape == "grouped":
+            shape = (batch_size, 2) + shape[1:]
+        B, C = torch.randn(shape), torch.randn(shape)
+    inputs = [torch.randn(batch_size, dim, seqlen), torch.rand(batch_size, dim, seqlen), A, B, C,
+              torch.randn(dim), torch.randn(batch_size, dim, seqlen), torch.rand(dim),
+              torch.randn(batch_size, dim, dstate, dtype=dtype)]
+    outs, grads = [], []
+    for fn in (selective_scan_recompute_fn, selective_scan_ref):
+        u, delta, A, B, C, D, z, delta_bias, prev_state = [t.clone().requires_grad_() for t in inputs]
+        out, last_state = fn(u, delta, A, B, C, D, z, delta_bias, delta_softplus=True, return_last_state=True,
+                             prev_state=prev_state, chunk_size=chunk_size)
+        # The last state feeds the next call in recurrent mode, so its gradient must flow back too.
+        (out.sum() + last_state.real.sum()).backward()
+        outs.append((out, last_state))
+        grads.append([u.grad, delta.grad, A.grad, B.grad, C.grad, D.grad, z.grad, delta_bias.grad, prev_state.grad])
+    for t, t_ref in zip(*outs):
+        assert torch.allclose(t, t_ref, rtol=1e-5, atol=1e-6)
+    for g, g_ref in zip(*grads):
+        assert torch.allclose(g, g_ref, rtol=1e-4, atol=1e-4)
+
+
+@pytest.mark.parametrize("is_complex", [False, True])
+def test_selective_scan_compile(is_complex):
+    """Under torch.compile the scan is one opaque custom op, with the same outputs and gradients as eager."""
+    torch.random.manual_seed(0)
+    batch_size, dim, dstate, seqlen = 2, 8, 4, 19
+    dtype = torch.complex64 if is_complex else torch.float32
+    BC_shape = (batch_size, dstate, seqlen * (2 if is_complex else 1))
+    inputs = [torch.randn(batch_size, dim, seqlen), torch.rand(batch_size, dim, seqlen),
+              -0.5 * torch.rand(dim, dstate, dtype=dtype), torch.randn(BC_shape), torch.randn(BC_shape),
+              torch.randn(dim), torch.randn(batch_size, dim, dstate, dtype=dtype)]
+
+    def fn(u, delta, A, B, C, D, prev_state):
+        out, last_state = selective_scan_recompute_fn(u, delta, A, B, C, D, delta_softplus=True, return_last_state=True,
+                                                      prev_state=prev_state, chunk_size=8)
+        return out.sum() + last_state.real.sum()
+
+    grads = []
+    for f in (fn, torch.compile(fn, backend="aot_eager", fullgraph=True)):
+        leaves = [t.clone().requires_grad_() for t in inputs]
+        f(*leaves).backward()
+        grads.append([t.grad for t in leaves])
+    for g, g_ref in zip(*grads):
+        assert torch.allclose(g, g_ref, rtol=1e-5, atol=1e-6)
+    torch.library.opcheck(torch.ops.mamba_ssm.selective_scan_chunks, (*inputs[:5], inputs[6], 8))
+
+
+@pytest.mark.parametrize("seqlen", [1, 7, 64])
+def test_mamba_cpu_parallel_matches_step(seqlen):
+    """The fused path on CPU (reference ops) must match the token-by-token recurrence."""
+    torch.random.manual_seed(0)
+    batch_size, d_model = 2, 32
+    model = Mamba(d_model, layer_idx=0, bimamba=False)
+    x = torch.randn(batch_size, seqlen, d_model)
+    with torch.no_grad():
+        out = model(x)
+        conv_state, ssm_state = model.allocate_inference_cache(batch_size, seqlen)
+        out_step = torch.cat([model.step(x[:, i:i + 1], conv_state, ssm_state)[0] for i in range(seqlen)], dim=1)
+    assert torch.allclose(out, out_step, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("activation", [None, "silu"])
+@pytest.mark.parametrize("width", [2, 3, 4])
+def test_causal_conv1d_update_ring(width, activation):
+    """The circular conv state gives the linear update's outputs bit for bit, and the same state up to a roll."""
+    torch.random.manual_seed(0)
+    batch_size, dim, seqlen = 2, 24, 9
+    x = torch.randn(batch_size, dim, seqlen)
+    weight, bias = torch.randn(dim, width), torch.randn(dim)
+    conv_state, ring_state, ring_state_tensor = (torch.randn(batch_size, dim, width) for _ in range(3))
+    ring_state.copy_(conv_state)
+    ring_state_tensor.copy_(conv_state)
+    for t in range(seqlen):
+        out = causal_conv1d_update_ref(x[:, :, t], conv_state, weight, bias, activation)[0]
+        out_ring = causal_conv1d_update_ref(x[:, :, t], ring_state, weight, bias, activation, cache_seqlens=width + t)[0]
+        cache_seqlens = torch.full((batch_size,), width + t, dtype=torch.int32)
+        out_ring_tensor = causal_conv1d_update_ref(x[:, :, t], ring_state_tensor, weight, bias, activation,
+                                                   cache_seqlens=cache_seqlens)[0]
+        assert torch.equal(out_ring, out)
+        assert torch.allclose(out_ring_tensor, out, rtol=1e-6, atol=1e-6)
+    assert torch.equal(ring_state.roll(-((width + seqlen) % width), dims=-1), conv_state)
+    assert torch.equal(ring_state_tensor, ring_state)
+
+
+def test_mamba_cpu_step_ring_conv_state():
+    torch.random.manual_seed(0)
+    batch_size, d_model, seqlen = 2, 32, 10
+    model = Mamba(d_model, layer_idx=0, bimamba=False)
+    x = torch.randn(batch_size, seqlen, d_model)
+    with torch.no_grad():
+        conv_state, ssm_state = model.allocate_inference_cache(batch_size, seqlen)
+        out = torch.cat([model.step(x[:, i:i + 1], conv_state, ssm_state)[0] for i in range(seqlen)], dim=1)
+        ring_state, ring_ssm_state = model.allocate_inference_cache(batch_size, seqlen)
+        out_ring = torch.cat([model.step(x[:, i:i + 1], ring_state, ring_ssm_state, cache_seqlens=i)[0]
+                              for i in range(seqlen)], dim=1)
+    assert torch.equal(out_ring, out)
+    assert torch.equal(ring_ssm_state, ssm_state)
+    assert torch.equal(ring_state.roll(-(seqlen % model.d_conv), dims=-1), conv_state)
+
+
+@pytest.mark.parametrize("splits", [[1] * 10, [3, 1, 1, 4, 1], [6, 1, 3]])
+def test_mamba_cpu_forward_ring_conv_state(splits):
+    """With InferenceParams.conv_state_ring, single tokens are stepped on the circular conv state and longer calls
+    scan around it: same outputs and states as the linear layout, up to the roll of the conv state."""
+    torch.random.manual_seed(0)
+    batch_size, d_model, seqlen = 2, 32, 10
+    model = Mamba(d_model, layer_idx=0, bimamba=False, return_last_state=True)
+    x = torch.randn(batch_size, seqlen, d_model)
+    params = InferenceParams(max_seqlen=seqlen, max_batch_size=batch_size)
+    ring_params = InferenceParams(max_seqlen=seqlen, max_batch_size=batch_size, conv_state_ring=True)
+    with torch.no_grad():
+        for x_chunk in x.split(splits, dim=1):
+            out = model(x_chunk, inference_params=params)[0]
+            out_ring = model(x_chunk, inference_params=ring_params)[0]
+            assert torch.allclose(out_ring, out, rtol=1e-4, atol=1e-5)
+            params.seqlen_offset += x_chunk.shape[1]
+            ring_params.seqlen_offset += x_chunk.shape[1]
+            conv_state, ssm_state = params.key_value_memory_dict[0]
+            ring_state, ring_ssm_state = ring_params.key_value_memory_dict[0]
+            assert torch.allclose(ring_ssm_state, ssm_state, rtol=1e-4, atol=1e-5)
+            assert torch.equal(ring_state.roll(-(ring_params.seqlen_offset % model.d_conv), dims=-1), conv_state)
+
+
+def test_mamba_cpu_return_last_state():
+    """Scanning a sequence in two calls with return_last_state gives the one-call result."""
+    torch.random.manual_seed(0)
+    batch_size, seqlen, d_model = 2, 24, 32
+    model = Mamba(d_model, layer_idx=0, bimamba=False, return_last_state=True)
+    x = torch.randn(batch_size, seqlen, d_model)
+    with torch.no_grad():
+        out = model(x)
+        conv_state, ssm_state = model.allocate_inference_cache(batch_size, seqlen)
+        outs = []
+        for x_chunk in x.split([10, 14], dim=1):
+            xz = rearrange(model.in_proj(x_chunk), "b l d -> b d l")
+            out_chunk, ssm_state, conv_state = mamba_inner_fn(
+                xz, model.conv1d.weight, model.conv1d.bias, model.x_proj.weight, model.dt_proj.weight,
+                model.out_proj.weight, model.out_proj.bias, -torch.exp(model.A_log.float()), None, None,
+                model.D.float(), delta_bias=model.dt_proj.bias.float(), delta_softplus=True,
+                ssm_state=ssm_state, conv_state=conv_state, return_last_state=True,
+            )
+            outs.append(out_chunk)
+    assert torch.allclose(out, torch.cat(outs, dim=1), rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("splits", [[24], [1] * 24, [3, 5, 16], [17, 7]])
+def test_mamba_cpu_chunks_bit_exact(splits):
+    """Splitting the sequence (temporal layer) or the batch (spatial layer) into several calls changes no bit."""
+    torch.random.manual_seed(0)
+    batch_size, seqlen, d_model = 3, 24, 32
+    model = Mamba(d_model, layer_idx=0, bimamba=False, return_last_state=True)
+    x = torch.randn(batch_size, seqlen, d_model)
+    with torch.no_grad():
+        out = model(x, inference_params=InferenceParams(max_seqlen=seqlen, max_batch_size=batch_size))[0]
+        params = InferenceParams(max_seqlen=seqlen, max_batch_size=batch_size)
+        outs = [model(x_chunk, inference_params=params)[0] for x_chunk in x.split(splits, dim=1)]
+    assert torch.equal(out, torch.cat(outs, dim=1))
+
+    model = Mamba(d_model, layer_idx=1, bimamba=True)
+    x = torch.randn(len(splits), seqlen, d_model)
+    with torch.no_grad():
+        assert torch.equal(model(x), torch.cat([model(x_row) for x_row in x.split(1)]))
+
+
+def test_bimamba_cpu():
+    """The bidirectional layer adds a second scan, with its own weights, over the flipped sequence."""
+    torch.random.manual_seed(0)
+    batch_size, seqlen, d_model = 2, 17, 32
+    model = Mamba(d_model, layer_idx=0, bimamba=True)
+    x = torch.randn(batch_size, seqlen, d_model)
+    out = model(x)
+    out.sum().backward()
+    assert model.A_b_log.grad is not None and model.conv1d_b.weight.grad is not None
+    with torch.no_grad():
+        xz = rearrange(model.in_proj(x), "b l d -> b d l")
+        ys = []
+        for flip, conv1d, x_proj, dt_proj, A_log, D in (
+            (False, model.conv1d, model.x_proj, model.dt_proj, model.A_log, model.D),
+            (True, model.conv1d_b, model.x_proj_b, model.dt_proj_b, model.A_b_log, model.D_b),
+        ):
+            u, z = (xz.flip([-1]) if flip else xz).chunk(2, dim=1)
+            u = F.silu(conv1d(u)[..., :seqlen])
+            dt, B, C = torch.split(x_proj(rearrange(u, "b d l -> b l d")), [model.dt_rank, model.d_state, model.d_state], dim=-1)
+            dt = F.softplus(dt_proj(dt))
+            A = -torch.exp(A_log)
+            state = torch.zeros(batch_size, model.d_inner, model.d_state)
+            y = []
+            for i in range(seqlen):
+                state = state * torch.exp(dt[:, i, :, None] * A) + (dt[:, i] * u[:, :, i])[..., None] * B[:, i, None]
+                y.append((state * C[:, i, None]).sum(-1) + D * u[:, :, i])
+            y = torch.stack(y, dim=-1) * F.silu(z)
+            ys.append(y.flip([-1]) if flip else y)
+        out_ref = model.out_proj(rearrange(ys[0] + ys[1], "b d l -> b l d"))
+    assert torch.allclose(out, out_ref, rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("is_rms_norm", [False, True])
+@pytest.mark.parametrize("has_residual", [False, True])
+def test_fused_add_norm_cpu(has_residual, is_rms_norm):
+    torch.random.manual_seed(0)
+    hidden = 64
+    x = torch.randn(2, 5, hidden)
+    residual = torch.randn(2, 5, hidden) if has_residual else None
+    weight = torch.randn(hidden)
+    bias = None if is_rms_norm else torch.randn(hidden)
+    out, residual_out = layer_norm_fn(x, weight, bias, residual=residual, eps=1e-5, prenorm=True,
+                                      residual_in_fp32=True, is_rms_norm=is_rms_norm)
+    x_ref = x + residual if has_residual else x
+    if is_rms_norm:
+        out_ref = x_ref * torch.rsqrt(x_ref.square().mean(-1, keepdim=True) + 1e-5) * weight
+        assert torch.allclose(rms_norm_fn(x, weight, bias, residual=residual, eps=1e-5), out_ref,
+                              rtol=1e-5, atol=1e-5)
+    else:
+        out_ref = F.layer_norm(x_ref, (hidden,), weight, bias, eps=1e-5)
+    assert residual_out.dtype == torch.float32
+    assert torch.allclose(residual_out, x_ref)
+    assert torch.allclose(out, out_ref, rtol=1e-5, atol=1e-5)
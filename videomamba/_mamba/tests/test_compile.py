@@ -0,0 +1,68 @@
+import pytest
+import torch
+
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from video_sm.models.compile import CompiledEndoMamba, graph_breaks, mode_function
+from video_sm.models.endomamba import EndoMamba
+
+
+def _model(**kwargs):
+    torch.random.manual_seed(0)
+    config = dict(img_size=32, patch_size=16, depth=4, embed_dim=32, num_classes=5, drop_path_rate=0.)
+    config.update(kwargs)
+    return EndoMamba(**config).eval()
+
+
+@pytest.fixture(autouse=True)
+def _reset_dynamo():
+    torch._dynamo.reset()
+    yield
+    torch._dynamo.reset()
+
+
+@pytest.mark.parametrize("backend", ["aot_eager", "inductor"])
+def test_compiled_endomamba_matches_eager(backend):
+    """Every compiled mode gives the eager outputs: parallel, then prefill continued by steps."""
+    clip = torch.randn(2, 3, 5, 32, 32)
+    model = _model()
+    compiled = CompiledEndoMamba(model, backend=backend)
+    assert compiled.modes == ("parallel",)
+    with torch.no_grad():
+        assert torch.allclose(compiled.parallel(clip), model(clip), rtol=1e-4, atol=1e-5)
+
+    model = _model(return_last_state=True)
+    compiled = CompiledEndoMamba(model, backend=backend)
+    assert compiled.modes == ("prefill", "step")
+    with torch.no_grad():
+        inference_params = InferenceParams(max_seqlen=5, max_batch_size=2)
+        reference, inference_params = model.forward_stream(clip[:, :, :3], inference_params)
+        logits, *states = compiled.prefill(clip[:, :, :3])
+        assert torch.allclose(logits, reference, rtol=1e-4, atol=1e-5)
+        offset = torch.full((2,), 3)
+        for t in range(3, 5):
+            reference, inference_params = model.forward_stream(clip[:, :, t:t + 1], inference_params)
+            logits, *states = compiled.step(clip[:, :, t].contiguous(), offset, *states)
+            assert torch.allclose(logits, reference[:, 0], rtol=1e-4, atol=1e-5)
+            offset = offset + 1
+
+
+@pytest.mark.parametrize("mode", ["parallel", "prefill", "step"])
+def test_no_graph_breaks(mode):
+    model = _model(return_last_state=mode != "parallel")
+    fn = mode_function(model, mode)
+    args = fn.example_inputs(2) if mode != "parallel" else (torch.randn(2, 3, 4, 32, 32),)
+    explanation, breaks = graph_breaks(fn, *args)
+    assert explanation.graph_break_count == 0, breaks
+    assert not breaks
+
+
+def test_graph_breaks_reported():
+    def fn(x):
+        x = x + 1
+        torch._dynamo.graph_break()
+        return x * 2
+
+    explanation, breaks = graph_breaks(fn, torch.randn(3))
+    assert explanation.graph_break_count == 1
+    [(location, reasons)] = breaks.items()
+    assert "test_compile.py" in location and len(reasons) == 1
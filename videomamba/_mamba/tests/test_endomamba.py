@@ -0,0 +1,234 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+import torch
+from einops import rearrange
+
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from _mamba.mamba_ssm.utils.inference_state import InferenceStateManager
+from video_sm.models.checkpointing import ActivationProfile, explicit_checkpoint_layers, select_layers
+from video_sm.models.endomamba import EndoMamba
+
+
+def _model(**kwargs):
+    torch.random.manual_seed(0)
+    config = dict(img_size=32, patch_size=16, depth=4, embed_dim=32, num_classes=5, drop_path_rate=0.)
+    config.update(kwargs)
+    return EndoMamba(**config).eval()
+
+
+def test_lengths_per_sample_parity():
+    """A batch of streams at different temporal offsets equals each stream run on its own at seqlen_offset."""
+    model = _model(return_last_state=True)
+    prefix_lengths, T = [1, 4, 2], 3
+    clips = [torch.randn(1, 3, length + T, 32, 32) for length in prefix_lengths]
+
+    outs, states = [], []
+    with torch.no_grad():
+        for clip, length in zip(clips, prefix_lengths):
+            inference_params = InferenceParams(max_seqlen=length + T, max_batch_size=1)
+            _, inference_params = model.forward_stream(clip[:, :, :length], inference_params)
+            states.append({i: tuple(state.clone() for state in layer_states)
+                           for i, layer_states in inference_params.key_value_memory_dict.items()})
+            assert inference_params.seqlen_offset == length
+            out, _ = model(clip[:, :, length:], inference_params)
+            outs.append(out)
+
+        batched = InferenceParams(max_seqlen=max(prefix_lengths) + T, max_batch_size=len(clips),
+                                  lengths_per_sample=torch.tensor(prefix_lengths))
+        for i in states[0]:
+            batched.key_value_memory_dict[i] = tuple(
+                torch.cat(layer_states) for layer_states in zip(*(stream_states[i] for stream_states in states))
+            )
+        x = torch.cat([clip[:, :, length:] for clip, length in zip(clips, prefix_lengths)])
+        out, batched = model(x, batched)
+
+    assert batched.lengths_per_sample.tolist() == prefix_lengths  # forward does not advance the positions
+    assert torch.allclose(out, torch.cat(outs), rtol=1e-4, atol=1e-5)
+
+
+
+def test_restore_into_part_of_a_batch():
+    """A stream restored into one row of a batch keeps its own position; the other rows keep theirs."""
+    model = _model(return_last_state=True)
+    clip, others = torch.randn(1, 3, 5, 32, 32), torch.randn(2, 3, 3, 32, 32)
+    with torch.no_grad():
+        saved = InferenceParams(max_seqlen=5, max_batch_size=1)
+        _, saved = model.forward_stream(clip[:, :, :4], saved)
+        blob = InferenceStateManager(saved).snapshot([0])
+        reference, _ = model.forward_stream(clip[:, :, 4:], saved)
+
+        batch = InferenceParams(max_seqlen=5, max_batch_size=2)
+        _, batch = model.forward_stream(others[:, :, :2], batch)
+        row_0 = InferenceParams(max_seqlen=3, max_batch_size=1)
+        _, row_0 = model.forward_stream(others[:1, :, :2], row_0)
+        row_0_reference, _ = model.forward_stream(others[:1, :, 2:], row_0)
+
+        InferenceStateManager(batch).restore(blob, [1])
+        assert batch.seqlen_offset == 2
+        assert batch.lengths_per_sample.tolist() == [2, 4]
+        out, batch = model.forward_stream(torch.cat([others[:1, :, 2:], clip[:, :, 4:]]), batch)
+    assert batch.lengths_per_sample.tolist() == [3, 5]
+    assert torch.allclose(out[0], row_0_reference[0], rtol=1e-4, atol=1e-5)
+    assert torch.allclose(out[1], reference[0], rtol=1e-4, atol=1e-5)
+
+
+def test_conv_state_ring_rejected():
+    """seqlen_offset counts frames, so the circular conv states of the causal Mamba layers are not supported."""
+    model = _model(return_last_state=True)
+    with pytest.raises(ValueError):
+        model.forward_stream(torch.randn(1, 3, 1, 32, 32), InferenceParams(max_seqlen=1, max_batch_size=1,
+                                                                           conv_state_ring=True))
+
+
+@pytest.mark.parametrize("chunk_size", [1, 3, 7, 16])
+@pytest.mark.parametrize("with_head", [True, False])
+def test_forward_chunked_bit_exact(chunk_size, with_head):
+    """forward_chunked equals forward_stream over the whole clip, bit for bit, also when chunk_size does not
+    divide T, from a clip start and continuing a stream."""
+    model = _model(return_last_state=True, with_head=with_head)
+    x = torch.randn(2, 3, 7, 32, 32)
+    with torch.no_grad():
+        reference, reference_params = model.forward_stream(x, InferenceParams(max_seqlen=10, max_batch_size=2))
+        out, inference_params = model.forward_chunked(x, chunk_size)
+        assert torch.equal(out, reference)
+        assert inference_params.seqlen_offset == 7
+        for i, states in reference_params.key_value_memory_dict.items():
+            for state, reference_state in zip(inference_params.key_value_memory_dict[i], states):
+                assert torch.equal(state, reference_state)
+
+        tail = torch.randn(2, 3, 3, 32, 32)
+        reference, _ = model.forward_stream(tail, reference_params)
+        out, inference_params = model.forward_chunked(tail, chunk_size, inference_params)
+    assert torch.equal(out, reference)
+    assert inference_params.seqlen_offset == 10
+
+
+@pytest.mark.parametrize("policy,budget", [("bogus", None), ("auto", None), ("auto", 0), ([0, 4], None), (3, None)])
+def test_checkpoint_policy_checked_at_construction(policy, budget):
+    with pytest.raises(ValueError):
+        _model(checkpoint_policy=policy, checkpoint_budget=budget)
+
+
+def test_select_layers():
+    model = _model(checkpoint_num=3)  # layers 0, 1 spatial, 2, 3 temporal
+    assert select_layers(model, "none") == set()
+    assert select_layers(model, "all") == {0, 1, 2, 3}
+    assert select_layers(model, "first_k") == {0, 1, 2}
+    assert select_layers(model, "spatial") == {0, 1}
+    assert select_layers(model, "temporal") == {2, 3}
+    assert select_layers(model, [3, 1]) == {1, 3}
+
+    profile = ActivationProfile(model)
+    full = profile.estimate((), 2, 4)
+    assert select_layers(model, "auto", 2, 4, full, profile) == set()
+    assert select_layers(model, "auto", 2, 4, 1, profile) == {0, 1, 2, 3}
+    layers = select_layers(model, "auto", 2, 4, full * 0.8, profile)
+    assert 0 < len(layers) < 4
+    assert profile.estimate(layers, 2, 4) <= full * 0.8
+
+
+def test_auto_checkpoint_explicit_profile():
+    """profile_activations() measures up front; the training forwards then run no probe forwards."""
+    model = _model(checkpoint_policy="auto", checkpoint_budget=1).train()
+    model.profile_activations()
+    calls = []
+    model.register_forward_pre_hook(lambda module, args: calls.append(args[0].shape))
+    model(torch.randn(2, 3, 4, 32, 32)).sum().backward()
+    assert calls == [(2, 3, 4, 32, 32)]
+    assert model._auto_checkpoint == {(2, 4): frozenset({0, 1, 2, 3})}
+
+
+
+def test_auto_checkpoint_first_step_keeps_its_features():
+    """The probe forwards of the first "auto" training step do not replace the features of the step itself."""
+    model = _model(checkpoint_policy="auto", checkpoint_budget=1, with_head=False).train()
+    model.feature_taps.add(2, tokens="patches")
+    x = torch.randn(2, 3, 4, 32, 32)
+    model(x).sum().backward()
+    assert model._activation_profile is not None
+    assert [feature.shape for feature in model.get_features()] == [(2, 4, 4, 32)]
+    layout_copies = model.layout_copies
+    with torch.no_grad():
+        model(x)
+    assert model.layout_copies == layout_copies
+
+
+@pytest.mark.parametrize("policy", ["all", "first_k", "spatial", "temporal"])
+def test_checkpointing_keeps_gradients(policy):
+    """Checkpointed layers recompute their forward in backward: the gradients are identical."""
+    model = _model(checkpoint_num=2).train()
+    x = torch.randn(2, 3, 4, 32, 32)
+
+    def grads(layers):
+        model.zero_grad(set_to_none=True)
+        with explicit_checkpoint_layers(model, layers):
+            model(x).pow(2).mean().backward()
+        return {name: p.grad.clone() for name, p in model.named_parameters() if p.grad is not None}
+
+    reference, checkpointed = grads(()), grads(select_layers(model, policy))
+    assert reference.keys() == checkpointed.keys()
+    for name in reference:
+        assert torch.equal(reference[name], checkpointed[name]), name
+
+
+def _endomamba_seg():
+    path = os.path.join(os.path.dirname(__file__), "../../downstream/CVC-12kSegmentation/networks/endomamba_seg_modeling.py")
+    spec = importlib.util.spec_from_file_location("endomamba_seg_modeling", path)
+    module = sys.modules[spec.name] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.EndoMambaSeg
+
+
+def _old_intermediate_features(model, x):
+    """The layer outputs forward_features kept before the feature taps: layers depth / 3, 2 * depth / 3 and
+    depth - 1, (B, T, N + 1, C)."""
+    depth, (B, T) = len(model.layers), (x.shape[0], x.shape[2])
+    outputs, handles = [], []
+    for idx in (depth // 3, 2 * depth // 3, depth - 1):
+        layer = model.layers[idx]
+        pattern = '(b t) n m -> b t n m' if layer.bimamba else 'b (t n) m -> b t n m'
+        handles.append(layer.register_forward_hook(
+            lambda module, args, out, pattern=pattern: outputs.append(rearrange(out[0], pattern, b=B, t=T))
+        ))
+    with torch.no_grad():
+        model(x)
+    for handle in handles:
+        handle.remove()
+    return outputs
+
+
+def test_seg_skips_equal_old_intermediate_features():
+    pytest.importorskip("timm")
+    torch.random.manual_seed(0)
+    seg = _endomamba_seg()(patch_size=16, embed_dim=32, depth=6).eval()
+    x = torch.randn(2, 3, 2, 224, 224)
+    intermediate_features = _old_intermediate_features(seg.encoder, x)
+    with torch.no_grad():
+        seg.encoder(x)
+    skips = seg.encoder.get_features()
+    assert len(skips) == 3
+    for i, skip in enumerate(skips):
+        assert torch.equal(skip, intermediate_features[i][:, :, 1:])
+
+
+def test_feature_taps_per_data_parallel_replica():
+    """nn.DataParallel replicas share the FeatureTaps registrations but keep the features of their own forward."""
+    model = _model(with_head=False)
+    model.feature_taps.add(2, tokens="patches")
+    replicas = [model._replicate_for_data_parallel() for _ in range(2)]
+    for replica in replicas:
+        replica._parameters = dict(model._parameters)  # replicate() sets the copies of the top-level parameters
+    assert replicas[0].feature_taps is replicas[1].feature_taps
+    shards = torch.randn(2, 2, 3, 2, 32, 32)
+    with torch.no_grad():
+        references = []
+        for shard in shards:
+            model(shard)
+            references.append(model.get_features()[0])
+        for replica, shard in zip(replicas, shards):
+            replica(shard)
+    for replica, reference in zip(replicas, references):
+        assert torch.equal(replica.get_features()[0], reference)
@@ -0,0 +1,78 @@
+import pytest
+import torch
+
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from video_sm.models.endomamba import EndoMamba
+from video_sm.models.export import RecurrentPrefill, RecurrentStep, export_onnx, trace_step
+
+
+def _model(**kwargs):
+    torch.random.manual_seed(0)
+    config = dict(img_size=32, patch_size=16, depth=4, embed_dim=32, num_classes=5, drop_path_rate=0.,
+                  return_last_state=True)
+    config.update(kwargs)
+    return EndoMamba(**config).eval()
+
+
+def _forward_stream(model, clip):
+    """Outputs of forward_stream, one frame per call: (B, T, num_classes)."""
+    inference_params = InferenceParams(max_seqlen=clip.shape[2], max_batch_size=clip.shape[0])
+    outs = []
+    with torch.no_grad():
+        for t in range(clip.shape[2]):
+            out, inference_params = model.forward_stream(clip[:, :, t:t + 1], inference_params)
+            outs.append(out[:, 0])
+    return torch.stack(outs, dim=1)
+
+
+def test_traced_recurrent_step_matches_forward_stream():
+    """The TorchScript step, fed back its states and offset + 1, gives forward_stream's outputs frame by frame."""
+    model = _model()
+    step = RecurrentStep(model)
+    traced = trace_step(step, batch_size=2)
+    assert "PythonOp" not in str(traced.inlined_graph)
+    clip = torch.randn(2, 3, 4, 32, 32)
+    reference = _forward_stream(model, clip)
+    states = eager_states = step.initial_states(2)
+    offset = torch.zeros(2, dtype=torch.long)
+    with torch.no_grad():
+        for t in range(clip.shape[2]):
+            frame = clip[:, :, t].contiguous()
+            out, *states = traced(frame, offset, *states)
+            eager, *eager_states = step(frame, offset, *eager_states)
+            assert torch.equal(out, eager)
+            assert torch.allclose(out, reference[:, t], rtol=1e-4, atol=1e-5)
+            offset = offset + 1
+    assert len(states) == len(step.state_names)
+
+
+def test_recurrent_prefill_then_step():
+    """States returned by RecurrentPrefill continue in RecurrentStep like forward_stream does."""
+    model = _model()
+    clip = torch.randn(2, 3, 5, 32, 32)
+    reference = _forward_stream(model, clip)
+    with torch.no_grad():
+        out, *states = RecurrentPrefill(model)(clip[:, :, :4])
+        last, *_ = RecurrentStep(model)(clip[:, :, 4].contiguous(), torch.full((2,), 4), *states)
+    assert torch.allclose(out, reference[:, :4], rtol=1e-4, atol=1e-5)
+    assert torch.allclose(last, reference[:, 4], rtol=1e-4, atol=1e-5)
+
+
+def test_export_onnx(tmp_path):
+    onnx = pytest.importorskip("onnx")
+    step = RecurrentStep(_model())
+    path = export_onnx(step, str(tmp_path / "step.onnx"))
+    graph = onnx.load(path)
+    onnx.checker.check_model(graph)
+    assert [i.name for i in graph.graph.input] == ["frame", "offset"] + step.state_names
+    assert [o.name for o in graph.graph.output] == ["logits"] + [f"new_{name}" for name in step.state_names]
+
+    onnxruntime = pytest.importorskip("onnxruntime")
+    session = onnxruntime.InferenceSession(path)
+    inputs = step.example_inputs(2)
+    inputs = (torch.randn_like(inputs[0]),) + inputs[1:]
+    with torch.no_grad():
+        reference = step(*inputs)
+    outputs = session.run(None, {name: x.numpy() for name, x in zip(["frame", "offset"] + step.state_names, inputs)})
+    for output, expected in zip(outputs, reference):
+        assert torch.allclose(torch.from_numpy(output), expected, rtol=1e-4, atol=1e-5)
@@ -0,0 +1,63 @@
+import pytest
+import torch
+
+from video_sm.models.endomamba import EndoMamba, load_state_dict, segm_init_weights
+from video_sm.models.fast_init import is_meta, materialize, meta_device
+
+
+def _model(**kwargs):
+    config = dict(img_size=32, patch_size=16, depth=4, embed_dim=32, num_classes=5, drop_path_rate=0.)
+    config.update(kwargs)
+    return EndoMamba(**config).eval()
+
+
+def _reference():
+    torch.random.manual_seed(0)
+    return _model()
+
+
+def test_materialize_bit_identical():
+    """A model built on the meta device and filled from a state dict equals the model it was saved from."""
+    reference = _reference()
+    with meta_device():
+        model = _model()
+    assert is_meta(model)
+    materialize(model, reference.state_dict(), init=segm_init_weights)
+    assert not is_meta(model)
+    assert not any(t.is_meta for t in model.buffers())
+    for (name, p), p_ref in zip(model.named_parameters(), reference.parameters()):
+        assert torch.equal(p, p_ref), name
+        assert getattr(p, "_no_weight_decay", False) == getattr(p_ref, "_no_weight_decay", False), name
+        assert getattr(p, "_no_reinit", False) == getattr(p_ref, "_no_reinit", False), name
+    assert model.layers[0].mixer.A_log._no_weight_decay and model.layers[0].mixer.D_b._no_weight_decay
+
+    x = torch.randn(2, 3, 3, 32, 32)
+    with torch.no_grad():
+        features, features_ref = model.forward_features(x)[0], reference.forward_features(x)[0]
+        assert torch.equal(features, features_ref)
+        assert torch.equal(model(x), reference(x))
+
+
+def test_materialize_initializes_missing_head():
+    """load_state_dict of a pretraining checkpoint (no head) allocates and initializes the head of a meta model."""
+    reference = _reference()
+    checkpoint = {f"encoder.{k}": v for k, v in reference.state_dict().items() if not k.startswith("head.")}
+    with meta_device():
+        model = _model()
+    torch.random.manual_seed(1)
+    load_state_dict(model, checkpoint)
+    assert not is_meta(model)
+    assert torch.equal(model.head.bias, torch.zeros(5))
+    assert 0.01 < model.head.weight.std().item() < 0.03  # trunc_normal_(std=0.02) of segm_init_weights
+    assert model.head.weight.abs().max() <= 2
+    with torch.no_grad():
+        x = torch.randn(2, 3, 3, 32, 32)
+        assert torch.equal(model.forward_features(x)[0], reference.forward_features(x)[0])
+
+
+def test_materialize_rejects_missing_mixer_weights():
+    state_dict = {k: v for k, v in _reference().state_dict().items() if k != "layers.1.mixer.A_log"}
+    with meta_device():
+        model = _model()
+    with pytest.raises(ValueError):
+        materialize(model, state_dict)
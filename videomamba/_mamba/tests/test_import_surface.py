@@ -0,0 +1,50 @@
+import os
+import subprocess
+import sys
+
+import pytest
+
+
+def _imported(statement, names):
+    """The modules of names that a fresh interpreter has imported after running statement."""
+    code = f"import sys\n{statement}\nprint(','.join(name for name in {names!r} if name in sys.modules))"
+    output = subprocess.run([sys.executable, "-c", code], env=dict(os.environ), check=True,
+                            capture_output=True, text=True).stdout
+    return [name for name in output.strip().split(",") if name]
+
+
+def test_inference_params_imports_nothing():
+    assert _imported("from mamba_ssm.utils.inference_params import InferenceParams",
+                     ["torch", "transformers", "mamba_ssm.utils.generation"]) == []
+
+
+@pytest.mark.parametrize("statement", [
+    "from mamba_ssm.modules.mamba_simple import Mamba",
+    "from mamba_ssm import Mamba",
+])
+def test_mamba_imports_no_optional_dependency(statement):
+    assert _imported(statement, ["transformers", "triton", "selective_scan_cuda", "causal_conv1d_cuda",
+                                 "mamba_ssm.models.mixer_seq_simple"]) == []
+
+
+def test_generation_reexports_inference_params():
+    from mamba_ssm.utils.generation import InferenceParams
+    from mamba_ssm.utils.inference_params import InferenceParams as Params
+
+    assert InferenceParams is Params
+
+
+def test_endomamba_registers_timm_models_on_request():
+    assert _imported("import video_sm.models.endomamba", ["timm"]) == []
+    assert _imported("from video_sm.models.endomamba import register_timm_models\nregister_timm_models()\n"
+                     "register_timm_models()\nfrom timm.models import is_model\nassert is_model('endomamba_small')",
+                     ["timm"]) == ["timm"]
+
+
+def test_surgformer_endomamba_registers_timm_models_on_request():
+    """The Surgformer copy of endomamba.py follows video_sm's: no timm on import, registered by its entry points."""
+    path = os.path.join(os.path.dirname(__file__), "../../downstream/SurgicalPhase/Surgformer")
+    statement = f"sys.path.insert(0, {os.path.abspath(path)!r})\nimport model.endomamba"
+    assert _imported(statement, ["timm"]) == []
+    assert _imported(f"{statement}\nmodel.endomamba.register_timm_models()\nfrom timm.models import is_model\n"
+                     "assert is_model('endomamba_small')", ["timm"]) == ["timm"]
@@ -0,0 +1,95 @@
+import json
+import os
+
+import pytest
+import torch
+
+from video_sm.models.endomamba import endomamba_tiny
+from video_sm.models.inference_checkpoint import (
+    export_inference_checkpoint, load_inference_checkpoint, load_tensors, save_tensors
+)
+
+
+def _tensors():
+    torch.random.manual_seed(0)
+    # Odd sizes: every narrower tensor would start misaligned if the wider ones were not written first
+    return {
+        "bf16": torch.randn(3, 5).bfloat16(), "fp16": torch.randn(7).half(), "fp32": torch.randn(2, 3),
+        "fp64": torch.randn(1).double(), "int8": torch.randint(-128, 127, (5,), dtype=torch.int8),
+        "int64": torch.arange(3), "bool": torch.tensor([True, False, True]), "empty": torch.empty(0, 4),
+    }
+
+
+def test_save_load_tensors(tmp_path):
+    path = str(tmp_path / "tensors.safetensors")
+    tensors = _tensors()
+    save_tensors(tensors, path, {"key": "value"})
+    loaded, metadata = load_tensors(path)
+    assert metadata == {"key": "value"}
+    assert loaded.keys() == tensors.keys()
+    for name, tensor in tensors.items():
+        assert loaded[name].dtype == tensor.dtype
+        assert torch.equal(loaded[name], tensor), name
+        assert loaded[name].data_ptr() % tensor.element_size() == 0, name
+        assert loaded[name].untyped_storage().nbytes() == os.path.getsize(path)  # a view of the mapping
+
+
+def test_safetensors_compatible(tmp_path):
+    safetensors = pytest.importorskip("safetensors.torch")
+    from safetensors import safe_open
+
+    tensors = _tensors()
+    path = str(tmp_path / "ours.safetensors")
+    save_tensors(tensors, path, {"key": "value"})
+    loaded = safetensors.load_file(path)
+    for name, tensor in tensors.items():
+        assert torch.equal(loaded[name], tensor), name
+    with safe_open(path, framework="pt") as f:
+        assert f.metadata() == {"key": "value"}
+
+    # and the other way round
+    path = str(tmp_path / "theirs.safetensors")
+    safetensors.save_file(tensors, path, {"key": "value"})
+    loaded, metadata = load_tensors(path)
+    assert metadata == {"key": "value"}
+    for name, tensor in tensors.items():
+        assert torch.equal(loaded[name], tensor), name
+
+
+def test_inference_checkpoint_round_trip(tmp_path):
+    """export, then mmap load: the same state_dict and the same outputs, without copying the weights."""
+    torch.random.manual_seed(0)
+    model_kwargs = dict(img_size=32, num_classes=5)
+    reference = endomamba_tiny(**model_kwargs).eval()
+    path = str(tmp_path / "endomamba_tiny.safetensors")
+    missing = export_inference_checkpoint({"model": reference.state_dict()}, path, "endomamba_tiny",
+                                          from_pretraining=False, **model_kwargs)
+    assert missing == []
+    _, metadata = load_tensors(path)
+    assert metadata["model_name"] == "endomamba_tiny" and json.loads(metadata["model_kwargs"]) == model_kwargs
+
+    model = load_inference_checkpoint(path)
+    assert not model.training
+    state_dict, reference_state_dict = model.state_dict(), reference.state_dict()
+    assert state_dict.keys() == reference_state_dict.keys()
+    for name, tensor in state_dict.items():
+        assert torch.equal(tensor, reference_state_dict[name]), name
+        assert tensor.untyped_storage().nbytes() == os.path.getsize(path), name
+    x = torch.randn(2, 3, 3, 32, 32)
+    with torch.no_grad():
+        assert torch.equal(model(x), reference(x))
+
+
+def test_inference_checkpoint_from_pretraining(tmp_path):
+    """A pretraining checkpoint is converted at export; the head it lacks is initialized at load."""
+    torch.random.manual_seed(0)
+    reference = endomamba_tiny(img_size=32, num_classes=5).eval()
+    checkpoint = {"model": {f"encoder.{k}": v for k, v in reference.state_dict().items()}}
+    path = str(tmp_path / "endomamba_tiny.safetensors")
+    assert export_inference_checkpoint(checkpoint, path, "endomamba_tiny", img_size=32,
+                                       num_classes=5) == ["head.bias", "head.weight"]
+    model = load_inference_checkpoint(path)
+    assert torch.equal(model.head.bias, torch.zeros(5))
+    x = torch.randn(1, 3, 2, 32, 32)
+    with torch.no_grad():
+        assert torch.equal(model.forward_features(x)[0], reference.forward_features(x)[0])
@@ -0,0 +1,99 @@
+import copy
+
+import pytest
+import torch
+import torch.nn as nn
+
+from mamba_ssm.modules.mamba_simple import Mamba
+from mamba_ssm.utils.generation import InferenceParams
+from mamba_ssm.utils.inference_state import InferenceStateManager
+
+
+def _model(n_layer=2, d_model=16):
+    torch.random.manual_seed(0)
+    return nn.ModuleList(
+        [Mamba(d_model, layer_idx=i, bimamba=False, return_last_state=True) for i in range(n_layer)]
+    )
+
+
+def _run(layers, x, inference_params):
+    with torch.no_grad():
+        for layer in layers:
+            x, inference_params = layer(x, inference_params=inference_params)
+    return x
+
+
+def test_snapshot_restore_bit_exact():
+    """Restored streams continue exactly (bit for bit, at the same batch layout) as if they had never left."""
+    layers = _model()
+    batch_size, chunk, d_model = 3, 5, 16
+    x = torch.randn(batch_size, 4 * chunk, d_model)
+    params = InferenceParams(max_seqlen=4 * chunk, max_batch_size=batch_size)
+    manager = InferenceStateManager(params)
+    outs = [_run(layers, x[:, i * chunk:(i + 1) * chunk], params) for i in range(2)]
+    blob = manager.snapshot(list(range(batch_size)))
+    blob_rows = manager.snapshot([2, 0])
+    outs += [_run(layers, x[:, i * chunk:(i + 1) * chunk], params) for i in range(2, 4)]
+
+    # Resume all streams in a fresh InferenceParams (e.g. on another worker)
+    restored = InferenceParams(max_seqlen=4 * chunk, max_batch_size=batch_size)
+    InferenceStateManager(restored).restore(blob, list(range(batch_size)))
+    outs_restored = [_run(layers, x[:, i * chunk:(i + 1) * chunk], restored) for i in range(2, 4)]
+    for out, out_restored in zip(outs[2:], outs_restored):
+        assert torch.equal(out, out_restored)
+
+    # Resume rows 2 and 0 only, swapped into rows 1 and 0 of a batch of 2
+    restored = InferenceParams(max_seqlen=4 * chunk, max_batch_size=2)
+    InferenceStateManager(restored).restore(blob_rows, [1, 0])
+    outs_restored = [_run(layers, x[[0, 2], i * chunk:(i + 1) * chunk], restored) for i in range(2, 4)]
+    for out, out_restored in zip(outs[2:], outs_restored):
+        assert torch.allclose(out[[0, 2]], out_restored, rtol=1e-5, atol=1e-6)
+
+
+def test_reset_fork_compact():
+    layers = _model()
+    batch_size, chunk, d_model = 3, 4, 16
+    x = torch.randn(batch_size, 2 * chunk, d_model)
+    params = InferenceParams(max_seqlen=2 * chunk, max_batch_size=batch_size)
+    manager = InferenceStateManager(params)
+    _run(layers, x[:, :chunk], params)
+
+    # A reset row continues like a fresh stream
+    manager.reset([1])
+    out = _run(layers, x[:, chunk:], params)
+    fresh = _run(layers, x[1:2, chunk:], InferenceParams(max_seqlen=chunk, max_batch_size=1))
+    assert torch.allclose(out[1:2], fresh, rtol=1e-5, atol=1e-6)
+
+    # Forked rows continue like their source, compacting keeps the surviving rows' states
+    copies = manager.fork(0, 2)
+    assert copies == [3, 4] and manager.batch_size == 5
+    y = torch.randn(1, chunk, d_model).expand(5, -1, -1)
+    out = _run(layers, y, params)
+    assert torch.equal(out[3], out[0]) and torch.equal(out[4], out[0])
+    z = torch.randn(5, chunk, d_model)
+    expected = _run(layers, z, copy.deepcopy(params))[[2, 3]]
+    manager.compact([2, 3])
+    assert manager.batch_size == 2
+    assert torch.equal(_run(layers, z[[2, 3]], params), expected)
+
+
+def test_restore_conv_state_layout():
+    """Circular conv states are restored only into a batch of that layout, at the seqlen_offset they were saved at."""
+    layers = _model()
+    x = torch.randn(2, 5, 16)
+    ring = InferenceParams(max_seqlen=5, max_batch_size=2, conv_state_ring=True)
+    _run(layers, x[:, :3], ring)
+    ring.seqlen_offset += 3
+    blob = InferenceStateManager(ring).snapshot([0, 1])
+    with pytest.raises(ValueError):
+        InferenceStateManager(InferenceParams(max_seqlen=5, max_batch_size=2)).restore(blob, [0, 1])
+    with pytest.raises(ValueError):
+        InferenceStateManager(InferenceParams(max_seqlen=5, max_batch_size=2, conv_state_ring=True)).restore(blob, [0, 1])
+
+    restored = InferenceParams(max_seqlen=5, max_batch_size=2, seqlen_offset=3, conv_state_ring=True)
+    InferenceStateManager(restored).restore(blob, [1, 0])
+    for t in range(3, 5):
+        out = _run(layers, x[:, t:t + 1], ring)
+        assert torch.equal(_run(layers, x[[1, 0], t:t + 1], restored), out[[1, 0]])
+        ring.seqlen_offset += 1
+        restored.seqlen_offset += 1
@@ -0,0 +1,105 @@
+import importlib.util
+import os
+import sys
+
+import pytest
+import torch
+from einops import rearrange
+
+from _mamba.mamba_ssm.ops.backend import RMSNorm, layer_norm_fn, rms_norm_fn
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from video_sm.models.endomamba import EndoMamba
+from video_sm.models.layout import layer_stages
+
+
+def _surgformer_endomamba():
+    path = os.path.join(os.path.dirname(__file__), "../../downstream/SurgicalPhase/Surgformer/model/endomamba.py")
+    spec = importlib.util.spec_from_file_location("surgformer_endomamba", path)
+    module = sys.modules[spec.name] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module.EndoMamba
+
+
+MODELS = {"video_sm": lambda: EndoMamba, "surgformer": _surgformer_endomamba}
+
+
+def _model(name, **kwargs):
+    torch.random.manual_seed(0)
+    config = dict(img_size=32, patch_size=16, depth=6, embed_dim=32, num_classes=5, drop_path_rate=0.)
+    config.update(kwargs)
+    return MODELS[name]()(**config).eval()
+
+
+def _per_layer_forward_features(model, x, inference_params=None):
+    """forward_features as before the layout stages: every layer converts from and back to (B, T, N, M)."""
+    tokens = []
+    handle = model.pos_drop.register_forward_hook(lambda module, args, out: tokens.append(out))
+    with torch.no_grad():
+        model.forward_features(x, InferenceParams(max_seqlen=inference_params.max_seqlen,
+                                                  max_batch_size=inference_params.max_batch_size,
+                                                  seqlen_offset=inference_params.seqlen_offset)
+                               if inference_params is not None else None)
+    handle.remove()
+    hidden_states, residual = tokens[0], None
+    B, T = hidden_states.shape[:2]
+    with torch.no_grad():
+        for layer in model.layers:
+            pattern = 'b t n m -> (b t) n m' if layer.bimamba else 'b t n m -> b (t n) m'
+            hidden_states = rearrange(hidden_states, pattern)
+            if residual is not None:
+                residual = rearrange(residual, pattern)
+            hidden_states, residual = layer(hidden_states, residual,
+                                            inference_params=None if layer.bimamba else inference_params)
+            if model.return_last_state and not layer.bimamba:
+                hidden_states, inference_params = hidden_states
+            pattern = '(b t) n m -> b t n m' if layer.bimamba else 'b (t n) m -> b t n m'
+            hidden_states = rearrange(hidden_states, pattern, b=B, t=T)
+            residual = rearrange(residual, pattern, b=B, t=T)
+        if not model.fused_add_norm:
+            return model.norm_f((residual + hidden_states).to(dtype=model.norm_f.weight.dtype))
+        fused_add_norm_fn = rms_norm_fn if isinstance(model.norm_f, RMSNorm) else layer_norm_fn
+        return fused_add_norm_fn(hidden_states, model.norm_f.weight, model.norm_f.bias, eps=model.norm_f.eps,
+                                 residual=residual, prenorm=False, residual_in_fp32=model.residual_in_fp32)
+
+
+@pytest.mark.parametrize("name", MODELS)
+@pytest.mark.parametrize("fused_add_norm", [True, False])
+def test_stages_match_per_layer_layouts(name, fused_add_norm):
+    """Running the layers as stages gives the outputs of the per-layer conversions, bit for bit, in parallel
+    and in recurrent mode."""
+    model = _model(name, fused_add_norm=fused_add_norm, rms_norm=fused_add_norm)
+    x = torch.randn(2, 3, 4, 32, 32)
+    with torch.no_grad():
+        out, _ = model.forward_features(x)
+    assert torch.equal(out, _per_layer_forward_features(model, x))
+
+    model = _model(name, fused_add_norm=fused_add_norm, rms_norm=fused_add_norm, return_last_state=True)
+    inference_params = InferenceParams(max_seqlen=4, max_batch_size=2)
+    reference_params = InferenceParams(max_seqlen=4, max_batch_size=2)
+    for t in range(0, 4, 2):
+        with torch.no_grad():
+            out, inference_params = model.forward_features(x[:, :, t:t + 2], inference_params)
+        reference = _per_layer_forward_features(model, x[:, :, t:t + 2], reference_params)
+        assert torch.equal(out, reference)
+        inference_params.seqlen_offset += 2
+        reference_params.seqlen_offset += 2
+
+
+@pytest.mark.parametrize("name", MODELS)
+def test_layout_copies(name):
+    """Only the patch embedding permute copies, and not for a single frame: the stage conversions are views."""
+    model = _model(name, num_spatial_layers=2)
+    assert model.layer_stages == layer_stages(model.layers) == [(True, [0, 1]), (False, [2, 3, 4, 5])]
+    with torch.no_grad():
+        model.forward_features(torch.randn(2, 3, 4, 32, 32))
+        assert model.layout_copies == 1
+        model.forward_features(torch.randn(2, 3, 1, 32, 32))
+        assert model.layout_copies == 0
+
+    # The counter counts: a transpose of the stage layout copies, a regrouping does not
+    model.layout_copies = 0
+    hidden_states = torch.randn(2, 4 * 5, 32)
+    model._relayout(hidden_states, 'b (t n) m -> (b t) n m', t=4)
+    assert model.layout_copies == 0
+    model._relayout(hidden_states, 'b (t n) m -> (b n) t m', t=4)
+    assert model.layout_copies == 1
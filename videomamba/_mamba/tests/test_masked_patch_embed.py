@@ -0,0 +1,79 @@
+import pytest
+import torch
+from einops import rearrange
+
+from video_sm.models.endomamba_pretrain import EndoMamba
+from video_sm.models.videomamba_pretrain import VisionMamba
+
+
+B, T, IMG, PATCHES = 2, 4, 32, 4
+
+
+def _model(cls):
+    torch.random.manual_seed(0)
+    return cls(img_size=IMG, patch_size=16, embed_dim=32, depth=2, kernel_size=1, num_frames=T,
+               fused_add_norm=False, rms_norm=False).train()
+
+
+def _tube_mask(num_masked):
+    """(B, T * N) tube masks: the same masked patches in every frame, as the pretraining datasets draw them."""
+    order = torch.rand(B, PATCHES).argsort(dim=1)
+    mask_per_frame = torch.zeros(B, PATCHES, dtype=torch.bool)
+    mask_per_frame.scatter_(1, order[:, :num_masked], True)
+    return mask_per_frame.repeat(1, T)
+
+
+def _random_mask(num_masked):
+    """(B, T * N) masks with num_masked patches anywhere in the clip."""
+    order = torch.rand(B, T * PATCHES).argsort(dim=1)
+    return torch.zeros(B, T * PATCHES, dtype=torch.bool).scatter_(1, order[:, :num_masked], True)
+
+
+def _endomamba_full(model, x, mask):
+    x = model.embed(x)
+    return rearrange(x, 'b t n c -> b (t n) c')[~mask].reshape(B, T, -1, x.shape[-1])
+
+
+def _videomamba_full(model, x, mask):
+    x = model.embed(x)
+    return x[~mask].reshape(B, -1, x.shape[-1])
+
+
+def _with_cls(mask):
+    """videomamba_pretrain masks have a leading column for the CLS token, which is always visible."""
+    return torch.cat((torch.zeros(B, 1, dtype=torch.bool), mask), dim=1)
+
+
+def _grads(model, tokens):
+    model.zero_grad(set_to_none=True)
+    tokens.backward(torch.arange(tokens.numel(), dtype=tokens.dtype).view_as(tokens).sin())
+    return {name: p.grad.clone() for name, p in model.named_parameters() if p.grad is not None}
+
+
+@pytest.mark.parametrize("cls,full,masks", [
+    (EndoMamba, _endomamba_full, [_tube_mask(3), _tube_mask(0)]),
+    (VisionMamba, _videomamba_full, [_tube_mask(3), _random_mask(11), _random_mask(0)]),
+])
+def test_embed_visible_equals_full_then_index(cls, full, masks):
+    """embed(x, mask) embeds only the visible patches: the tokens of the full path followed by x[~mask], bit
+    for bit, and the same gradients of the patch, positional and CLS embeddings."""
+    model = _model(cls)
+    x = torch.randn(B, 3, T, IMG, IMG)
+    for mask in masks:
+        if cls is VisionMamba:
+            mask = _with_cls(mask)
+        reference, tokens = full(model, x, mask), model.embed(x, mask)
+        assert torch.equal(tokens, reference)
+        if cls is VisionMamba:
+            assert torch.equal(tokens[:, 0], (model.cls_token[0, 0] + model.pos_embed[0, 0]).expand(B, -1))
+
+        reference_grads, token_grads = _grads(model, reference), _grads(model, tokens)
+        assert reference_grads.keys() == token_grads.keys()
+        assert {"patch_embed.proj.weight", "pos_embed"} <= reference_grads.keys()
+        if cls is VisionMamba:
+            assert "cls_token" in reference_grads
+        for name in reference_grads:
+            # The weight gradient sums over the tokens (the full path also over the masked ones, with zero
+            # gradients): equal up to the rounding of the sum
+            error = (token_grads[name] - reference_grads[name]).abs().max()
+            assert error <= 1e-5 * reference_grads[name].abs().max(), name
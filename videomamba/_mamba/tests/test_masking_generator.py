@@ -0,0 +1,111 @@
+import importlib.util
+import os
+import sys
+
+import numpy as np
+import pytest
+import torch
+from torch.utils.data import DataLoader, Dataset
+
+
+def _masking_generator():
+    """datasets/masking_generator.py, loaded on its own: the datasets package imports the video decoders."""
+    path = os.path.join(os.path.dirname(__file__), "../../video_sm/datasets/masking_generator.py")
+    spec = importlib.util.spec_from_file_location("masking_generator", path)
+    module = sys.modules[spec.name] = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(module)
+    return module
+
+
+masking_generator = _masking_generator()
+BatchMaskingGenerator, MaskingCollate = masking_generator.BatchMaskingGenerator, masking_generator.MaskingCollate
+GENERATORS = {
+    "tube": masking_generator.TubeMaskingGenerator,
+    "random": masking_generator.RandomMaskingGenerator,
+    "tube_row": masking_generator.TubeRowMaskingGenerator,
+    "random_row": masking_generator.RandomRowMaskingGenerator,
+}
+INPUT_SIZE = (4, 6, 5)
+
+
+@pytest.mark.parametrize("mask_type", BatchMaskingGenerator.MASK_TYPES)
+@pytest.mark.parametrize("mask_ratio", [0., 0.3, 0.9])
+def test_counts_and_structure(mask_type, mask_ratio):
+    """As many masked patches as the per-sample generator, tubes shared by the frames, rows over the width."""
+    generator = BatchMaskingGenerator(INPUT_SIZE, mask_ratio, mask_type=mask_type)
+    np.random.seed(0)
+    reference = GENERATORS[mask_type](INPUT_SIZE, mask_ratio)()
+    masks = generator(torch.arange(64))
+    assert masks.shape == (64, np.prod(INPUT_SIZE)) and masks.dtype == torch.bool
+    assert (masks.sum(1) == int(reference.sum())).all()
+    assert generator.total_masks == int(reference.sum())
+
+    grid = masks.view(-1, *INPUT_SIZE)
+    if mask_type == "tube":
+        assert (grid == grid[:, :1]).all()
+    if mask_type in ("tube_row", "random_row"):
+        assert (grid == grid[..., :1]).all()
+    if mask_type == "tube_row":
+        assert (grid.sum((2, 3)) == generator.num_mask * INPUT_SIZE[2]).all()
+    if 0 < mask_ratio:
+        assert len(set(map(tuple, masks.tolist()))) > 1  # the masks differ between samples
+
+
+def test_deterministic_and_independent_of_the_batch():
+    """A mask depends only on (seed, epoch, index): not on the call, the batch it is drawn in or its device."""
+    generator = BatchMaskingGenerator(INPUT_SIZE, 0.75, mask_type="random", seed=3)
+    masks = generator(torch.arange(32))
+    assert torch.equal(generator(torch.arange(32)), masks)
+    assert torch.equal(BatchMaskingGenerator(INPUT_SIZE, 0.75, mask_type="random", seed=3)(range(32)), masks)
+    indices = [17, 2, 30, 2]
+    assert torch.equal(generator(indices), masks[indices])
+    assert torch.equal(generator(torch.tensor(indices), device="cpu"), masks[indices])
+    assert not torch.equal(BatchMaskingGenerator(INPUT_SIZE, 0.75, mask_type="random", seed=4)(range(32)), masks)
+
+
+def test_set_epoch():
+    generator = BatchMaskingGenerator(INPUT_SIZE, 0.75, mask_type="tube")
+    indices = torch.arange(16)
+    first = generator(indices)
+    assert torch.equal(generator(indices, epoch=0), first)
+    generator.set_epoch(1)
+    second = generator(indices)
+    assert not torch.equal(second, first)
+    assert torch.equal(generator(indices, epoch=1), second)
+    assert torch.equal(generator(indices, epoch=0), first)
+    generator.set_epoch(0)
+    assert torch.equal(generator(indices), first)
+
+
+def test_unknown_mask_type():
+    with pytest.raises(ValueError):
+        BatchMaskingGenerator(INPUT_SIZE, 0.5, mask_type="block")
+
+
+class _IndexedClips(Dataset):
+    """Samples (clip, label, index), as a pretraining dataset returning the index in place of its mask."""
+
+    def __len__(self):
+        return 10
+
+    def __getitem__(self, index):
+        return torch.full((2, 3), float(index)), index % 3, index
+
+
+@pytest.mark.parametrize("num_workers", [0, 1])
+def test_masking_collate(num_workers):
+    """The loader yields the collated samples followed by the masks of their indices, at the epoch set."""
+    generator = BatchMaskingGenerator(INPUT_SIZE, 0.5, mask_type="tube_row", seed=1)
+    collate = MaskingCollate(generator)
+    loader = DataLoader(_IndexedClips(), batch_size=4, shuffle=True, collate_fn=collate, num_workers=num_workers)
+    for epoch in range(2):
+        collate.set_epoch(epoch)
+        for clips, labels, masks in loader:
+            indices = clips[:, 0, 0].long()
+            assert torch.equal(labels, indices % 3)
+            assert torch.equal(masks, generator(indices, epoch=epoch))
+
+    pairs = MaskingCollate(generator)([(torch.zeros(2), 5), (torch.ones(2), 7)])
+    assert len(pairs) == 2
+    assert torch.equal(pairs[0], torch.tensor([[0., 0.], [1., 1.]]))
+    assert torch.equal(pairs[1], generator([5, 7], epoch=1))
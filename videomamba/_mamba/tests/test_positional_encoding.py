@@ -0,0 +1,56 @@
+import torch
+
+from video_sm.models.fast_init import meta_device
+from video_sm.models.positional_encoding import PositionalEncoding
+
+
+def _legacy_table(d_model, max_len):
+    """The former fixed table of PositionalEncoding."""
+    encoding = torch.zeros(max_len, d_model)
+    pos = torch.arange(0, max_len).float().unsqueeze(dim=1)
+    _2i = torch.arange(0, d_model, step=2).float()
+    encoding[:, 0::2] = torch.sin(pos / (10000 ** (_2i / d_model)))
+    encoding[:, 1::2] = torch.cos(pos / (10000 ** (_2i / d_model)))
+    return encoding
+
+
+def test_table_equals_legacy():
+    module = PositionalEncoding(64)
+    table = _legacy_table(64, 8192)
+    assert torch.equal(module.encoding, table)
+    assert torch.equal(module(torch.zeros(2, 30)), table[:30])
+    assert torch.equal(module.half().encoding, table.half())
+
+
+def test_gather_equals_rows():
+    module = PositionalEncoding(64, max_len=512)
+    positions = torch.randint(0, 512, (4, 3))
+    assert torch.equal(module.gather(positions), module.rows(0, 512)[positions])
+    assert torch.equal(module.gather(torch.arange(500, 520)), module.rows(500, 20))
+
+
+def test_past_max_len():
+    """Rows past the table are computed without touching it; grow extends it, doubling, with the same values."""
+    module = PositionalEncoding(64, max_len=512)
+    table = _legacy_table(64, 4096)
+    encoding = module.encoding
+    assert torch.equal(module.rows(510, 10), table[510:520])
+    assert torch.equal(module(torch.zeros(1, 600)), table[:600])
+    assert module.encoding is encoding
+
+    module.grow(513)
+    assert module.encoding.shape[0] == 1024
+    module.grow(3000)
+    assert module.encoding.shape[0] == 3000
+    assert torch.equal(module.encoding, table[:3000])
+    encoding = module.encoding
+    module.grow(2000)
+    assert module.encoding is encoding
+
+
+def test_built_off_meta_device():
+    with meta_device():
+        module = PositionalEncoding(64, max_len=512)
+    assert module.encoding.is_meta and module.encoding.numel() == 0
+    module.to_empty(device="cpu")
+    assert torch.equal(module.encoding, _legacy_table(64, 512))
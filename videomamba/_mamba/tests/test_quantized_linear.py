@@ -0,0 +1,77 @@
+import warnings
+
+import pytest
+import torch
+import torch.nn as nn
+
+from mamba_ssm.modules.mamba_simple import Mamba
+from mamba_ssm.modules.quantized_linear import QuantizedLinear, has_dynamic_int8
+from mamba_ssm.utils.generation import InferenceParams
+
+
+@pytest.mark.parametrize("dynamic", [False, True])
+def test_quantized_linear(dynamic):
+    torch.random.manual_seed(0)
+    linear = nn.Linear(64, 96)
+    layer = QuantizedLinear.from_float(linear, dynamic=dynamic)
+    assert layer.qweight.dtype == torch.int8
+    # Half a quantization step per output channel
+    step = linear.weight.abs().amax(dim=1, keepdim=True) / 127
+    assert ((layer.weight - linear.weight).abs() <= step / 2 + 1e-7).all()
+    x = torch.randn(2, 5, 64)
+    with torch.no_grad():
+        out, out_ref = layer(x), linear(x)
+    assert out.shape == out_ref.shape
+    assert (out - out_ref).norm() / out_ref.norm() < 0.02
+
+    restored = QuantizedLinear(64, 96, dynamic=dynamic)
+    restored.load_state_dict(layer.state_dict())
+    assert torch.equal(restored(x), out)
+
+
+@pytest.mark.skipif(not has_dynamic_int8(), reason="no quantized engine")
+def test_quantized_linear_packed_weight():
+    """The int8 GEMM packs exactly qweight and its scales, without warnings."""
+    torch.random.manual_seed(0)
+    layer = QuantizedLinear.from_float(nn.Linear(64, 96))
+    with warnings.catch_warnings():
+        warnings.simplefilter("error")
+        weight, bias = torch.ops.quantized.linear_unpack(layer._packed_weight())
+    assert torch.equal(weight.int_repr(), layer.qweight)
+    assert torch.equal(weight.q_per_channel_scales().float(), layer.weight_scale)
+    assert torch.equal(bias, layer.bias)
+
+
+@pytest.mark.parametrize("bimamba", [False, True])
+def test_mamba_quantized_projections(bimamba):
+    """Quantized in_proj / out_proj are called as layers, in parallel and recurrent mode."""
+    torch.random.manual_seed(0)
+    model = Mamba(32, layer_idx=0, bimamba=bimamba, return_last_state=not bimamba).eval()
+    x = torch.randn(2, 12, 32)
+    params = InferenceParams(max_seqlen=12, max_batch_size=2)
+    with torch.no_grad():
+        out_ref = model(x, inference_params=params)[0] if not bimamba else model(x)
+        for name in ("in_proj", "out_proj", "x_proj", "dt_proj"):
+            setattr(model, name, QuantizedLinear.from_float(getattr(model, name), dynamic=name in ("in_proj", "out_proj")))
+        if bimamba:
+            out = model(x)
+        else:
+            params = InferenceParams(max_seqlen=12, max_batch_size=2)
+            outs = []
+            for start in range(0, 12, 4):
+                out, params = model(x[:, start:start + 4], inference_params=params)
+                outs.append(out)
+            out = torch.cat(outs, dim=1)
+    assert (out - out_ref).norm() / out_ref.norm() < 0.05
+
+
+@pytest.mark.parametrize("dynamic", [False, True])
+def test_quantized_linear_holds_no_float_weight(dynamic):
+    """After forward (and packing), the layer keeps its int8 weight, the scales and the bias only."""
+    layer = QuantizedLinear.from_float(nn.Linear(64, 96), dynamic=dynamic)
+    with torch.no_grad():
+        layer(torch.randn(2, 64))
+    tensors = [value for value in vars(layer).values() if isinstance(value, torch.Tensor)]
+    tensors += list(layer.buffers()) + list(layer.parameters())
+    assert not any(t.is_floating_point() and t.shape == (96, 64) for t in tensors)
+    assert {name for name, _ in layer.named_buffers()} == {"qweight", "weight_scale", "bias"}
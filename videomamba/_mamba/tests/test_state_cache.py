@@ -0,0 +1,55 @@
+import pytest
+import torch
+import torch.nn as nn
+
+from mamba_ssm.modules.mamba_simple import Mamba
+from mamba_ssm.utils.generation import InferenceParams
+from mamba_ssm.utils.inference_state import InferenceStateManager
+from mamba_ssm.utils.state_cache import allocate_states, load_states, store_states_
+
+
+def _run(layers, x, inference_params):
+    with torch.no_grad():
+        for layer in layers:
+            x, inference_params = layer(x, inference_params=inference_params)
+    return x
+
+
+@pytest.mark.parametrize("dtype", [torch.bfloat16, torch.float16, torch.int8])
+def test_store_load_roundtrip(dtype):
+    torch.random.manual_seed(0)
+    states = (torch.randn(3, 8, 4), 10 * torch.randn(3, 8, 16))
+    stored = allocate_states([state.shape for state in states], dtype)
+    assert len(stored) == (4 if dtype == torch.int8 else 2)
+    loaded = load_states(store_states_(stored, states))
+    for state, state_loaded in zip(states, loaded):
+        assert state_loaded.dtype == torch.float32
+        if dtype == torch.int8:
+            # Half a quantization step per channel
+            step = state.abs().amax(-1, keepdim=True) / 127
+            assert ((state_loaded - state).abs() <= step / 2 + 1e-6).all()
+        else:
+            assert torch.equal(state_loaded, state.to(dtype).float())
+
+
+@pytest.mark.parametrize("dtype", [torch.bfloat16, torch.float16, torch.int8])
+def test_mamba_reduced_precision_states(dtype):
+    torch.random.manual_seed(0)
+    layers = nn.ModuleList([Mamba(16, layer_idx=i, bimamba=False, return_last_state=True) for i in range(2)])
+    batch_size, chunk = 2, 4
+    x = torch.randn(batch_size, 8 * chunk, 16)
+    params = InferenceParams(max_seqlen=8 * chunk, max_batch_size=batch_size)
+    params_low = InferenceParams(max_seqlen=8 * chunk, max_batch_size=batch_size, state_dtype=dtype)
+    for i in range(8):
+        out = _run(layers, x[:, i * chunk:(i + 1) * chunk], params)
+        out_low = _run(layers, x[:, i * chunk:(i + 1) * chunk], params_low)
+        assert torch.allclose(out_low, out, rtol=1e-2, atol=2e-3)
+    for layer_states in params_low.key_value_memory_dict.values():
+        assert layer_states[0].dtype == dtype and layer_states[1].dtype == dtype
+
+    # The stored states move with the stream manager like fp32 ones
+    manager = InferenceStateManager(params_low)
+    restored = InferenceParams(max_seqlen=chunk, max_batch_size=batch_size, state_dtype=dtype)
+    InferenceStateManager(restored).restore(manager.snapshot([1, 0]), [1, 0])
+    y = torch.randn(batch_size, chunk, 16)
+    assert torch.equal(_run(layers, y, restored), _run(layers, y, params_low))
@@ -0,0 +1,56 @@
+import pytest
+import torch
+
+from mamba_ssm.modules.mamba_simple import Mamba
+from mamba_ssm.modules.mamba_static import StaticMamba
+from mamba_ssm.utils.generation import InferenceParams
+from mamba_ssm.utils.workspace import AllocationCounter, Workspace
+
+
+@pytest.mark.parametrize("seqlen", [1, 9])
+def test_static_mamba_bimamba(seqlen):
+    torch.random.manual_seed(0)
+    mixer = Mamba(32, layer_idx=0, bimamba=True).eval()
+    static = StaticMamba(mixer)
+    x = torch.randn(2, seqlen, 32)
+    out = torch.empty_like(x)
+    with torch.no_grad():
+        out_ref = mixer(x)
+    assert torch.allclose(static(x, out), out_ref, rtol=1e-5, atol=1e-5)
+
+
+def test_static_mamba_causal_states():
+    """Successive calls carry conv_state / ssm_state like Mamba.forward with return_last_state."""
+    torch.random.manual_seed(0)
+    mixer = Mamba(32, layer_idx=0, bimamba=False, return_last_state=True).eval()
+    static = StaticMamba(mixer)
+    batch, chunk = 2, 3
+    x = torch.randn(batch, 4 * chunk, 32)
+    params = InferenceParams(max_seqlen=4 * chunk, max_batch_size=batch)
+    conv_state, ssm_state = mixer.allocate_inference_cache(batch, 4 * chunk)
+    out = torch.empty(batch, chunk, 32)
+    with torch.no_grad():
+        for start in range(0, 4 * chunk, chunk):
+            out_ref, params = mixer(x[:, start:start + chunk], inference_params=params)
+            params.seqlen_offset += chunk
+            static(x[:, start:start + chunk].contiguous(), out, conv_state, ssm_state)
+            assert torch.allclose(out, out_ref, rtol=1e-5, atol=1e-5)
+    conv_ref, ssm_ref = params.key_value_memory_dict[0]
+    assert torch.allclose(conv_state, conv_ref)
+    assert torch.allclose(ssm_state, ssm_ref, rtol=1e-5, atol=1e-5)
+
+
+@pytest.mark.parametrize("bimamba", [False, True])
+def test_static_mamba_no_allocation(bimamba):
+    torch.random.manual_seed(0)
+    mixer = Mamba(32, layer_idx=0, bimamba=bimamba).eval()
+    workspace = Workspace()
+    static = StaticMamba(mixer, workspace)
+    x, out = torch.randn(1, 5, 32), torch.empty(1, 5, 32)
+    states = () if bimamba else mixer.allocate_inference_cache(1, 5)
+    static(x, out, *states)  # warm-up: fills the workspace
+    num_buffers = workspace.num_allocations
+    with AllocationCounter() as counter:
+        static(x, out, *states)
+    assert counter.count == 0
+    assert workspace.num_allocations == num_buffers
@@ -0,0 +1,155 @@
+import pytest
+import torch
+
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from _mamba.mamba_ssm.utils.inference_state import InferenceStateManager
+from video_sm.models.endomamba import EndoMamba
+from video_sm.models.streaming import StaggeredStateStreamer, StaticFrameRunner, StreamingEngine
+
+
+def _model(**kwargs):
+    torch.random.manual_seed(0)
+    config = dict(img_size=32, patch_size=16, depth=4, embed_dim=32, num_classes=5, drop_path_rate=0.,
+                  return_last_state=True)
+    config.update(kwargs)
+    return EndoMamba(**config).eval()
+
+
+def _single_stream(model, frames):
+    """Outputs of one stream run on its own, one recurrent forward_stream step per frame: (T, num_classes)."""
+    inference_params = InferenceParams(max_seqlen=frames.shape[1], max_batch_size=1)
+    outs = []
+    with torch.no_grad():
+        for t in range(frames.shape[1]):
+            out, inference_params = model.forward_stream(frames[None, :, t:t + 1], inference_params)
+            outs.append(out[0, 0])
+    return torch.stack(outs)
+
+
+def test_streaming_engine_join_leave():
+    """Streams that join and leave get, tick by tick, the outputs of separate single-stream runs."""
+    model = _model()
+    engine = StreamingEngine(model, max_streams=3)
+    clips = {stream_id: torch.randn(3, 6, 32, 32) for stream_id in "abcd"}
+    pool = [state.data_ptr() for states in engine.states.values() for state in states]
+
+    # stream -> ticks it is joined for: c joins late, a leaves and d takes its slot
+    schedule = {"a": range(0, 3), "b": range(0, 6), "c": range(2, 6), "d": range(3, 6)}
+    outs = {stream_id: [] for stream_id in clips}
+    slots = {}
+    for tick in range(6):
+        for stream_id, ticks in schedule.items():
+            if tick == ticks.stop:
+                engine.leave(stream_id)
+            elif tick == ticks.start:
+                slots[stream_id] = engine.join(stream_id)
+        # b skips tick 4: the streams of a tick are at different positions
+        frames = {stream_id: clips[stream_id][:, len(outs[stream_id])]
+                  for stream_id in engine.slots if not (stream_id == "b" and tick == 4)}
+        for stream_id, out in engine.step(frames).items():
+            outs[stream_id].append(out)
+
+    assert slots["d"] == slots["a"]
+    assert engine.num_streams == 3
+    assert [state.data_ptr() for states in engine.states.values() for state in states] == pool
+    for stream_id, stream_outs in outs.items():
+        clip = clips[stream_id][:, :len(stream_outs)]
+        assert torch.allclose(torch.stack(stream_outs), _single_stream(model, clip), rtol=1e-4, atol=1e-5)
+
+
+def test_streaming_engine_full_pool():
+    engine = StreamingEngine(_model(), max_streams=1)
+    engine.join("a")
+    with pytest.raises(ValueError):
+        engine.join("a")
+    with pytest.raises(RuntimeError):
+        engine.join("b")
+
+
+@pytest.mark.parametrize("smart_test", [False, True])
+def test_staggered_state_streamer_matches_smart_test(smart_test):
+    """StaggeredStateStreamer against the loop smart_test.test_per_sequence ran before it: the clip repeated
+    in a batch of 2, one row reset every train_seq_len frames, and current_batch switched between them."""
+    model = _model()
+    train_seq_len = 4
+    frames = torch.randn(3 * train_seq_len + 3, 1, 3, 1, 32, 32)
+    streamer = StaggeredStateStreamer(model, num_states=2 if smart_test else 1, reset_period=train_seq_len)
+
+    infer_params = InferenceParams(max_seqlen=64, max_batch_size=1)
+    states = InferenceStateManager(infer_params)
+    current_batch = 0
+    with torch.no_grad():
+        for frame_counter, videos in enumerate(frames):
+            output = streamer.step(videos)[0]
+
+            videos = torch.concatenate([videos, videos], dim=0)
+            if frame_counter % train_seq_len == 0 and frame_counter > train_seq_len:
+                if smart_test:
+                    current_batch = 1  # switch final output to batch 1
+                states.reset([0])  # clear batch 0 states
+            elif smart_test and frame_counter % train_seq_len == train_seq_len // 2 and frame_counter > train_seq_len:
+                current_batch = 0  # switch final output to batch 0
+                states.reset([1])  # clear batch 1 states
+            reference, infer_params = model(videos, infer_params)
+
+            assert streamer.current_state == current_batch
+            assert torch.allclose(output, reference[current_batch], rtol=1e-5, atol=1e-6)
+
+
+def test_forward_stream_burst():
+    """A burst of K frames in one forward_stream equals K single-frame steps."""
+    model = _model()
+    clip = torch.randn(2, 3, 7, 32, 32)
+    singles = torch.stack([_single_stream(model, clip[b]) for b in range(2)])
+    inference_params = InferenceParams(max_seqlen=7, max_batch_size=2)
+    with torch.no_grad():
+        first, inference_params = model.forward_stream(clip[:, :, :1], inference_params)
+        burst, inference_params = model.forward_stream(clip[:, :, 1:5], inference_params)
+        last, inference_params = model.forward_stream(clip[:, :, 5:], inference_params)
+    assert inference_params.seqlen_offset == 7
+    assert torch.allclose(torch.cat([first, burst, last], dim=1), singles, rtol=1e-4, atol=1e-5)
+
+
+def test_streaming_engine_burst():
+    """Streams delivering bursts of different lengths in one tick are grouped by length and continue like
+    single-frame steps."""
+    model = _model()
+    engine = StreamingEngine(model, max_streams=3)
+    clips = {stream_id: torch.randn(3, 6, 32, 32) for stream_id in "abc"}
+    for stream_id in clips:
+        engine.join(stream_id)
+    # tick -> stream -> number of frames (None: a single (C, H, W) frame)
+    ticks = [{"a": None, "b": 3, "c": 3}, {"a": 2, "b": None, "c": 3}, {"a": 3, "b": 2}]
+    outs = {stream_id: [] for stream_id in clips}
+    for tick in ticks:
+        frames = {}
+        for stream_id, num_frames in tick.items():
+            start = sum(len(out) for out in outs[stream_id])
+            frames[stream_id] = (clips[stream_id][:, start] if num_frames is None
+                                 else clips[stream_id][:, start:start + num_frames])
+        for stream_id, out in engine.step(frames).items():
+            assert out.dim() == (1 if tick[stream_id] is None else 2)
+            outs[stream_id].append(out.view(-1, out.shape[-1]))
+    for stream_id, stream_outs in outs.items():
+        assert sum(len(out) for out in stream_outs) == 6
+        assert torch.allclose(torch.cat(stream_outs), _single_stream(model, clips[stream_id]), rtol=1e-4, atol=1e-5)
+
+
+@pytest.mark.parametrize("fused_add_norm", [True, False])
+@pytest.mark.parametrize("with_cls_token,only_cls_token", [(True, False), (True, True), (False, False)])
+@pytest.mark.parametrize("with_head", [True, False])
+def test_static_frame_runner_parity(fused_add_norm, with_cls_token, only_cls_token, with_head):
+    """StaticFrameRunner re-implements the EndoMamba forward: it matches forward_stream on every path it copies."""
+    model = _model(fused_add_norm=fused_add_norm, with_cls_token=with_cls_token, only_cls_token=only_cls_token,
+                   with_head=with_head)
+    runner = StaticFrameRunner(model, batch_size=2)
+    clip = torch.randn(2, 3, 4, 32, 32)
+    for clip_idx in range(2):
+        inference_params = InferenceParams(max_seqlen=4, max_batch_size=2)
+        with torch.no_grad():
+            for t in range(clip.shape[2]):
+                out = runner.step(clip[:, :, t].contiguous())
+                reference, inference_params = model.forward_stream(clip[:, :, t:t + 1], inference_params)
+                reference = reference[:, 0] if with_head else model._pool(reference)[:, 0]
+                assert torch.allclose(out, reference, rtol=1e-4, atol=1e-5)
+        runner.reset()  # a new clip: zero states at position 0
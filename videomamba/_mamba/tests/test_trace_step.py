@@ -0,0 +1,39 @@
+import torch
+import torch.nn as nn
+
+from mamba_ssm.modules.mamba_simple import Mamba
+from mamba_ssm.utils.generation import InferenceParams
+
+
+class _Step(nn.Module):
+    """A spatial (bimamba) and a temporal layer as a pure function of their states."""
+
+    def __init__(self):
+        super().__init__()
+        self.spatial = Mamba(32, layer_idx=0, bimamba=True)
+        self.temporal = Mamba(32, layer_idx=1, bimamba=False, return_last_state=True)
+
+    def forward(self, x, conv_state, ssm_state):
+        params = InferenceParams(max_seqlen=x.shape[1], max_batch_size=x.shape[0])
+        params.key_value_memory_dict[1] = (conv_state.clone(), ssm_state)
+        out, params = self.temporal(self.spatial(x), inference_params=params)
+        return (out, *params.key_value_memory_dict[1])
+
+
+def test_trace_recurrent_step():
+    """The traced step (no autograd.Function in the graph) matches eager, states included, over several calls."""
+    torch.random.manual_seed(0)
+    step = _Step().eval()
+    batch, seqlen = 2, 5
+    conv_state, ssm_state = step.temporal.allocate_inference_cache(batch, seqlen)
+    with torch.no_grad():
+        traced = torch.jit.trace(step, (torch.randn(batch, seqlen, 32), conv_state, ssm_state), check_trace=False)
+        assert "PythonOp" not in str(traced.inlined_graph)
+        states_ref, states = (conv_state, ssm_state), (conv_state, ssm_state)
+        for _ in range(3):
+            x = torch.randn(batch, seqlen, 32)
+            out_ref, *states_ref = step(x, *states_ref)
+            out, *states = traced(x, *states)
+            assert torch.equal(out, out_ref)
+            assert all(torch.equal(state, state_ref) for state, state_ref in zip(states, states_ref))
+    assert not conv_state.any()  # inputs are not written to
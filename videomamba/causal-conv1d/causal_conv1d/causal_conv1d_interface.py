@@ -3,8 +3,19 @@
 import torch
 import torch.nn.functional as F
 
+_causal_conv1d_cuda = None
 
-import causal_conv1d_cuda
+
+def _cuda_extension():
+    """The causal_conv1d_cuda extension, imported on the first CUDA call (None if it is not installed)."""
+    global _causal_conv1d_cuda
+    if _causal_conv1d_cuda is None:
+        try:
+            import causal_conv1d_cuda
+            _causal_conv1d_cuda = causal_conv1d_cuda
+        except ImportError:  # CPU-only install, only the *_ref functions are usable
+            _causal_conv1d_cuda = False
+    return _causal_conv1d_cuda or None
 
 
 class CausalConv1dFn(torch.autograd.Function):
@@ -17,7 +28,7 @@ class CausalConv1dFn(torch.autograd.Function):
         bias = bias.contiguous() if bias is not None else None
         ctx.save_for_backward(x, weight, bias)
         ctx.activation = activation in ["silu", "swish"]
-        out = causal_conv1d_cuda.causal_conv1d_fwd(x, weight, bias, ctx.activation)
+        out = _cuda_extension().causal_conv1d_fwd(x, weight, bias, ctx.activation)
         return out
 
     @staticmethod
@@ -28,7 +39,7 @@ class CausalConv1dFn(torch.autograd.Function):
         # The kernel supports passing in a pre-allocated dx (e.g., in case we want to fuse the
         # backward of conv1d with the backward of chunk).
         # Here we just pass in None and dx will be allocated in the C++ code.
-        dx, dweight, dbias = causal_conv1d_cuda.causal_conv1d_bwd(
+        dx, dweight, dbias = _cuda_extension().causal_conv1d_bwd(
             x, weight, bias, dout, None, ctx.activation
         )
         return dx, dweight, dbias if bias is not None else None, None
@@ -43,9 +54,36 @@ def causal_conv1d_fn(x, weight, bias=None, activation=None):
 
     out: (batch, dim, seqlen)
     """
+    if not x.is_cuda or _cuda_extension() is None:
+        return causal_conv1d_ref(x, weight, bias, activation)
     return CausalConv1dFn.apply(x, weight, bias, activation)
 
 
+def _depthwise_conv1d_ref(x, weight, bias, seqlen):
+    """
+    Valid depthwise convolution over the last seqlen outputs of x, one multiply-add per tap.
+
+    Every output only depends on its own width inputs, always accumulated in the same order, so the
+    result does not depend on how the sequence is split into calls (unlike F.conv1d, whose blocking
+    changes with the length). Feeding a sequence through causal_conv1d_update_ref in chunks is thus
+    bit-identical to one causal_conv1d_ref call.
+
+    x: (batch, dim, >= seqlen + width - 1)
+    weight: (dim, width)
+    bias: (dim,)
+
+    out: (batch, dim, seqlen)
+    """
+    width = weight.shape[1]
+    start = x.shape[-1] - seqlen - (width - 1)
+    out = x[..., start:start + seqlen] * weight[:, 0, None]
+    for k in range(1, width):
+        out = out.addcmul(x[..., start + k:start + k + seqlen], weight[:, k, None])
+    if bias is not None:
+        out = out + bias[:, None]
+    return out
+
+
 def causal_conv1d_ref(x, weight, bias=None, activation=None):
     """
     x: (batch, dim, seqlen)
@@ -60,24 +98,27 @@ def causal_conv1d_ref(x, weight, bias=None, activation=None):
     x = x.to(weight.dtype)
     seqlen = x.shape[-1]
     dim, width = weight.shape
-    out = F.conv1d(x, weight.unsqueeze(1), bias, padding=width - 1, groups=dim)
-    out = out[..., :seqlen]
+    out = _depthwise_conv1d_ref(F.pad(x, (width - 1, 0)), weight, bias, seqlen)
     return (out if activation is None else F.silu(out)).to(dtype=dtype_in)
 
 
-def causal_conv1d_update(x, conv_state, weight, bias=None, activation=None):
+def causal_conv1d_update(x, conv_state, weight, bias=None, activation=None, cache_seqlens=None):
     """
     x: (batch, dim)
     conv_state: (batch, dim, width)
     weight: (dim, width)
     bias: (dim,)
+    cache_seqlens: int or (batch,) tensor. If not None, conv_state is a circular buffer, see
+        causal_conv1d_update_ref.
 
     out: (batch, dim)
     """
     if activation not in [None, "silu", "swish"]:
         raise NotImplementedError("activation must be None, silu, or swish")
+    if not x.is_cuda or cache_seqlens is not None or _cuda_extension() is None:
+        return causal_conv1d_update_ref(x, conv_state, weight, bias, activation, cache_seqlens)[0]
     activation = activation in ["silu", "swish"]
-    return causal_conv1d_cuda.causal_conv1d_update(x, conv_state, weight, bias, activation)
+    return _cuda_extension().causal_conv1d_update(x, conv_state, weight, bias, activation)
 
 
 def causal_conv1d_update_ref(x, conv_state, weight, bias=None, activation=None, cache_seqlens=None):
@@ -86,10 +127,14 @@ def causal_conv1d_update_ref(x, conv_state, weight, bias=None, activation=None,
     conv_state: (batch, dim, state_len), where state_len >= width - 1
     weight: (dim, width)
     bias: (dim,)
-    cache_seqlens: (batch,), dtype int32.
+    cache_seqlens: (batch,), dtype int32, or an int shared by the whole batch.
         If not None, the conv_state is treated as a circular buffer.
         The conv_state will be updated by copying x to the conv_state starting at the index
         @cache_seqlens % state_len before performing the convolution.
+        With an int and a single token, only that slot is written and the taps are read in place
+        (slot (cache_seqlens - width + 1 + k) % state_len for tap k), instead of shifting the whole
+        state. The result is bit-identical to the linear update. A linear conv_state (as left by the
+        parallel forward) after n tokens is the circular one of cache_seqlens=n rolled by -(n % state_len).
 
     out: (batch, dim) or (batch, dim, seqlen)
     """
@@ -106,6 +151,10 @@ def causal_conv1d_update_ref(x, conv_state, weight, bias=None, activation=None,
     state_len = conv_state.shape[-1]
     assert conv_state.shape == (batch, dim, state_len)
     assert weight.shape == (dim, width)
+    if isinstance(cache_seqlens, int) and seqlen == 1:
+        return _causal_conv1d_ring_step_ref(x, conv_state, weight, bias, activation, cache_seqlens, unsqueeze)
+    if isinstance(cache_seqlens, int):
+        cache_seqlens = torch.full((batch,), cache_seqlens, dtype=torch.int32, device=x.device)
     if cache_seqlens is None:
         x_new = torch.cat([conv_state, x], dim=-1).to(weight.dtype)  # (batch, dim, state_len + seqlen)
         conv_state.copy_(x_new[:, :, -state_len:])
@@ -116,7 +165,33 @@ def causal_conv1d_update_ref(x, conv_state, weight, bias=None, activation=None,
         copy_idx = torch.arange(seqlen, dtype=torch.long, device=x.device).unsqueeze(0) + cache_seqlens.unsqueeze(1)
         copy_idx = torch.remainder(copy_idx, state_len).unsqueeze(1).expand(-1, dim, -1)
         conv_state.scatter_(2, copy_idx, x)
-    out = F.conv1d(x_new, weight.unsqueeze(1), bias, padding=0, groups=dim)[:, :, -seqlen:]
+    out = _depthwise_conv1d_ref(x_new, weight, bias, seqlen)
+    if unsqueeze:
+        out = out.squeeze(-1)
+    return (out if activation is None else F.silu(out)).to(dtype=dtype_in), conv_state
+
+
+def _causal_conv1d_ring_step_ref(x, conv_state, weight, bias, activation, cache_seqlens, unsqueeze):
+    """
+    One token into a circular conv_state with a write pointer shared by the batch: one column write and
+    one multiply-add per tap, in the order of _depthwise_conv1d_ref.
+
+    x: (batch, dim, 1)
+    """
+    dtype_in = x.dtype
+    width = weight.shape[1]
+    state_len = conv_state.shape[-1]
+    conv_state.select(2, cache_seqlens % state_len).copy_(x[:, :, 0])
+    if conv_state.dtype != weight.dtype:
+        conv_state_w = conv_state.to(weight.dtype)
+    else:
+        conv_state_w = conv_state
+    start = cache_seqlens - (width - 1)
+    out = conv_state_w[:, :, start % state_len, None] * weight[:, 0, None]
+    for k in range(1, width):
+        out.addcmul_(conv_state_w[:, :, (start + k) % state_len, None], weight[:, k, None])
+    if bias is not None:
+        out.add_(bias[:, None])
     if unsqueeze:
         out = out.squeeze(-1)
-    return (out if activation is None else F.silu(out)).to(dtype=dtype_in), conv_state
\ No newline at end of file
+    return (out if activation is None else F.silu(out)).to(dtype=dtype_in), conv_state
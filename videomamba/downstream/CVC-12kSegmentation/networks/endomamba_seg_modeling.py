@@ -154,7 +154,7 @@ class DecoderCup(nn.Module):
             else:
                 skip = None
             if skip is not None:
-                skip = skip[:, :, 1:, :].contiguous().view(B, hidden, h, w)
+                skip = skip.view(B, hidden, h, w)  # patch tokens (B, T, N, C)
                 skip = self.up[i](skip)
             x = decoder_block(x, skip=skip)
         return x
@@ -189,6 +189,9 @@ class EndoMambaSeg(nn.Module):
                         fused_add_norm=fused_add_norm, 
                         with_head=False,
                     )
+        # Skip connections: the patch tokens after layers depth / 3, 2 * depth / 3 and depth - 1
+        for layer in (depth // 3, 2 * depth // 3, depth - 1)[:n_skip]:
+            self.encoder.feature_taps.add(layer, tokens="patches")
         total_params = sum(p.numel() for p in self.encoder.parameters() if p.requires_grad)
         print(f'Backbone trainable parameters: {total_params}')
         self.decoder = DecoderCup(
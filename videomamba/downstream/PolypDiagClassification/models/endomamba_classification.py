@@ -1,5 +1,4 @@
 import os
-from sympy import N
 import torch
 import torch.nn as nn
 from functools import partial
@@ -20,7 +19,7 @@ import math
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../../..")))
 from _mamba.mamba_ssm.modules.mamba_simple import Mamba
-from _mamba.mamba_ssm.ops.triton.layernorm import RMSNorm, layer_norm_fn, rms_norm_fn
+from _mamba.mamba_ssm.ops.backend import RMSNorm, layer_norm_fn, rms_norm_fn
 
 from video_sm.models.positional_encoding import PositionalEncoding
 
@@ -414,7 +413,7 @@ class EndoMamba(nn.Module):
         x = rearrange(x, '(b t) n c -> (b n) t c', b=B, t=T)  # (B*N, T, C)
 
         if inference_params is not None:
-            temporal_pos = self.temporal_pos_embedding.encoding[inference_params.seqlen_offset: inference_params.seqlen_offset + T, :].unsqueeze(0).to(x.device)
+            temporal_pos = self.temporal_pos_embedding.rows(inference_params.seqlen_offset, T).unsqueeze(0)
             x = x + temporal_pos  # (B*N, T, C) + (1, T, C)
         else:
             x = x + self.temporal_pos_embedding(x).unsqueeze(0).to(x.device)  # (B*N, T, C)
@@ -42,11 +42,13 @@ import utils
 # from model.surgformer_base import surgformer_base
 # from model.surgformer_HTA import surgformer_HTA
 # from model.surgformer_HTA_KCA import surgformer_HTA_KCA
-from model.endomamba import endomamba_small
+from model.endomamba import endomamba_small, register_timm_models
 # from model.videomamba import videomamba_small
 from video_sm.models.videomae_v2 import vit_small_patch16_224
 # from model.EndoFM_models.timesformer import get_vit_base_patch16_224, load_config
 
+register_timm_models()  # endomamba_* for create_model
+
 
 def get_args():
     parser = argparse.ArgumentParser(
@@ -18,8 +18,10 @@ from timm.models import create_model
 from downstream_phase.datasets_phase import build_smart_test_dataset as build_dataset
 import utils
 
-from model.endomamba import endomamba_small
-from mamba_ssm.utils.generation import InferenceParams
+from model.endomamba import endomamba_small, register_timm_models
+from video_sm.models.streaming import StaggeredStateStreamer
+
+register_timm_models()  # endomamba_* for create_model
 
 
 def get_args():
@@ -129,10 +131,11 @@ def test_per_sequence(data_loader, model, device="cuda:1", train_seq_len=16, sma
     metric_logger = utils.MetricLogger(delimiter="  ")
     header = "Test:"
     
-    infer_params = InferenceParams(max_seqlen=64, max_batch_size=1)
+    # Two recurrent states reset in alternation every train_seq_len frames (one state without smart test);
+    # the spatial layers run once per frame for both
+    if model.return_last_state:
+        streamer = StaggeredStateStreamer(model, num_states=2 if smart_test else 1, reset_period=train_seq_len)
     frame_counter = 0
-        
-    current_batch = 0
     
     with open(txt_path, 'w') as f:
         f.write('')
@@ -149,39 +152,12 @@ def test_per_sequence(data_loader, model, device="cuda:1", train_seq_len=16, sma
             videos= videos.to(device)
             target = target.to(device)
                 
-            videos = torch.concatenate([videos, videos], dim=0)
-
-            t1 = time.time()
-            if frame_counter % train_seq_len == 0 and frame_counter > train_seq_len:
-                if smart_test:
-                    current_batch = 1  # switch final output to batch 1
-                for layer_idx in infer_params.key_value_memory_dict.keys():
-                    params = infer_params.key_value_memory_dict[layer_idx]
-                    updated_params = []  
-                    for i in range(len(params)):
-                        element = params[i]
-                        element[0] = torch.zeros_like(element[0]).to(element.device)  # clear batch 0 states
-                        updated_params.append(element) 
-                    infer_params.key_value_memory_dict[layer_idx] = tuple(updated_params)
-                
-            elif smart_test and frame_counter % train_seq_len == train_seq_len // 2 and frame_counter > train_seq_len:
-                current_batch  = 0 # switch final output to batch 0
-                for layer_idx in infer_params.key_value_memory_dict.keys():
-                    params = infer_params.key_value_memory_dict[layer_idx]
-                    updated_params = []
-                    for i in range(len(params)):
-                        element = params[i]
-                        element[1] = torch.zeros_like(element[1]).to(element.device)  # clear batch 1 states
-                        updated_params.append(element) 
-                    infer_params.key_value_memory_dict[layer_idx] = tuple(updated_params)
-            time_mem = time.time() - t1
-            
             t1 = time.time()
             if model.return_last_state:
-                output, infer_params = model(videos, infer_params)  
+                output = streamer.step(videos)
             else:
                 output = model(videos)  
-            output = output[current_batch]
+            output = output[0]
             time_com = time.time() - t1
             # print("Used time:", time.time() - t1)
             # print(output.size(), target.size())
@@ -225,7 +201,6 @@ def test_per_sequence(data_loader, model, device="cuda:1", train_seq_len=16, sma
             metric_logger.meters["acc1"].update(acc1.item(), n=batch_size)
             metric_logger.meters["acc5"].update(acc5.item(), n=batch_size)
             metric_logger.meters["time_loader"].update(time_loader, n=batch_size)
-            metric_logger.meters["time_mem"].update(time_mem, n=batch_size)
             metric_logger.meters["time_com"].update(time_com, n=batch_size)
             
             frame_counter += 1
@@ -23,11 +23,13 @@ from downstream_phase.datasets_phase import build_dataset
 import utils
 
 # from model.EndoFM_models.timesformer import get_vit_base_patch16_224, load_config
-from mamba_ssm.utils.generation import InferenceParams
-from model.endomamba import endomamba_small
+from mamba_ssm.utils.inference_params import InferenceParams
+from model.endomamba import endomamba_small, register_timm_models
 # from model.videomamba import videomamba_small
 from video_sm.models.videomae_v2 import vit_small_patch16_224 
 
+register_timm_models()  # endomamba_* for create_model
+
 
 def get_args():
     parser = argparse.ArgumentParser(
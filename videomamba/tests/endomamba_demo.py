@@ -3,7 +3,7 @@ import torch
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "..")))
 from video_sm.models.endomamba import *
-from _mamba.mamba_ssm.utils.generation import InferenceParams
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
 
 # Define batch, sequence length, and feature dimension
 batch, total_length, dim = 2, 8, 224 
@@ -0,0 +1,85 @@
+"""
+Activation memory of every checkpointing policy (see checkpointing.py) for one training step of EndoMamba.
+
+For each policy it prints the checkpointed layers, the estimated activation memory kept for backward
+(ActivationProfile, extrapolated from 1- and 2-frame probes), the measured one (bytes autograd keeps for
+backward, SavedTensorsMeter), the estimated peak (kept + recomputation of the largest checkpointed layer,
+what the auto policy fits in the budget), the forward + backward time and the largest gradient difference
+with "none" (checkpointing must not change the gradients). Runs on CPU with small models:
+
+    python video_sm/benchmarks/checkpoint_memory_report.py --depth 8 --embed-dim 96 --img-size 112 --frames 8 \
+        --batch-size 2 --checkpoint-num 4 --budget-mb 300
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models.checkpointing import POLICIES, ActivationProfile, explicit_checkpoint_layers, \
+    measure_activation_bytes, select_layers
+from video_sm.models.endomamba import EndoMamba
+
+
+parser = argparse.ArgumentParser(description="Activation checkpointing memory report")
+parser.add_argument("--depth", type=int, default=8)
+parser.add_argument("--embed-dim", type=int, default=96)
+parser.add_argument("--img-size", type=int, default=112)
+parser.add_argument("--frames", type=int, default=8)
+parser.add_argument("--batch-size", type=int, default=2)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--checkpoint-num", type=int, default=4, help="k of first_k")
+parser.add_argument("--budget-mb", type=float, default=None, help="budget of auto, half of none's estimate if unset")
+parser.add_argument("--policies", type=str, nargs="+", default=list(POLICIES), choices=POLICIES)
+parser.add_argument("--no-fused-add-norm", action="store_true")
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(0)
+MB = 2 ** 20
+
+model = EndoMamba(
+    img_size=args.img_size, depth=args.depth, embed_dim=args.embed_dim, num_classes=args.num_classes,
+    fused_add_norm=not args.no_fused_add_norm, checkpoint_num=args.checkpoint_num,
+).train()
+x = torch.randn(args.batch_size, 3, args.frames, args.img_size, args.img_size)
+target = torch.randint(args.num_classes, (args.batch_size,))
+
+start = time.perf_counter()
+profile = ActivationProfile(model)
+print(f"EndoMamba depth {args.depth}, dim {args.embed_dim}, {args.img_size}px, batch {args.batch_size} x "
+      f"{args.frames} frames; profiled in {time.perf_counter() - start:.1f} s")
+budget = args.budget_mb * MB if args.budget_mb is not None else profile.estimate((), args.batch_size, args.frames) / 2
+print(f"auto budget: {budget / MB:.1f} MB")
+
+
+def train_step(layers):
+    model.zero_grad(set_to_none=True)
+    with torch.random.fork_rng(), explicit_checkpoint_layers(model, layers):
+        torch.manual_seed(1)  # same drop path draws for every policy
+        start = time.perf_counter()
+        loss = torch.nn.functional.cross_entropy(model(x).mean(1), target)
+        loss.backward()
+        elapsed = time.perf_counter() - start
+    return elapsed, [p.grad.clone() for p in model.parameters() if p.grad is not None]
+
+
+print(f"{'policy':>9} | {'layers':<28} | {'kept MB est.':>12} {'measured':>8} {'peak est.':>9} | "
+      f"{'fwd+bwd s':>9} {'max |dgrad|':>11}")
+reference = None
+for policy in ["none"] + [p for p in args.policies if p != "none"]:
+    layers = select_layers(model, policy, args.batch_size, args.frames, budget, profile)
+    estimated = profile.estimate(layers, args.batch_size, args.frames, recompute_peak=False)
+    peak = profile.estimate(layers, args.batch_size, args.frames)
+    measured = measure_activation_bytes(model, x, layers).total
+    elapsed, grads = train_step(layers)
+    if reference is None:
+        reference = grads
+    diff = max((g - g_ref).abs().max().item() for g, g_ref in zip(grads, reference))
+    layer_list = ",".join(map(str, sorted(layers))) or "-"
+    print(f"{policy:>9} | {layer_list[:28]:<28} | {estimated / MB:>12.1f} {measured / MB:>8.1f} {peak / MB:>9.1f} | "
+          f"{elapsed:>9.2f} {diff:>11.2e}")
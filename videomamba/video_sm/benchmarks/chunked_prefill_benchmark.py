@@ -0,0 +1,96 @@
+"""
+CPU peak memory and throughput of EndoMamba.forward_chunked vs chunk size, for a clip of T frames.
+
+The first row is the one-call parallel forward (chunk = T); every other row must give bit-identical
+logits ("exact" column). Peak memory is the growth of the process high-water mark (VmHWM, reset
+through /proc/self/clear_refs) over the resident set before the forward, after handing freed heap
+memory back with malloc_trim, so it is only reported on Linux / glibc.
+
+    python video_sm/benchmarks/chunked_prefill_benchmark.py --frames 64 --chunk-size 1 4 16 --img-size 224
+"""
+import argparse
+import ctypes
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+
+
+parser = argparse.ArgumentParser(description="Chunked prefill CPU benchmark")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--frames", type=int, default=32)
+parser.add_argument("--chunk-size", type=int, nargs="+", default=[1, 2, 4, 8, 16])
+parser.add_argument("--batch-size", type=int, default=1)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--repeats", type=int, default=2)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(0)
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=True).eval()
+x = torch.randn(args.batch_size, 3, args.frames, args.img_size, args.img_size)
+
+
+def reset_peak_memory():
+    try:
+        ctypes.CDLL("libc.so.6").malloc_trim(0)
+    except (OSError, AttributeError):
+        pass
+    try:
+        with open("/proc/self/clear_refs", "w") as f:
+            f.write("5")
+    except OSError:
+        pass
+
+
+def memory_mb(field="VmHWM"):
+    try:
+        with open("/proc/self/status") as f:
+            for line in f:
+                if line.startswith(field + ":"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return float("nan")
+
+
+def parallel(chunk_size):
+    with torch.no_grad():
+        return model(x, InferenceParams(max_seqlen=args.frames, max_batch_size=args.batch_size))[0]
+
+
+def chunked(chunk_size):
+    return model.forward_chunked(x, chunk_size)[0]
+
+
+def benchmark(fn, chunk_size):
+    out = fn(chunk_size)  # warmup
+    del out
+    reset_peak_memory()
+    rss = memory_mb("VmRSS")
+    start = time.perf_counter()
+    for _ in range(args.repeats):
+        out = fn(chunk_size)
+    elapsed = (time.perf_counter() - start) / args.repeats
+    return out, elapsed, memory_mb() - rss
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, {args.batch_size} x {args.frames} frames, "
+      f"{torch.get_num_threads()} threads")
+print(f"{'chunk':>6} | {'frames/s':>8} | {'peak MB':>8} | exact")
+reference, elapsed, peak = benchmark(parallel, args.frames)
+print(f"{'all':>6} | {args.batch_size * args.frames / elapsed:>8.2f} | {peak:>8.1f} | -")
+for chunk_size in args.chunk_size:
+    out, elapsed, peak = benchmark(chunked, chunk_size)
+    print(f"{chunk_size:>6} | {args.batch_size * args.frames / elapsed:>8.2f} | {peak:>8.1f} | "
+          f"{torch.equal(out, reference)}")
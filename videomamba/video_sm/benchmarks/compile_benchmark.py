@@ -0,0 +1,91 @@
+"""
+CPU throughput of torch.compile (CompiledEndoMamba, see compile.py) vs eager, per inference mode:
+
+- parallel: clips of --frames frames, no states;
+- prefill: clips of --frames frames from a stream start, returning the states;
+- step: single frames, carrying the states.
+
+Reports the compilation time (first call), mean / p50 latency per call, frames/s and the largest
+|logits difference| with eager.
+
+    python video_sm/benchmarks/compile_benchmark.py --model small --img-size 224 --frames 8 --iters 10
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models.compile import MODES, CompiledEndoMamba, mode_function
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+
+
+parser = argparse.ArgumentParser(description="torch.compile vs eager CPU benchmark")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--modes", type=str, nargs="+", default=list(MODES), choices=MODES)
+parser.add_argument("--backend", type=str, default="inductor")
+parser.add_argument("--compile-mode", type=str, default=None, help="torch.compile mode, e.g. max-autotune")
+parser.add_argument("--frames", type=int, default=8, help="clip length of parallel / prefill")
+parser.add_argument("--iters", type=int, default=10)
+parser.add_argument("--warmup", type=int, default=2)
+parser.add_argument("--batch-size", type=int, default=1)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+
+
+def time_calls(fn, inputs_fn):
+    """First call time, latencies (ms) of the next calls after warm-up, and the outputs of every call."""
+    latencies, outputs = [], []
+    for i in range(1 + args.warmup + args.iters):
+        inputs = inputs_fn(i)
+        start = time.perf_counter()
+        out = fn(*inputs)
+        elapsed = time.perf_counter() - start
+        if i == 0:
+            first = elapsed
+        elif i > args.warmup:
+            latencies.append(elapsed)
+        outputs.append(out[0] if isinstance(out, (tuple, list)) else out)
+    return first, np.array(latencies) * 1e3, torch.stack(outputs)
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, batch {args.batch_size}, backend {args.backend}, "
+      f"{torch.get_num_threads()} threads")
+print(f"{'mode':>8} {'path':>9} | {'1st call s':>10} {'mean ms':>8} {'p50':>8} {'frames/s':>8} | {'max |diff|':>10}")
+for mode in args.modes:
+    torch.manual_seed(0)
+    model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=mode != "parallel").eval()
+    eager = mode_function(model, mode)
+    compiled = getattr(CompiledEndoMamba(model, backend=args.backend, mode=args.compile_mode), mode)
+    frames_per_call = args.batch_size * (1 if mode == "step" else args.frames)
+    clips = torch.randn(1 + args.warmup + args.iters, args.batch_size, 3, 1 if mode == "step" else args.frames,
+                        args.img_size, args.img_size)
+
+    results = {}
+    for path, fn in (("eager", eager), ("compiled", compiled)):
+        if mode == "step":
+            # One stream, frame after frame: the states of a call feed the next one
+            carry = {"offset": torch.zeros(args.batch_size, dtype=torch.long), "states": eager.initial_states(args.batch_size)}
+
+            def call(frame, fn=fn, carry=carry):
+                logits, *carry["states"] = fn(frame, carry["offset"], *carry["states"])
+                carry["offset"] = carry["offset"] + 1
+                return logits
+
+            inputs_fn = lambda i: (clips[i, :, :, 0],)
+        else:
+            call, inputs_fn = fn, lambda i: (clips[i],)
+        with torch.no_grad():
+            first, latency, results[path] = time_calls(call, inputs_fn)
+        diff = (results[path] - results["eager"]).abs().max().item()
+        print(f"{mode:>8} {path:>9} | {first:>10.1f} {latency.mean():>8.1f} {np.percentile(latency, 50):>8.1f} "
+              f"{frames_per_call / latency.mean() * 1e3:>8.1f} | {diff:>10.2e}")
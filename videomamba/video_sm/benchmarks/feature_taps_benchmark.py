@@ -0,0 +1,79 @@
+"""
+Memory held by EndoMamba's intermediate features (feature_taps.py) on CPU, for several tap configurations:
+
+- legacy: all tokens at depth / 3, 2 * depth / 3 and depth - 1 (what intermediate_features always kept);
+- none: no tap;
+- cls / patches: the cls or patch tokens of the same three layers.
+
+For each one it prints the bytes held by the features after an inference forward (storages no longer
+needed by anything else), the bytes kept during a training step (saved for backward, with every layer
+checkpointed, plus the features) and the inference time per clip.
+
+    python video_sm/benchmarks/feature_taps_benchmark.py --model tiny --img-size 224 --frames 8 --batch-size 1
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models.checkpointing import SavedTensorsMeter, explicit_checkpoint_layers
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+
+
+parser = argparse.ArgumentParser(description="Feature tap memory CPU benchmark")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--frames", type=int, default=8)
+parser.add_argument("--batch-size", type=int, default=1)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--iters", type=int, default=3)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(0)
+MB = 2 ** 20
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+model = build(img_size=args.img_size, num_classes=7)
+depth = len(model.layers)
+layers = (depth // 3, 2 * depth // 3, depth - 1)
+configs = {"legacy": "all", "none": None, "cls": "cls", "patches": "patches"}
+x = torch.randn(args.batch_size, 3, args.frames, args.img_size, args.img_size)
+
+
+def storage_bytes(tensors, exclude=()):
+    storages = {t.untyped_storage().data_ptr(): t.untyped_storage().nbytes() for t in tensors}
+    return sum(nbytes for ptr, nbytes in storages.items() if ptr not in exclude)
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, batch {args.batch_size} x {args.frames} frames, "
+      f"taps at layers {layers}, {torch.get_num_threads()} threads")
+print(f"{'taps':>8} | {'inference MB':>12} {'ms/clip':>8} | {'training MB':>11} {'of which taps':>13}")
+for name, tokens in configs.items():
+    model.feature_taps.clear()
+    if tokens is not None:
+        for layer in layers:
+            model.feature_taps.add(layer, tokens)
+
+    model.eval()
+    with torch.no_grad():
+        model(x)  # warm-up
+        start = time.perf_counter()
+        for _ in range(args.iters):
+            out = model(x)
+        elapsed = (time.perf_counter() - start) / args.iters
+        # out is a (B, T, num_classes) head output: the features are the only references to the layer outputs
+        inference = storage_bytes(model.get_features(), exclude={out.untyped_storage().data_ptr()})
+
+    model.train()
+    with torch.random.fork_rng(), explicit_checkpoint_layers(model, range(depth)):
+        with SavedTensorsMeter(model) as meter:
+            out = model(x)
+        training = meter.total + storage_bytes(model.get_features(), exclude=meter.storages)
+        taps = storage_bytes(model.get_features())
+        del out
+    print(f"{name:>8} | {inference / MB:>12.2f} {elapsed * 1e3:>8.0f} | {training / MB:>11.2f} {taps / MB:>13.2f}")
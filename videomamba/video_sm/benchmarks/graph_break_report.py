@@ -0,0 +1,45 @@
+"""
+Lists the torch.compile graph breaks of EndoMamba in each inference mode (see compile.py): number of
+graphs, number of breaks, and the breaks grouped by the source location (file:line (function)) that
+caused them, with their reasons.
+
+    python video_sm/benchmarks/graph_break_report.py --model small --img-size 224 --modes parallel prefill step
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models.compile import MODES, graph_breaks, mode_function
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+
+
+parser = argparse.ArgumentParser(description="torch.compile graph break report")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--modes", type=str, nargs="+", default=list(MODES), choices=MODES)
+parser.add_argument("--frames", type=int, default=8, help="clip length of parallel / prefill")
+parser.add_argument("--batch-size", type=int, default=1)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+args = parser.parse_args()
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+total = 0
+for mode in args.modes:
+    torch.manual_seed(0)
+    model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=mode != "parallel").eval()
+    fn = mode_function(model, mode)
+    if mode == "step":
+        inputs = fn.example_inputs(args.batch_size)
+    else:
+        inputs = (torch.randn(args.batch_size, 3, args.frames, args.img_size, args.img_size),)
+    explanation, breaks = graph_breaks(fn, *inputs)
+    total += explanation.graph_break_count
+    print(f"{mode}: {explanation.graph_count} graph(s), {explanation.graph_break_count} break(s)")
+    for location, reasons in breaks.items():
+        print(f"  {location}: {len(reasons)}")
+        for reason in sorted(set(reasons)):
+            print(f"    {reason}")
+print(f"total: {total} break(s)")
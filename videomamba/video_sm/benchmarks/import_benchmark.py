@@ -0,0 +1,75 @@
+"""
+Cold import of the inference surface (endomamba.py, inference_checkpoint.py, streaming.py and the mamba
+layers they use), measured in fresh interpreters on top of `import torch`: wall time and resident memory
+added by the imports (median of --runs), and the heavy or optional modules that got imported on the way.
+
+Exits with status 1 if the time or the memory is over its budget, or if one of the modules of --forbidden
+(imported lazily, on first use) is imported, so it can run as a regression check:
+
+    python video_sm/benchmarks/import_benchmark.py --budget-s 0.5 --budget-mb 32
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+SURFACE = ["video_sm.models.endomamba", "video_sm.models.inference_checkpoint", "video_sm.models.streaming"]
+FORBIDDEN = ["sympy", "timm", "torchvision", "transformers", "triton", "torch._dynamo", "safetensors",
+             "selective_scan_cuda", "causal_conv1d_cuda"]
+
+parser = argparse.ArgumentParser(description="Inference surface import time / memory benchmark")
+parser.add_argument("--modules", type=str, nargs="+", default=SURFACE)
+parser.add_argument("--forbidden", type=str, nargs="*", default=FORBIDDEN)
+parser.add_argument("--runs", type=int, default=5)
+parser.add_argument("--budget-s", type=float, default=0.5, help="import time over `import torch`")
+parser.add_argument("--budget-mb", type=float, default=32, help="resident memory over `import torch`")
+args = parser.parse_args()
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+
+CHILD = """
+import importlib, json, sys, time
+
+def rss():
+    for line in open("/proc/self/status"):
+        if line.startswith("VmRSS"):
+            return int(line.split()[1]) / 1024
+
+start = time.perf_counter()
+import torch
+torch_time, torch_rss = time.perf_counter() - start, rss()
+start = time.perf_counter()
+for name in sys.argv[1].split(","):
+    importlib.import_module(name)
+print(json.dumps({"torch_time": torch_time, "torch_rss": torch_rss, "time": time.perf_counter() - start,
+                  "rss": rss() - torch_rss, "imported": [name for name in sys.argv[2:] if name in sys.modules]}))
+"""
+
+
+def cold_import():
+    env = dict(os.environ)
+    env["PYTHONPATH"] = os.pathsep.join([os.path.join(root, "_mamba"), os.path.join(root, "causal-conv1d"), root,
+                                         env.get("PYTHONPATH", "")])
+    output = subprocess.run([sys.executable, "-W", "ignore", "-c", CHILD, ",".join(args.modules)] + args.forbidden,
+                            env=env, cwd=root, check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+reports = [cold_import() for _ in range(args.runs)]
+median = {key: statistics.median(report[key] for report in reports) for key in ("torch_time", "torch_rss", "time", "rss")}
+imported = sorted({name for report in reports for name in report["imported"]})
+print(f"import torch: {median['torch_time']:.2f} s, {median['torch_rss']:.0f} MB")
+print(f"+ {', '.join(args.modules)}: {median['time']:.3f} s (budget {args.budget_s}), "
+      f"{median['rss']:.1f} MB (budget {args.budget_mb})")
+print(f"forbidden modules imported: {', '.join(imported) if imported else 'none'}")
+failures = []
+if median["time"] > args.budget_s:
+    failures.append("time")
+if median["rss"] > args.budget_mb:
+    failures.append("memory")
+if imported:
+    failures.append("forbidden modules")
+if failures:
+    print(f"FAILED: {', '.join(failures)}")
+    sys.exit(1)
@@ -0,0 +1,122 @@
+"""
+Cold start and resident memory of EndoMamba replicas on one host (CPU), loading:
+
+- pretraining: the full pretraining checkpoint (torch.load), converted by load_state_dict of endomamba.py
+  into a randomly initialized model, as the entry points do;
+- mapped: the inference checkpoint exported from it, memory-mapped by load_inference_checkpoint.
+
+--replicas processes of each kind run at the same time. Each one reports its load time (after imports)
+and, once every replica has run one clip, its resident memory: anonymous (private) and file-backed, and
+its proportional share (PSS, file pages shared by n processes count 1 / n). Without --checkpoint, a
+pretraining checkpoint of a random model is written first, with Adam states and a teacher copy of the
+weights as the training scripts save. Page cache is warm (the files were just written or read).
+
+    python video_sm/benchmarks/inference_checkpoint_benchmark.py --model small --replicas 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+parser = argparse.ArgumentParser(description="Inference checkpoint cold start / memory benchmark")
+parser.add_argument("--model", type=str, default="small", choices=["tiny", "small", "middle"])
+parser.add_argument("--checkpoint", type=str, default=None, help="pretraining checkpoint ('model' of 'encoder.' keys)")
+parser.add_argument("--replicas", type=int, default=4)
+parser.add_argument("--frames", type=int, default=2)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--child", type=str, default=None, help=argparse.SUPPRESS)
+parser.add_argument("--path", type=str, default=None, help=argparse.SUPPRESS)
+args = parser.parse_args()
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+sys.path.append(root)
+
+
+def memory(pid="self"):
+    """RssAnon, RssFile and Pss of a process, in MB."""
+    values = {}
+    for name in (f"/proc/{pid}/status", f"/proc/{pid}/smaps_rollup"):
+        for line in open(name):
+            key, _, value = line.partition(":")
+            if key in ("RssAnon", "RssFile", "Pss"):
+                values[key] = int(value.split()[0]) / 1024
+    return values
+
+
+def run_child():
+    """One replica: loads, runs a clip, reports, and stays alive until its stdin is closed."""
+    import torch
+    torch.set_num_threads(1)
+    import video_sm.models.endomamba as endomamba
+    from video_sm.models.inference_checkpoint import load_inference_checkpoint
+
+    start = time.perf_counter()
+    if args.child == "pretraining":
+        model = getattr(endomamba, f"endomamba_{args.model}")(img_size=args.img_size, num_classes=args.num_classes)
+        checkpoint = torch.load(args.path, map_location="cpu", weights_only=False)
+        endomamba.load_state_dict(model, checkpoint["model"], center=True)
+        del checkpoint
+        model.eval()
+    else:
+        model = load_inference_checkpoint(args.path)
+    load = time.perf_counter() - start
+    with torch.no_grad():
+        model(torch.randn(1, 3, args.frames, args.img_size, args.img_size))
+    print(json.dumps({"load": load}), flush=True)
+    sys.stdin.read()
+
+
+def read_report(replica):
+    """The JSON line of a replica (the model prints its configuration before)."""
+    for line in replica.stdout:
+        if line.startswith("{"):
+            return json.loads(line)
+    raise RuntimeError(f"replica {replica.pid} exited without a report")
+
+
+def save_pretraining_checkpoint(path):
+    import torch
+    import video_sm.models.endomamba as endomamba
+    model = getattr(endomamba, f"endomamba_{args.model}")(img_size=args.img_size, num_classes=args.num_classes)
+    weights = {f"encoder.{k}": v for k, v in model.state_dict().items()}
+    torch.save({
+        "model": weights,
+        "optimizer": {"state": {i: {"exp_avg": torch.randn_like(p), "exp_avg_sq": torch.rand_like(p)}
+                                for i, p in enumerate(model.parameters())}},
+        "teacher": {k: v.clone() for k, v in weights.items()},
+        "scaler": {"scale": 65536.0},
+        "epoch": 499,
+    }, path)
+
+
+if args.child is not None:
+    run_child()
+    sys.exit()
+
+with tempfile.TemporaryDirectory() as tmp:
+    from video_sm.models.inference_checkpoint import export_inference_checkpoint
+
+    if args.checkpoint is None:
+        args.checkpoint = os.path.join(tmp, "pretraining.pth")
+        save_pretraining_checkpoint(args.checkpoint)
+    mapped = os.path.join(tmp, "inference.safetensors")
+    export_inference_checkpoint(args.checkpoint, mapped, f"endomamba_{args.model}",
+                                img_size=args.img_size, num_classes=args.num_classes)
+    print(f"EndoMamba-{args.model}, {args.replicas} replicas: pretraining checkpoint "
+          f"{os.path.getsize(args.checkpoint) / 2 ** 20:.0f} MB, inference checkpoint {os.path.getsize(mapped) / 2 ** 20:.0f} MB")
+    print(f"{'checkpoint':>11} | {'load s':>6} | {'anon MB':>7} {'file MB':>7} {'PSS MB':>7} (per replica, mean)")
+    for kind, path in (("pretraining", args.checkpoint), ("mapped", mapped)):
+        command = [sys.executable, "-W", "ignore", __file__, "--child", kind, "--path", path] + sys.argv[1:]
+        replicas = [subprocess.Popen(command, stdin=subprocess.PIPE, stdout=subprocess.PIPE, text=True)
+                    for _ in range(args.replicas)]
+        reports = [read_report(replica) for replica in replicas]
+        for replica, report in zip(replicas, reports):
+            report.update(memory(replica.pid))
+        for replica in replicas:
+            replica.stdin.close()
+            replica.wait()
+        mean = {key: sum(report[key] for report in reports) / len(reports) for key in reports[0]}
+        print(f"{kind:>11} | {mean['load']:>6.2f} | {mean['RssAnon']:>7.0f} {mean['RssFile']:>7.0f} {mean['Pss']:>7.0f}")
@@ -0,0 +1,118 @@
+"""
+Token embedding of masked pretraining (embed of endomamba_pretrain.py and videomamba_pretrain.py), on CPU:
+
+- full: the patch embedding and positional embeddings of every patch, then x[~mask] as before;
+- visible: only the visible patches are embedded (PatchEmbed.forward_visible), given their positional
+  embeddings.
+
+Checks that both give the same tokens (bit for bit) and the same gradients of the patch embedding and
+positional embeddings (up to float rounding of the weight gradient sum), then times forward and forward + backward at --mask-ratio (tube masks, as the
+pretraining datasets draw them). Exits with status 1 if the tokens or the gradients differ.
+
+    python video_sm/benchmarks/masked_patch_embed_benchmark.py --embed-dim 384 --frames 16 --batch-size 4
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+from einops import rearrange
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+
+
+parser = argparse.ArgumentParser(description="Masked patch embedding benchmark")
+parser.add_argument("--embed-dim", type=int, default=384)
+parser.add_argument("--frames", type=int, default=16)
+parser.add_argument("--batch-size", type=int, default=4)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--mask-ratio", type=float, default=0.9)
+parser.add_argument("--iters", type=int, default=10)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+
+
+def endomamba_pretrain_model():
+    from video_sm.models.endomamba_pretrain import EndoMamba
+    return EndoMamba(img_size=args.img_size, embed_dim=args.embed_dim, depth=2, kernel_size=1,
+                     num_frames=args.frames, fused_add_norm=False, rms_norm=False)
+
+
+def videomamba_pretrain_model():
+    from video_sm.models.videomamba_pretrain import VisionMamba
+    return VisionMamba(img_size=args.img_size, embed_dim=args.embed_dim, depth=2, kernel_size=1,
+                       num_frames=args.frames, fused_add_norm=False, rms_norm=False)
+
+
+def endomamba_full(model, x, mask):
+    x = model.embed(x)
+    B, T, N, C = x.shape
+    return rearrange(x, 'b t n c -> b (t n) c')[~mask].reshape(B, T, -1, C)
+
+
+def videomamba_full(model, x, mask):
+    x = model.embed(x)
+    return x[~mask].reshape(x.shape[0], -1, x.shape[-1])
+
+
+def grads(model, tokens):
+    model.zero_grad()
+    tokens.backward(torch.ones_like(tokens))
+    return {name: p.grad.clone() for name, p in model.named_parameters()
+            if p.grad is not None and ("embed" in name or name == "cls_token")}
+
+
+def tube_masks(batch_size, frames, patches, mask_ratio):
+    """(B, T * N) masks drawn as TubeMaskingGenerator of datasets/masking_generator.py: one per-frame mask, tiled."""
+    num_masks = int(mask_ratio * patches)
+    order = torch.rand(batch_size, patches).argsort(dim=1)
+    mask_per_frame = torch.zeros(batch_size, patches, dtype=torch.bool)
+    mask_per_frame.scatter_(1, order[:, :num_masks], True)
+    return mask_per_frame.repeat(1, frames)
+
+
+def time_per_call(fn):
+    fn()
+    start = time.perf_counter()
+    for _ in range(args.iters):
+        fn()
+    return (time.perf_counter() - start) / args.iters * 1e3
+
+
+torch.manual_seed(0)
+mask = tube_masks(args.batch_size, args.frames, (args.img_size // 16) ** 2, args.mask_ratio)
+x = torch.randn(args.batch_size, 3, args.frames, args.img_size, args.img_size)
+print(f"embed dim {args.embed_dim}, {args.batch_size}x{args.frames} frames of {args.img_size}, "
+      f"mask ratio {args.mask_ratio} ({int((~mask[0]).sum())} of {mask.shape[1]} patches visible)")
+print(f"{'model':>20} | {'path':>7} | {'fwd ms':>7} | {'fwd+bwd ms':>10}")
+
+failed = False
+for name, build, full in (("endomamba_pretrain", endomamba_pretrain_model, endomamba_full),
+                          ("videomamba_pretrain", videomamba_pretrain_model, videomamba_full)):
+    torch.manual_seed(0)
+    model = build().train()
+    model_mask = mask if full is endomamba_full else torch.cat((torch.zeros(args.batch_size, 1, dtype=torch.bool), mask), 1)
+    paths = {"full": lambda: full(model, x, model_mask), "visible": lambda: model.embed(x, model_mask)}
+
+    reference, tokens = paths["full"](), paths["visible"]()
+    same_tokens = torch.equal(reference, tokens)
+    reference_grads, token_grads = grads(model, reference), grads(model, tokens)
+    # The weight gradient sums over other tokens (the full path also over the masked ones, with zero
+    # gradients): equal up to the rounding of the sum
+    same_grads = all((reference_grads[k] - token_grads[k]).abs().max() <= 1e-5 * reference_grads[k].abs().max()
+                     for k in reference_grads)
+    print(f"{name:>20} | tokens identical: {same_tokens}, gradients match: {same_grads}")
+    failed |= not (same_tokens and same_grads)
+
+    for path, fn in paths.items():
+        with torch.no_grad():
+            forward = time_per_call(fn)
+        backward = time_per_call(lambda: fn().sum().backward())
+        print(f"{name:>20} | {path:>7} | {forward:>7.1f} | {backward:>10.1f}")
+
+if failed:
+    print("FAILED: the visible-patch path differs from the full path")
+    sys.exit(1)
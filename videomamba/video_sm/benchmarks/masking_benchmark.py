@@ -0,0 +1,124 @@
+"""
+Pretraining masks per second of the per-sample generators of masking_generator.py (NumPy, one mask per
+__call__, as each DataLoader worker draws them) and of BatchMaskingGenerator (torch, a whole batch per call,
+on CPU and on --device).
+
+Also checks, for every mask type, that the batched masks are drawn like the per-sample ones: the same number
+of masked patches and the same structure (tubes shared by the frames, rows over the whole width), and the
+same frequency of every patch being masked and of every patch being masked together with the first one
+(two-sample z-scores over --samples masks of each, below --max-z), and that a mask depends only on
+(epoch, index). Exits with status 1 if a check fails.
+
+    python video_sm/benchmarks/masking_benchmark.py --frames 16 --mask-ratio 0.9 --batch-size 64
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+# Imported from its directory: the datasets package imports the video decoders
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../datasets")))
+from masking_generator import (
+    BatchMaskingGenerator, RandomMaskingGenerator, RandomRowMaskingGenerator, TubeMaskingGenerator,
+    TubeRowMaskingGenerator
+)
+
+
+parser = argparse.ArgumentParser(description="Pretraining mask generation benchmark")
+parser.add_argument("--frames", type=int, default=16)
+parser.add_argument("--patches", type=int, default=14, help="patches per side (input size / patch size)")
+parser.add_argument("--mask-ratio", type=float, default=0.9)
+parser.add_argument("--batch-size", type=int, default=64)
+parser.add_argument("--samples", type=int, default=20000, help="masks of each kind for the statistical checks")
+parser.add_argument("--max-z", type=float, default=5.0)
+parser.add_argument("--seconds", type=float, default=1.0, help="timing duration per generator")
+parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+args = parser.parse_args()
+device = torch.device(args.device)
+input_size = (args.frames, args.patches, args.patches)
+
+GENERATORS = {
+    "tube": TubeMaskingGenerator,
+    "random": RandomMaskingGenerator,
+    "tube_row": TubeRowMaskingGenerator,
+    "random_row": RandomRowMaskingGenerator,
+}
+
+
+def synchronize():
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def masks_per_second(draw, masks_per_call):
+    draw(0)
+    synchronize()
+    calls, start = 0, time.perf_counter()
+    while time.perf_counter() - start < args.seconds:
+        draw(calls)
+        calls += 1
+    synchronize()
+    return calls * masks_per_call / (time.perf_counter() - start)
+
+
+def frequencies(masks):
+    """Frequency of every patch being masked, and of being masked together with patch 0."""
+    masks = masks.double()
+    return masks.mean(0), (masks * masks[:, :1]).mean(0)
+
+
+def max_z(a, b, n):
+    """Largest two-sample z-score of frequencies a and b, over n samples each."""
+    pooled = (a + b) / 2
+    std = (2 * pooled * (1 - pooled) / n).sqrt()
+    z = (a - b).abs() / std
+    return z[std > 0].max().item() if (std > 0).any() else 0.0
+
+
+def structure(masks, mask_type):
+    """Whether the masks are shared by the frames (tubes) or cover whole rows, as their type requires."""
+    grid = masks.view(-1, args.frames, args.patches, args.patches)
+    if mask_type == "tube":
+        return bool((grid == grid[:, :1]).all())
+    if mask_type in ("tube_row", "random_row"):
+        return bool((grid == grid[..., :1]).all())
+    return True
+
+
+np.random.seed(0)
+failed = False
+print(f"{args.frames}x{args.patches}x{args.patches} patches, mask ratio {args.mask_ratio}, batch size {args.batch_size}, "
+      f"device {device}")
+print(f"{'mask type':>10} | {'count':>5} | {'structure':>9} | {'z masked':>8} | {'z pairs':>7} | {'reproducible':>12} | "
+      f"{'numpy masks/s':>13} | {'batched cpu':>11} | {'batched ' + device.type:>12}")
+for mask_type, generator_cls in GENERATORS.items():
+    generator = generator_cls(input_size, args.mask_ratio)
+    batched = BatchMaskingGenerator(input_size, args.mask_ratio, mask_type=mask_type, seed=0)
+
+    reference = torch.from_numpy(np.stack([generator() for _ in range(args.samples)])).to(torch.bool)
+    masks = torch.cat([batched(torch.arange(start, min(start + 4096, args.samples)))
+                       for start in range(0, args.samples, 4096)])
+    count = bool((masks.sum(1) == reference.sum(1)[0]).all()) and bool((reference.sum(1) == reference.sum(1)[0]).all())
+    shaped = structure(masks, mask_type) and structure(reference, mask_type)
+    (masked_ref, pairs_ref), (masked, pairs) = frequencies(reference), frequencies(masks)
+    z_masked, z_pairs = max_z(masked_ref, masked, args.samples), max_z(pairs_ref, pairs, args.samples)
+    indices = torch.randperm(args.samples)[:args.batch_size]
+    reproducible = (torch.equal(batched(indices, epoch=0), masks[indices])
+                    and torch.equal(batched(indices.to(device), epoch=0).cpu(), masks[indices])
+                    and not torch.equal(batched(indices, epoch=1), masks[indices]))
+    failed |= not (count and shaped and reproducible and z_masked < args.max_z and z_pairs < args.max_z)
+
+    batch = torch.arange(args.batch_size)
+    numpy_rate = masks_per_second(lambda i: generator(), 1)
+    cpu_rate = masks_per_second(lambda i: batched(batch + i * args.batch_size, epoch=0), args.batch_size)
+    device_batch = batch.to(device)
+    device_rate = masks_per_second(lambda i: batched(device_batch + i * args.batch_size, epoch=0), args.batch_size)
+    print(f"{mask_type:>10} | {str(count):>5} | {str(shaped):>9} | {z_masked:>8.2f} | {z_pairs:>7.2f} | "
+          f"{str(reproducible):>12} | {numpy_rate:>13.0f} | {cpu_rate:>11.0f} | {device_rate:>12.0f}")
+
+if failed:
+    print("FAILED: the batched masks differ from the per-sample generators")
+    sys.exit(1)
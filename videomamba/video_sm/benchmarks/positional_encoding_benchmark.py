@@ -0,0 +1,94 @@
+"""
+Cost of the temporal positional encoding per recurrent step (positional_encoding.py), on --device:
+
+- legacy: the former fixed (8192, C) host table, sliced and moved to the device on every step;
+- rows: a single stream offset, rows of the device-resident table (grown in blocks past its end);
+- gather: per-sample offsets of --streams streams, rows computed directly on the device.
+
+Also checks that the rows are the ones of the former table, and streams --frames frames from offset 0
+(past the former 8192-frame limit) to report how often and for how long the table grew.
+
+    python video_sm/benchmarks/positional_encoding_benchmark.py --embed-dim 384 --streams 8 --frames 100000
+"""
+import argparse
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models.positional_encoding import PositionalEncoding
+
+
+parser = argparse.ArgumentParser(description="Temporal positional encoding benchmark")
+parser.add_argument("--embed-dim", type=int, default=384)
+parser.add_argument("--streams", type=int, default=8)
+parser.add_argument("--frames", type=int, default=100000, help="frames of the long stream")
+parser.add_argument("--iters", type=int, default=2000)
+parser.add_argument("--device", type=str, default="cuda" if torch.cuda.is_available() else "cpu")
+args = parser.parse_args()
+device = torch.device(args.device)
+
+
+def legacy_table(d_model, max_len=8192):
+    encoding = torch.zeros(max_len, d_model)
+    pos = torch.arange(0, max_len).float().unsqueeze(dim=1)
+    _2i = torch.arange(0, d_model, step=2).float()
+    encoding[:, 0::2] = torch.sin(pos / (10000 ** (_2i / d_model)))
+    encoding[:, 1::2] = torch.cos(pos / (10000 ** (_2i / d_model)))
+    return encoding
+
+
+def synchronize():
+    if device.type == "cuda":
+        torch.cuda.synchronize()
+
+
+def time_per_call(fn):
+    fn(0)
+    synchronize()
+    start = time.perf_counter()
+    for i in range(args.iters):
+        fn(i)
+    synchronize()
+    return (time.perf_counter() - start) / args.iters * 1e6
+
+
+table = legacy_table(args.embed_dim)
+module = PositionalEncoding(args.embed_dim).to(device)
+offsets = torch.randint(0, 8192 - args.iters, (args.streams,), device=device)
+positions = offsets[:, None] + torch.arange(1, device=device)
+diff_rows = (module.rows(0, 8192).cpu() - table).abs().max().item()
+diff_gather = (module.gather(positions).cpu() - table[positions.cpu()]).abs().max().item()
+print(f"embed dim {args.embed_dim}, {args.streams} streams, device {device}")
+print(f"max |diff| with the former table: rows {diff_rows:.2e}, gather {diff_gather:.2e}")
+
+print(f"{'path':>8} | {'us/step':>8}")
+with torch.no_grad():
+    results = {
+        "legacy": time_per_call(lambda i: table[positions.cpu() + i].to(device)),
+        "rows": time_per_call(lambda i: module.rows(i, 1)),
+        "gather": time_per_call(lambda i: module.gather(positions + i)),
+    }
+for path, us in results.items():
+    print(f"{path:>8} | {us:>8.1f}")
+
+module = PositionalEncoding(args.embed_dim).to(device)
+builds, build_time = 0, 0.0
+start = time.perf_counter()
+with torch.no_grad():
+    for offset in range(args.frames):
+        size = module.encoding.shape[0]
+        step_start = time.perf_counter()
+        module.grow(offset + 1)  # as the streaming entry points do
+        module.rows(offset, 1)
+        if module.encoding.shape[0] != size:
+            synchronize()
+            builds += 1
+            build_time += time.perf_counter() - step_start
+synchronize()
+total = time.perf_counter() - start
+print(f"{args.frames} frames in one stream: table of {module.encoding.shape[0]} rows "
+      f"({module.encoding.numel() * module.encoding.element_size() / 2 ** 20:.1f} MB) built {builds} times, "
+      f"{build_time * 1e3:.1f} ms of {total * 1e3:.0f} ms")
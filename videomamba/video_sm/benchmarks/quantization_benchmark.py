@@ -0,0 +1,93 @@
+"""
+Accuracy and CPU latency of int8 EndoMamba against fp32, in parallel and in recurrent mode.
+
+Parallel: one forward over a --frames clip. Recurrent: forward_stream frame by frame over the same clip.
+For each mode it reports the latency (ms per clip / per frame), the largest |logits - fp32 logits| and
+the top-1 agreement with fp32. The int8 model is --quantized (a tools/quantize_endomamba.py checkpoint, whose
+fp32 weights are --checkpoint), or the fp32 model quantized with the default plan.
+
+    python video_sm/benchmarks/quantization_benchmark.py --model small --quantized endomamba_small_int8.pth \
+        --checkpoint finetuned.pth --clip-dir clips/
+"""
+import argparse
+import copy
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from video_sm.models import endomamba
+from video_sm.models.quantization import DYNAMIC, WEIGHT_ONLY, load_clip_folder, load_quantized, quantize_model
+
+
+parser = argparse.ArgumentParser(description="EndoMamba int8 accuracy / latency report")
+parser.add_argument("--model", type=str, default="small", choices=["tiny", "small", "middle"])
+parser.add_argument("--checkpoint", type=str, default=None)
+parser.add_argument("--quantized", type=str, default=None)
+parser.add_argument("--mode", type=str, default=DYNAMIC, choices=[DYNAMIC, WEIGHT_ONLY])
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--clip-dir", type=str, default=None)
+parser.add_argument("--num-clips", type=int, default=4)
+parser.add_argument("--frames", type=int, default=16)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(0)
+
+model = getattr(endomamba, f"endomamba_{args.model}")(
+    num_classes=args.num_classes, img_size=args.img_size, return_last_state=True).eval()
+if args.checkpoint is not None:
+    state_dict = torch.load(args.checkpoint, map_location="cpu")
+    model.load_state_dict(state_dict.get("model", state_dict.get("module", state_dict)), strict=False)
+if args.quantized is not None:
+    quantized = load_quantized(args.quantized)
+else:
+    quantized = quantize_model(copy.deepcopy(model), mode=args.mode)
+
+if args.clip_dir is not None:
+    clips = list(load_clip_folder(args.clip_dir, args.frames, args.img_size, args.num_clips))
+else:
+    clips = [torch.randn(1, 3, args.frames, args.img_size, args.img_size) for _ in range(args.num_clips)]
+
+
+@torch.no_grad()
+def parallel(net, clip):
+    return net(clip, InferenceParams(max_seqlen=clip.shape[2], max_batch_size=clip.shape[0]))[0]
+
+
+@torch.no_grad()
+def recurrent(net, clip):
+    inference_params = InferenceParams(max_seqlen=clip.shape[2], max_batch_size=clip.shape[0])
+    outs = []
+    for t in range(clip.shape[2]):
+        out, inference_params = net.forward_stream(clip[:, :, t:t + 1], inference_params)
+        outs.append(out)
+    return torch.cat(outs, dim=1)
+
+
+def run(fn, net):
+    fn(net, clips[0])  # warmup
+    outs, elapsed = [], 0.0
+    for clip in clips:
+        start = time.perf_counter()
+        outs.append(fn(net, clip))
+        elapsed += time.perf_counter() - start
+    return torch.cat(outs), elapsed / len(clips)
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, {len(clips)} clips x {args.frames} frames, "
+      f"{torch.get_num_threads()} threads")
+print(f"{'mode':>9} | {'fp32 ms':>9} {'int8 ms':>9} {'speedup':>7} | {'max |diff|':>10} {'top1 agree':>10}")
+for name, fn, unit in (("parallel", parallel, 1), ("recurrent", recurrent, args.frames)):
+    reference, t_fp32 = run(fn, model)
+    out, t_int8 = run(fn, quantized)
+    agree = (out.argmax(-1) == reference.argmax(-1)).float().mean().item()
+    print(f"{name:>9} | {t_fp32 * 1e3 / unit:>9.1f} {t_int8 * 1e3 / unit:>9.1f} {t_fp32 / t_int8:>6.2f}x | "
+          f"{(out - reference).abs().max().item():>10.2e} {agree:>10.2%}")
+print("(recurrent latencies are per frame)")
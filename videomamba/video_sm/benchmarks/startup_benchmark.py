@@ -0,0 +1,96 @@
+"""
+CPU startup time of an EndoMamba worker loading a checkpoint, with and without skip-init (fast_init.py):
+
+- default: the model is built and randomly initialized on CPU, then the checkpoint is copied into it;
+- skip_init: the model is built on the meta device and allocated from the checkpoint.
+
+Every run is a fresh interpreter, timing the import of endomamba.py, the model construction, the
+checkpoint load (torch.load + load_state_dict) and the first forward of one clip. Without --checkpoint,
+the weights of a random model are saved to a temporary file first.
+
+    python video_sm/benchmarks/startup_benchmark.py --model small --img-size 224 --frames 8 --repeats 3
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+
+parser = argparse.ArgumentParser(description="EndoMamba startup time benchmark")
+parser.add_argument("--model", type=str, default="small", choices=["tiny", "small", "middle"])
+parser.add_argument("--checkpoint", type=str, default=None, help="pretraining checkpoint ('model' of 'encoder.' keys)")
+parser.add_argument("--frames", type=int, default=8)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--repeats", type=int, default=3)
+parser.add_argument("--threads", type=int, default=None)
+parser.add_argument("--child", type=str, default=None, choices=["default", "skip_init"], help=argparse.SUPPRESS)
+args = parser.parse_args()
+root = os.path.abspath(os.path.join(os.path.dirname(__file__), "../.."))
+
+
+def run_child():
+    """One worker startup, prints the time of each phase (s) as JSON."""
+    times = {}
+    start = time.perf_counter()
+    import torch
+    if args.threads is not None:
+        torch.set_num_threads(args.threads)
+    sys.path.append(root)
+    import video_sm.models.endomamba as endomamba
+    from video_sm.models.fast_init import meta_device
+    times["import"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with meta_device(args.child == "skip_init"):
+        model = getattr(endomamba, f"endomamba_{args.model}")(img_size=args.img_size, num_classes=args.num_classes)
+    times["build"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    state_dict = torch.load(args.checkpoint, map_location="cpu")
+    endomamba.load_state_dict(model, state_dict["model"], center=True)
+    times["load"] = time.perf_counter() - start
+
+    start = time.perf_counter()
+    with torch.no_grad():
+        model.eval()(torch.randn(1, 3, args.frames, args.img_size, args.img_size))
+    times["first forward"] = time.perf_counter() - start
+    print(json.dumps(times))
+
+
+def save_random_checkpoint(path):
+    import torch
+    sys.path.append(root)
+    import video_sm.models.endomamba as endomamba
+    model = getattr(endomamba, f"endomamba_{args.model}")(img_size=args.img_size, num_classes=args.num_classes)
+    torch.save({"model": {f"encoder.{k}": v for k, v in model.state_dict().items()}}, path)
+
+
+if args.child is not None:
+    run_child()
+    sys.exit()
+
+with tempfile.TemporaryDirectory() as tmp:
+    if args.checkpoint is None:
+        args.checkpoint = os.path.join(tmp, "checkpoint.pth")
+        save_random_checkpoint(args.checkpoint)
+    results = {}
+    for mode in ("default", "skip_init"):
+        command = [sys.executable, "-W", "ignore", __file__, "--child", mode] + sys.argv[1:]
+        if "--checkpoint" not in sys.argv:
+            command += ["--checkpoint", args.checkpoint]
+        runs = []
+        for _ in range(args.repeats):
+            out = subprocess.run(command, check=True, capture_output=True, text=True).stdout
+            runs.append(json.loads(out.strip().splitlines()[-1]))
+        results[mode] = {phase: np.median([run[phase] for run in runs]) for phase in runs[0]}
+
+phases = list(results["default"])
+print(f"EndoMamba-{args.model} {args.img_size}px, {args.frames} frames, median of {args.repeats} fresh processes (s)")
+print(f"{'mode':>10} | " + " ".join(f"{phase:>13}" for phase in phases) + f" | {'total':>7}")
+for mode, times in results.items():
+    print(f"{mode:>10} | " + " ".join(f"{times[phase]:>13.2f}" for phase in phases) + f" | {sum(times.values()):>7.2f}")
@@ -0,0 +1,77 @@
+"""
+Output drift of recurrent inference with reduced-precision state storage, against fp32 states.
+
+The same stream is fed to one StreamingEngine per storage dtype, frame by frame, for --frames frames
+(temporally correlated noise: every frame keeps --correlation of the previous one). At every report
+point it prints, for each dtype, the largest and mean |logits - fp32 logits| over the last window, the
+top-1 agreement with fp32 since the start, and the state bytes per stream.
+
+    python video_sm/benchmarks/state_precision_drift.py --frames 10000 --img-size 224 --dtypes bf16 fp16 int8
+"""
+import argparse
+import math
+import os
+import sys
+import time
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from _mamba.mamba_ssm.utils.state_cache import STATE_DTYPES
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+from video_sm.models.streaming import StreamingEngine
+
+
+parser = argparse.ArgumentParser(description="Reduced-precision recurrent state drift")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--frames", type=int, default=10000)
+parser.add_argument("--report-every", type=int, default=1000)
+parser.add_argument("--dtypes", type=str, nargs="+", default=["bf16", "fp16", "int8"],
+                    choices=[name for name in STATE_DTYPES if name != "fp32"])
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--correlation", type=float, default=0.95)
+parser.add_argument("--threads", type=int, default=None)
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(args.seed)
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=True).eval()
+
+engines = {"fp32": StreamingEngine(model, max_streams=1)}
+for name in args.dtypes:
+    engines[name] = StreamingEngine(model, max_streams=1, state_dtype=STATE_DTYPES[name])
+for engine in engines.values():
+    engine.join(0)
+
+fp32_bytes = engines["fp32"].state_nbytes_per_stream
+print(f"EndoMamba-{args.model} {args.img_size}px, {args.frames} frames, {torch.get_num_threads()} threads")
+print("state per stream: " + ", ".join(
+    f"{name} {engine.state_nbytes_per_stream / 1024:.1f} KiB ({fp32_bytes / engine.state_nbytes_per_stream:.2f}x)"
+    for name, engine in engines.items()))
+print(f"{'frames':>7} | " + " | ".join(f"{name + ' max':>10} {'mean':>9} {'top1':>6}" for name in args.dtypes))
+
+window = {name: [0.0, 0.0] for name in args.dtypes}  # max, sum of |diff| over the report window
+agree = {name: 0 for name in args.dtypes}
+frame = torch.randn(3, args.img_size, args.img_size)
+start = time.perf_counter()
+for t in range(1, args.frames + 1):
+    frame = args.correlation * frame + math.sqrt(1 - args.correlation ** 2) * torch.randn_like(frame)
+    reference = engines["fp32"].step({0: frame})[0]
+    for name in args.dtypes:
+        logits = engines[name].step({0: frame})[0]
+        diff = (logits - reference).abs()
+        window[name][0] = max(window[name][0], diff.max().item())
+        window[name][1] += diff.mean().item()
+        agree[name] += int(logits.argmax() == reference.argmax())
+    if t % args.report_every == 0 or t == args.frames:
+        num_window = (t - 1) % args.report_every + 1
+        print(f"{t:>7} | " + " | ".join(
+            f"{window[name][0]:>10.2e} {window[name][1] / num_window:>9.2e} {agree[name] / t:>6.2%}"
+            for name in args.dtypes))
+        window = {name: [0.0, 0.0] for name in args.dtypes}
+print(f"{(time.perf_counter() - start) / args.frames * 1e3:.1f} ms per frame for {len(engines)} engines")
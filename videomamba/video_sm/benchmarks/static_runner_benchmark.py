@@ -0,0 +1,74 @@
+"""
+CPU per-frame latency of single-frame recurrent inference: forward_stream vs StaticFrameRunner.
+
+Reports mean / p50 / p95 / std of the step latency, the tensor allocations of one step after warm-up
+(AllocationCounter) and the largest difference between the logits of the two paths.
+
+    python video_sm/benchmarks/static_runner_benchmark.py --frames 50 --batch-size 1 --img-size 224
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from _mamba.mamba_ssm.utils.workspace import AllocationCounter
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+from video_sm.models.streaming import StaticFrameRunner
+
+
+parser = argparse.ArgumentParser(description="Static-shape recurrent step CPU benchmark")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--frames", type=int, default=50)
+parser.add_argument("--warmup", type=int, default=3)
+parser.add_argument("--batch-size", type=int, default=1)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(0)
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=True).eval()
+frames = torch.randn(args.warmup + args.frames, args.batch_size, 3, args.img_size, args.img_size)
+
+
+class EagerRunner:
+    def __init__(self):
+        self.inference_params = InferenceParams(max_seqlen=len(frames), max_batch_size=args.batch_size)
+
+    @torch.no_grad()
+    def step(self, frame):
+        out, self.inference_params = model.forward_stream(frame.unsqueeze(2), self.inference_params)
+        return out[:, 0]
+
+
+def run(runner):
+    latencies, outputs = [], []
+    for i, frame in enumerate(frames[:-1]):
+        start = time.perf_counter()
+        out = runner.step(frame)
+        if i >= args.warmup:
+            latencies.append(time.perf_counter() - start)
+        outputs.append(out.clone())
+    with AllocationCounter() as counter:
+        out = runner.step(frames[-1])
+    outputs.append(out.clone())
+    return np.array(latencies) * 1e3, counter, torch.stack(outputs)
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, batch {args.batch_size}, {torch.get_num_threads()} threads")
+print(f"{'runner':>14} | {'mean ms':>8} {'p50':>8} {'p95':>8} {'std':>6} | {'allocs/step':>11} {'MB/step':>8}")
+results = {}
+for name, runner in (("forward_stream", EagerRunner()), ("static", StaticFrameRunner(model, args.batch_size))):
+    latency, counter, results[name] = run(runner)
+    print(f"{name:>14} | {latency.mean():>8.1f} {np.percentile(latency, 50):>8.1f} "
+          f"{np.percentile(latency, 95):>8.1f} {latency.std():>6.1f} | {counter.count:>11} {counter.nbytes / 2 ** 20:>8.1f}")
+print(f"max |logits difference|: {(results['static'] - results['forward_stream']).abs().max().item():.2e}")
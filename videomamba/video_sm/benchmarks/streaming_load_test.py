@@ -0,0 +1,99 @@
+"""
+CPU load generator for StreamingEngine: frames/s and per-stream latency vs number of concurrent streams.
+
+Every tick, each live stream delivers a frame with probability 1 - drop_prob (camera jitter). With
+--churn, a stream leaves with that probability per tick and a fresh one takes its slot. --sequential
+runs the same ticks with one forward per stream, as a baseline for the batched ticks. With --burst K,
+every stream delivers K frames per tick (decoder catch-up, offline replay), run as one chunked step.
+--state-dtype keeps the state pool in bf16 / fp16 / int8.
+
+    python video_sm/benchmarks/streaming_load_test.py --streams 1 2 4 8 --ticks 20 --img-size 224
+"""
+import argparse
+import os
+import random
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from _mamba.mamba_ssm.utils.state_cache import STATE_DTYPES
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+from video_sm.models.streaming import StreamingEngine
+
+
+parser = argparse.ArgumentParser(description="Multi-stream recurrent inference load test")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--streams", type=int, nargs="+", default=[1, 2, 4, 8])
+parser.add_argument("--ticks", type=int, default=20)
+parser.add_argument("--warmup", type=int, default=2)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--drop-prob", type=float, default=0.0)
+parser.add_argument("--churn", type=float, default=0.0)
+parser.add_argument("--burst", type=int, default=1)
+parser.add_argument("--sequential", action="store_true")
+parser.add_argument("--threads", type=int, default=None)
+parser.add_argument("--state-dtype", type=str, default=None, choices=list(STATE_DTYPES))
+parser.add_argument("--seed", type=int, default=0)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(args.seed)
+random.seed(args.seed)
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=True).eval()
+
+
+def run(num_streams):
+    engine = StreamingEngine(model, max_streams=num_streams,
+                             state_dtype=STATE_DTYPES[args.state_dtype] if args.state_dtype else None)
+    next_id = 0
+    for _ in range(num_streams):
+        engine.join(next_id)
+        next_id += 1
+    latencies = {}  # stream_id -> [seconds]
+    num_frames, total_time = 0, 0.0
+    for tick in range(args.warmup + args.ticks):
+        if args.churn > 0:
+            for stream_id in list(engine.slots):
+                if random.random() < args.churn:
+                    engine.leave(stream_id)
+                    engine.join(next_id)
+                    next_id += 1
+        shape = (3, args.img_size, args.img_size) if args.burst == 1 else (3, args.burst, args.img_size, args.img_size)
+        frames = {stream_id: torch.randn(shape) for stream_id in engine.slots if random.random() >= args.drop_prob}
+        if not frames:
+            continue
+        start = time.perf_counter()
+        if args.sequential:
+            finished = {}
+            for stream_id, frame in frames.items():
+                engine.step({stream_id: frame})
+                finished[stream_id] = time.perf_counter() - start
+        else:
+            engine.step(frames)
+            finished = dict.fromkeys(frames, time.perf_counter() - start)
+        if tick < args.warmup:
+            continue
+        total_time += time.perf_counter() - start
+        num_frames += len(frames) * args.burst
+        for stream_id, latency in finished.items():
+            latencies.setdefault(stream_id, []).append(latency)
+    all_latencies = np.array([l for ls in latencies.values() for l in ls]) * 1e3
+    per_stream = np.array([np.mean(ls) for ls in latencies.values()]) * 1e3
+    return num_frames / total_time, all_latencies, per_stream
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, {'sequential' if args.sequential else 'batched'} ticks, "
+      f"{args.burst} frame(s) per stream per tick, {torch.get_num_threads()} threads")
+print(f"{'streams':>7} | {'frames/s':>8} | {'lat mean ms':>11} {'p50':>8} {'p95':>8} | "
+      f"{'per-stream mean min':>19} {'max':>8}")
+for num_streams in args.streams:
+    fps, latency, per_stream = run(num_streams)
+    print(f"{num_streams:>7} | {fps:>8.2f} | {latency.mean():>11.1f} {np.percentile(latency, 50):>8.1f} "
+          f"{np.percentile(latency, 95):>8.1f} | {per_stream.min():>19.1f} {per_stream.max():>8.1f}")
@@ -1,4 +1,6 @@
 import numpy as np
+import torch
+from torch.utils.data._utils.collate import default_collate
 
 
 class TubeMaskingGenerator:
@@ -108,4 +110,140 @@ class RandomRowMaskingGenerator:
             mask_row.reshape(self.frames, self.height)[:, :, np.newaxis], 
             (1, 1, self.width)
         ).flatten()
-        return mask 
\ No newline at end of file
+        return mask 
+
+
+def _mul32_(x, c):
+    """x = (x * c) mod 2 ** 32 in place, for x, c < 2 ** 32, without overflowing int64."""
+    if c < 2 ** 31:
+        return x.mul_(c).bitwise_and_(0xFFFFFFFF)
+    high_bit = (x & 1) << 31  # x * 2 ** 31 mod 2 ** 32
+    return x.mul_(c - 2 ** 31).add_(high_bit).bitwise_and_(0xFFFFFFFF)
+
+
+def _hash32(x):
+    """Integer hash (lowbias32) of the low 32 bits of an int64 tensor."""
+    x = x & 0xFFFFFFFF
+    x ^= x >> 16
+    _mul32_(x, 0x7FEB352D)
+    x ^= x >> 15
+    _mul32_(x, 0x846CA68B)
+    x ^= x >> 16
+    return x
+
+
+class BatchMaskingGenerator:
+    """
+    The masks of the generators above for a whole batch in one call, with torch: (B, T * H * W) bool masks,
+    True where masked, for mask_type 'tube' (TubeMaskingGenerator), 'random' (RandomMaskingGenerator),
+    'tube_row' (TubeRowMaskingGenerator) or 'random_row' (RandomRowMaskingGenerator).
+
+    The mask of a sample depends only on (seed, epoch, index of the sample): every position gets a key
+    hashed from them, and the positions of the smallest keys are masked, a uniformly drawn subset of the
+    same size as the shuffles of the generators above. The masks are then the same whichever worker, batch
+    or device draws them, so they can be made in the collate function or on the training device:
+
+        masks = generator(indices, epoch=epoch, device=device)
+
+    The indices reach it with the samples: see MaskingCollate.
+    """
+    MASK_TYPES = ('tube', 'random', 'tube_row', 'random_row')
+
+    def __init__(self, input_size, mask_ratio, mask_type='tube', seed=0):
+        if mask_type not in self.MASK_TYPES:
+            raise ValueError(f"mask_type must be one of {self.MASK_TYPES}, got {mask_type!r}")
+        if not isinstance(input_size, tuple):
+            input_size = (input_size, ) * 3
+        self.frames, self.height, self.width = input_size
+        self.mask_type = mask_type
+        self.seed = seed
+        self.epoch = 0
+        self.total_patches = self.frames * self.height * self.width
+        # Positions drawn from (last dimension) and how many of them are masked
+        if mask_type == 'tube':
+            self.draw_shape = (self.height * self.width, )
+            self.num_mask = int(mask_ratio * self.height * self.width)
+            self.total_masks = self.frames * self.num_mask
+        elif mask_type == 'random':
+            self.draw_shape = (self.total_patches, )
+            self.num_mask = int(mask_ratio * self.total_patches)
+            self.total_masks = self.num_mask
+        elif mask_type == 'tube_row':
+            self.draw_shape = (self.frames, self.height)
+            self.num_mask = int(mask_ratio * self.height)
+            self.total_masks = self.frames * self.num_mask * self.width
+        else:
+            self.draw_shape = (self.frames * self.height, )
+            self.num_mask = self.frames * int(mask_ratio * self.height)
+            self.total_masks = self.num_mask * self.width
+
+    def __repr__(self):
+        repr_str = "Batch masks ({}): total patches {}, mask patches {}".format(
+            self.mask_type, self.total_patches, self.total_masks
+        )
+        return repr_str
+
+    def set_epoch(self, epoch):
+        self.epoch = epoch
+
+    def keys(self, indices, epoch):
+        """
+        (B, *draw_shape) int64 keys of the samples of indices (B, ) at epoch: a hash of (seed, epoch, index,
+        position) followed by the position, so that no two positions of a sample have the same key.
+        """
+        sample = _hash32(_hash32(_hash32(torch.full_like(indices, self.seed)) ^ epoch) ^ indices)
+        count = int(np.prod(self.draw_shape))
+        positions = torch.arange(count, device=indices.device).view(self.draw_shape)
+        keys = _hash32(sample.view((-1, ) + (1, ) * len(self.draw_shape)) ^ positions)
+        return (keys << (count - 1).bit_length()) | positions
+
+    def __call__(self, indices, epoch=None, device=None):
+        indices = torch.as_tensor(indices, dtype=torch.int64, device=device)
+        keys = self.keys(indices, self.epoch if epoch is None else epoch)
+        # The num_mask smallest keys are masked: select the smaller of the masked and visible sets
+        count = keys.shape[-1]
+        if self.num_mask <= count // 2:
+            masked = keys.topk(self.num_mask, dim=-1, largest=False, sorted=False).indices
+            mask = torch.zeros(keys.shape, dtype=torch.bool, device=keys.device).scatter_(-1, masked, True)
+        else:
+            visible = keys.topk(count - self.num_mask, dim=-1, largest=True, sorted=False).indices
+            mask = torch.ones(keys.shape, dtype=torch.bool, device=keys.device).scatter_(-1, visible, False)
+        B = indices.shape[0]
+        if self.mask_type == 'tube':
+            mask = mask.repeat(1, self.frames)
+        elif self.mask_type in ('tube_row', 'random_row'):
+            mask = mask.view(B, self.frames, self.height, 1).expand(-1, -1, -1, self.width)
+        return mask.reshape(B, self.total_patches)
+
+
+class MaskingCollate:
+    """
+    collate_fn drawing the masks of a batch with a BatchMaskingGenerator. The samples of the dataset end with
+    their index (e.g. __getitem__ returns (process_data, index) instead of (process_data, mask)); the rest of
+    every sample is collated with collate_fn and the (B, T * H * W) masks of the indices are appended:
+
+        collate = MaskingCollate(BatchMaskingGenerator(window_size, mask_ratio, seed=seed))
+        loader = DataLoader(dataset, batch_size, sampler=sampler, collate_fn=collate, num_workers=workers)
+        for epoch in range(epochs):
+            collate.set_epoch(epoch)
+            for process_data, masks in loader:
+                ...
+
+    The workers collate with the copy of collate they got when the loader was iterated, so set_epoch is
+    called before the epoch's iteration and the loader must not use persistent_workers.
+    """
+    def __init__(self, generator, collate_fn=default_collate):
+        self.generator = generator
+        self.collate_fn = collate_fn
+
+    def set_epoch(self, epoch):
+        self.generator.set_epoch(epoch)
+
+    def __call__(self, batch):
+        indices = [sample[-1] for sample in batch]
+        samples = [sample[:-1] if len(sample) > 2 else sample[0] for sample in batch]
+        collated = self.collate_fn(samples)
+        masks = self.generator(indices)
+        if len(batch[0]) > 2:
+            return (*collated, masks)
+        return collated, masks
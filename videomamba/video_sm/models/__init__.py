@@ -1,4 +1,20 @@
-from .clip import clip_b16, clip_l14, clip_l14_336
+# Imported on first access, so that importing one model (e.g. video_sm.models.endomamba) does not import the others
+_LAZY_ATTRIBUTES = {
+    "clip_b16": ".clip",
+    "clip_l14": ".clip",
+    "clip_l14_336": ".clip",
+}
+__all__ = list(_LAZY_ATTRIBUTES)
+
+
+def __getattr__(name):
+    if name not in _LAZY_ATTRIBUTES:
+        raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
+    import importlib
+
+    value = getattr(importlib.import_module(_LAZY_ATTRIBUTES[name], __name__), name)
+    globals()[name] = value
+    return value
 # from .modeling_finetune import (
 #     vit_base_patch16_224, 
 #     vit_base_patch16_384, 
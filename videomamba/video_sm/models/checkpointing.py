@@ -0,0 +1,180 @@
+"""
+Activation checkpointing policies for EndoMamba (EndoMamba(checkpoint_policy=...)).
+
+A checkpointed Block only keeps its inputs (hidden_states, residual) for backward and recomputes the
+add + norm + mixer in backward. Which layers are checkpointed is chosen by the policy:
+
+- "none": no layer;
+- "all": every layer;
+- "first_k": the first checkpoint_num layers (what use_checkpoint=True, checkpoint_num=k selects);
+- "spatial" / "temporal": the bidirectional (spatial) / causal (temporal) layers;
+- "auto": as few layers as possible for the estimated activation memory of the batch to fit in
+  checkpoint_budget bytes, the layers saving the most first;
+- a collection of layer indices.
+
+Estimates come from an ActivationProfile: the bytes saved for backward by every layer, with and without
+checkpointing, measured (saved_tensors_hooks) on two probe clips of 1 and 2 frames and extrapolated
+linearly in batch_size * num_frames (every saved activation is per token). The estimate of a policy
+adds the recompute peak of backward: the full activations of the largest checkpointed layer.
+Measuring the profile takes 4 forwards with grad; EndoMamba runs them once, in its first training
+forward, unless EndoMamba.profile_activations() was called before.
+"""
+from collections import OrderedDict
+from contextlib import contextmanager
+
+import torch
+
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+
+POLICIES = ("none", "all", "first_k", "spatial", "temporal", "auto")
+OTHER = "other"  # patch embedding, positional embeddings, final norm and head
+
+
+class SavedTensorsMeter:
+    """
+    Counts the bytes of the tensors autograd saves for backward (each storage once, parameters excluded)
+    while active, per Block of model (keys are layer indices, OTHER for the rest).
+    """
+
+    def __init__(self, model):
+        self.model = model
+        self.parameter_storages = {p.untyped_storage().data_ptr() for p in model.parameters()}
+
+    def __enter__(self):
+        self.bytes = OrderedDict()
+        self.storages = set()
+        self.current = OTHER
+        self.handles = []
+        for idx, layer in enumerate(self.model.layers):
+            self.handles.append(layer.register_forward_pre_hook(lambda module, args, idx=idx: self._enter_layer(idx)))
+            self.handles.append(layer.register_forward_hook(lambda module, args, out: self._enter_layer(OTHER)))
+        self.hooks = torch.autograd.graph.saved_tensors_hooks(self._pack, lambda t: t)
+        self.hooks.__enter__()
+        return self
+
+    def __exit__(self, *exc):
+        self.hooks.__exit__(*exc)
+        for handle in self.handles:
+            handle.remove()
+
+    def _enter_layer(self, key):
+        self.current = key
+
+    def _pack(self, t):
+        storage = t.untyped_storage()
+        ptr = storage.data_ptr()
+        if ptr not in self.storages and ptr not in self.parameter_storages:
+            self.storages.add(ptr)
+            self.bytes[self.current] = self.bytes.get(self.current, 0) + storage.nbytes()
+        return t
+
+    @property
+    def total(self):
+        return sum(self.bytes.values())
+
+
+@contextmanager
+def explicit_checkpoint_layers(model, layers):
+    """Runs model with layers checkpointed, whatever its checkpoint_policy."""
+    policy = model.checkpoint_policy
+    model.checkpoint_policy = frozenset(layers)
+    try:
+        yield model
+    finally:
+        model.checkpoint_policy = policy
+
+
+def measure_activation_bytes(model, x, layers=()):
+    """
+    Runs model(x) with grad and layers checkpointed, and returns the SavedTensorsMeter: bytes kept for
+    backward in total (meter.total) and per layer (meter.bytes). The graph is freed on return.
+    A return_last_state model runs from fresh states; its temporal layers are then never checkpointed.
+    """
+    with torch.random.fork_rng(), torch.enable_grad(), explicit_checkpoint_layers(model, layers):
+        with SavedTensorsMeter(model) as meter:
+            if model.return_last_state:
+                out = model(x, InferenceParams(max_seqlen=x.shape[2], max_batch_size=x.shape[0]))
+            else:
+                out = model(x)
+        del out
+    return meter
+
+
+class ActivationProfile:
+    def __init__(self, model, batch_size=1):
+        """Measures the bytes saved by every layer, for 1- and 2-frame probe clips, without and with checkpointing."""
+        self.num_layers = len(model.layers)
+        img_size = model.patch_embed.img_size
+        channels = model.patch_embed.proj.in_channels
+        device = next(model.parameters()).device
+        self.tubelet = model.patch_embed.tubelet_size
+        self.batch_size = batch_size
+        self.full, self.checkpointed = [], []
+        for frames in (self.tubelet, 2 * self.tubelet):
+            x = torch.randn(batch_size, channels, frames, *img_size, device=device)
+            self.full.append(measure_activation_bytes(model, x).bytes)
+            self.checkpointed.append(measure_activation_bytes(model, x, range(self.num_layers)).bytes)
+
+    def _extrapolate(self, probes, key, batch_size, num_frames):
+        one, two = probes[0].get(key, 0), probes[1].get(key, 0)
+        units = batch_size / self.batch_size * num_frames / self.tubelet  # in multiples of the first probe
+        return int(one + (two - one) * (units - 1))
+
+    def layer_bytes(self, idx, batch_size, num_frames, checkpointed=False):
+        return self._extrapolate(self.checkpointed if checkpointed else self.full, idx, batch_size, num_frames)
+
+    def estimate(self, layers, batch_size, num_frames, recompute_peak=True):
+        """Estimated bytes kept for backward with layers checkpointed, plus (recompute_peak) the recompute peak."""
+        layers = set(layers)
+        total = self._extrapolate(self.full, OTHER, batch_size, num_frames)
+        for idx in range(self.num_layers):
+            total += self.layer_bytes(idx, batch_size, num_frames, checkpointed=idx in layers)
+        if recompute_peak:
+            total += max((self.layer_bytes(idx, batch_size, num_frames) for idx in layers), default=0)
+        return total
+
+
+def check_policy(policy, num_layers, budget=None):
+    """Raises a ValueError if policy is not a policy of a model of num_layers layers, with budget for "auto"."""
+    if isinstance(policy, str):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown checkpoint policy {policy!r}, expected one of {POLICIES} or layer indices")
+        if policy == "auto" and (budget is None or budget <= 0):
+            raise ValueError(f"The auto checkpoint policy needs a budget in bytes, got checkpoint_budget={budget!r}")
+        return
+    try:
+        layers = list(policy)
+    except TypeError:
+        raise ValueError(f"Checkpoint policy {policy!r} is neither one of {POLICIES} nor layer indices") from None
+    invalid = [idx for idx in layers if not isinstance(idx, int) or not 0 <= idx < num_layers]
+    if invalid:
+        raise ValueError(f"Checkpoint policy layers {invalid} are not layer indices of a {num_layers}-layer model")
+
+
+def select_layers(model, policy, batch_size=None, num_frames=None, budget=None, profile=None):
+    """Indices of the layers policy checkpoints (batch_size, num_frames and budget are only used by "auto")."""
+    check_policy(policy, len(model.layers), budget)
+    if not isinstance(policy, str):
+        return frozenset(policy)
+    indices = range(len(model.layers))
+    if policy == "none":
+        return frozenset()
+    if policy == "all":
+        return frozenset(indices)
+    if policy == "first_k":
+        return frozenset(indices[:model.checkpoint_num])
+    if policy in ("spatial", "temporal"):
+        return frozenset(i for i in indices if model.layers[i].bimamba == (policy == "spatial"))
+
+    profile = ActivationProfile(model) if profile is None else profile
+    savings = sorted(
+        indices,
+        key=lambda i: profile.layer_bytes(i, batch_size, num_frames) - profile.layer_bytes(i, batch_size, num_frames, True),
+        reverse=True,
+    )
+    layers = set()
+    for idx in savings:
+        if profile.estimate(layers, batch_size, num_frames) <= budget:
+            break
+        layers.add(idx)
+    return frozenset(layers)
@@ -0,0 +1,86 @@
+"""
+torch.compile of EndoMamba, specialized per inference mode.
+
+A compiled model guards on every Python-level branch it took (inference_params or not, the temporal
+offset, the clip length, ...), so calling one compiled forward in several modes keeps recompiling it.
+CompiledEndoMamba compiles one callable per mode instead, each with its branches fixed:
+
+- parallel(x): forward without states (a model built without return_last_state);
+- prefill(clip): a clip from a stream start, -> (logits, *states) (RecurrentPrefill);
+- step(frame, offset, *states): one frame, -> (logits, *new_states) (RecurrentStep). The offset is a
+  tensor, so the temporal position changes at every frame without a recompilation.
+
+On CPU the selective scan is the opaque mamba_ssm::selective_scan_chunks custom op (see
+selective_scan_interface.py): the compiler fuses everything around it and never unrolls the recurrence.
+
+    compiled = CompiledEndoMamba(endomamba_small(num_classes=7, return_last_state=True).eval())
+    logits, *states = compiled.prefill(clip)
+    offset = torch.full((clip.shape[0],), clip.shape[2])
+    logits, *states = compiled.step(frame, offset, *states)
+
+graph_breaks lists the graph breaks of a callable, by source location, e.g. for benchmarks/graph_break_report.py.
+"""
+import os
+from collections import OrderedDict
+
+import torch
+
+from video_sm.models.export import RecurrentPrefill, RecurrentStep
+
+MODES = ("parallel", "prefill", "step")
+
+
+class CompiledEndoMamba:
+    def __init__(self, model, backend="inductor", mode=None, dynamic=False, fullgraph=False):
+        """
+        Args:
+            model (EndoMamba): model in eval mode. prefill / step need return_last_state=True,
+                parallel needs return_last_state=False.
+            backend, mode, dynamic, fullgraph: passed to torch.compile for every mode.
+        """
+        self.model = model
+        self.compile_kwargs = dict(backend=backend, mode=mode, dynamic=dynamic, fullgraph=fullgraph)
+        if model.return_last_state:
+            self.prefill_module = RecurrentPrefill(model)
+            self.step_module = RecurrentStep(model)
+            self.prefill = torch.compile(self.prefill_module, **self.compile_kwargs)
+            self.step = torch.compile(self.step_module, **self.compile_kwargs)
+        else:
+            self.parallel = torch.compile(model, **self.compile_kwargs)
+
+    @property
+    def modes(self):
+        return ("prefill", "step") if self.model.return_last_state else ("parallel",)
+
+    def initial_states(self, batch_size=1):
+        return self.step_module.initial_states(batch_size)
+
+
+def mode_function(model, mode):
+    """The eager callable of mode, the one CompiledEndoMamba compiles."""
+    if mode == "parallel":
+        assert not model.return_last_state, "parallel mode needs a model built with return_last_state=False"
+        return model
+    return RecurrentPrefill(model) if mode == "prefill" else RecurrentStep(model)
+
+
+def _location(frame):
+    return f"{os.path.relpath(frame.filename)}:{frame.lineno} ({frame.name})"
+
+
+@torch.no_grad()
+def graph_breaks(fn, *args, **kwargs):
+    """
+    Runs fn(*args, **kwargs) under torch._dynamo.explain.
+
+    Returns:
+        explanation: the torch._dynamo ExplainOutput (graph_count, graph_break_count, ...).
+        breaks (OrderedDict): innermost source location -> list of the break reasons (first line) there.
+    """
+    torch._dynamo.reset()
+    explanation = torch._dynamo.explain(fn)(*args, **kwargs)
+    breaks = OrderedDict()
+    for reason in explanation.break_reasons:
+        location = _location(reason.user_stack[-1]) if reason.user_stack else "<unknown>"
+        breaks.setdefault(location, []).append(reason.reason.strip().splitlines()[0])
+    return explanation, breaks
@@ -1,5 +1,4 @@
 import os
-from sympy import N
 import torch
 import torch.nn as nn
 from functools import partial
@@ -8,20 +7,19 @@ from typing import Optional, List
 import torch.utils.checkpoint as checkpoint
 
 from einops import rearrange
-from timm.models.vision_transformer import _cfg
-from timm.models.registry import register_model
-from timm.models.layers import trunc_normal_
-
-from timm.models.layers import DropPath, to_2tuple
-from timm.models.vision_transformer import _load_weights
 
 import math
 
 import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 from _mamba.mamba_ssm.modules.mamba_simple import Mamba
-from _mamba.mamba_ssm.ops.triton.layernorm import RMSNorm, layer_norm_fn, rms_norm_fn
+from _mamba.mamba_ssm.ops.backend import RMSNorm, layer_norm_fn, rms_norm_fn
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
 
+from video_sm.models.checkpointing import ActivationProfile, check_policy, select_layers
+from video_sm.models.fast_init import is_meta, materialize, meta_device
+from video_sm.models.feature_taps import FeatureTaps
+from video_sm.models.layout import layer_stages, relayout
 from video_sm.models.positional_encoding import PositionalEncoding
 
 
@@ -52,7 +50,11 @@ class Block(nn.Module):
         self.fused_add_norm = fused_add_norm
         self.mixer = mixer_cls(dim)
         self.norm = norm_cls(dim)
-        self.drop_path = DropPath(drop_path) if drop_path > 0. else nn.Identity()
+        if drop_path > 0.:
+            from timm.models.layers import DropPath
+            self.drop_path = DropPath(drop_path)
+        else:
+            self.drop_path = nn.Identity()
         if self.fused_add_norm:
             assert RMSNorm is not None, "RMSNorm import fails"
             assert isinstance(
@@ -72,7 +74,14 @@ class Block(nn.Module):
         Args:
             hidden_states: the sequence to the encoder layer (required).
             residual: hidden_states = Mixer(LN(residual))
+            use_checkpoint: only keep the inputs for backward and recompute the add + norm + mixer in backward.
+                Ignored with inference_params, whose states the mixer updates inplace.
         """
+        if use_checkpoint and inference_params is None and torch.is_grad_enabled():
+            return checkpoint.checkpoint(self._forward, hidden_states, residual, use_reentrant=False)
+        return self._forward(hidden_states, residual, inference_params)
+
+    def _forward(self, hidden_states, residual=None, inference_params=None):
         if not self.fused_add_norm:
             residual = (residual + self.drop_path(hidden_states)) if residual is not None else hidden_states
             hidden_states = self.norm(residual.to(dtype=self.norm.weight.dtype))
@@ -89,10 +98,7 @@ class Block(nn.Module):
                 residual_in_fp32=self.residual_in_fp32,
                 eps=self.norm.eps,
             )
-        if use_checkpoint:
-            hidden_states = checkpoint.checkpoint(self.mixer, hidden_states, inference_params)
-        else:
-            hidden_states = self.mixer(hidden_states, inference_params=inference_params)
+        hidden_states = self.mixer(hidden_states, inference_params=inference_params)
         return hidden_states, residual
 
     def allocate_inference_cache(self, batch_size, max_seqlen, dtype=None, **kwargs):
@@ -184,6 +190,8 @@ def _init_weights(
 
 
 def segm_init_weights(m):
+    from timm.models.layers import trunc_normal_
+
     if isinstance(m, nn.Linear):
         trunc_normal_(m.weight, std=0.02)
         if isinstance(m, nn.Linear) and m.bias is not None:
@@ -198,6 +206,8 @@ class PatchEmbed(nn.Module):
     """ Image to Patch Embedding
     """
     def __init__(self, img_size=224, patch_size=16, kernel_size=1, in_chans=3, embed_dim=768):
+        from timm.models.layers import to_2tuple
+
         super().__init__()
         img_size = to_2tuple(img_size)
         patch_size = to_2tuple(patch_size)
@@ -243,6 +253,8 @@ class EndoMamba(nn.Module):
             # checkpoint
             use_checkpoint=False,
             checkpoint_num=0,
+            checkpoint_policy=None,
+            checkpoint_budget=None,
             return_last_state=False,
             # new parameter to specify split between spatial and temporal layers
             num_spatial_layers=None,  # If None, default to depth // 2
@@ -256,6 +268,13 @@ class EndoMamba(nn.Module):
 
         Args:
             num_spatial_layers (int): Number of layers to process spatial information. Defaults to depth // 2.
+            checkpoint_policy (str or list of int): which layers are checkpointed in training, see
+                video_sm/models/checkpointing.py: "none", "all", "first_k" (the first checkpoint_num layers),
+                "spatial", "temporal", "auto" (fit checkpoint_budget bytes of activations) or layer indices.
+                Defaults to "first_k" with use_checkpoint, "none" otherwise. "auto" measures the activations
+                of the layers with 4 forwards with grad, in the first training forward unless
+                profile_activations() is called before.
+            checkpoint_budget (int): activation memory budget in bytes of the "auto" policy.
             All other args are same as before.
         """
         factory_kwargs = {"device": device, "dtype": dtype}
@@ -264,10 +283,19 @@ class EndoMamba(nn.Module):
         self.fused_add_norm = fused_add_norm
         self.use_checkpoint = use_checkpoint
         self.checkpoint_num = checkpoint_num
+        if checkpoint_policy is None:
+            checkpoint_policy = "first_k" if use_checkpoint else "none"
+        check_policy(checkpoint_policy, depth, checkpoint_budget)
+        self.checkpoint_policy = checkpoint_policy
+        self.checkpoint_budget = checkpoint_budget
+        self._auto_checkpoint = {}  # (batch_size, num_frames) -> layers, for the "auto" policy
+        self._activation_profile = None
         print(f'Use checkpoint: {use_checkpoint}')
         print(f'Checkpoint number: {checkpoint_num}')
         
-        self.intermediate_features = None
+        # Intermediate features are only kept for the registered taps, see feature_taps.py
+        self.feature_taps = FeatureTaps()
+        self.tap_features = {}  # name -> tensor, from the last forward_features
         
         self.img_size = img_size
         self.patch_size = patch_size
@@ -296,7 +324,8 @@ class EndoMamba(nn.Module):
             self.head_drop = nn.Dropout(fc_drop_rate) if fc_drop_rate > 0 else nn.Identity()
             self.head = nn.Linear(self.num_features, num_classes) if num_classes > 0 else nn.Identity()
 
-        dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth)]  # stochastic depth decay rule
+        # stochastic depth decay rule (on CPU: the model may be built on the meta device, see fast_init.py)
+        dpr = [x.item() for x in torch.linspace(0, drop_path_rate, depth, device="cpu")]
         inter_dpr = [0.0] + dpr
 
         # Determine number of spatial layers
@@ -332,22 +361,30 @@ class EndoMamba(nn.Module):
         # Output head normalization
         self.norm_f = (nn.LayerNorm if not rms_norm else RMSNorm)(embed_dim, eps=norm_epsilon, **factory_kwargs)
 
-        # Initialize weights
-        self.apply(segm_init_weights)
-        if self.with_head:
-            self.head.apply(segm_init_weights)
-        trunc_normal_(self.pos_embed, std=.02)
-
-        # Mamba-specific initialization
-        self.apply(
-            partial(
-                _init_weights,
-                n_layer=depth,
-                **(initializer_cfg if initializer_cfg is not None else {}),
+        # Initialize weights (not on the meta device, where the weights come from a checkpoint, see fast_init.py)
+        if not self.pos_embed.is_meta:
+            from timm.models.layers import trunc_normal_
+
+            self.apply(segm_init_weights)
+            if self.with_head:
+                self.head.apply(segm_init_weights)
+            trunc_normal_(self.pos_embed, std=.02)
+
+            # Mamba-specific initialization
+            self.apply(
+                partial(
+                    _init_weights,
+                    n_layer=depth,
+                    **(initializer_cfg if initializer_cfg is not None else {}),
+                )
             )
-        )
 
         self.return_last_state = return_last_state
+
+        # Runs of consecutive spatial / temporal layers, executed as stages by forward_features
+        self.layer_stages = layer_stages(self.layers)
+        # Number of layout conversions that copied during the last forward_features
+        self.layout_copies = 0
         
     def get_lr_params(self, base_lr, factor=1):
         params = [
@@ -370,79 +407,115 @@ class EndoMamba(nn.Module):
 
     @torch.jit.ignore
     def load_pretrained(self, checkpoint_path, prefix=""):
+        from timm.models.vision_transformer import _load_weights
+
         _load_weights(self, checkpoint_path, prefix)
 
-    def forward_features(self, x, inference_params: Optional[List[Optional[Tensor]]] = None):
+    def profile_activations(self):
+        """
+        Measures the ActivationProfile the "auto" checkpoint policy selects layers from (4 forwards with grad on
+        1- and 2-frame probe clips). Called by the first training forward if not called before.
+        """
+        self._activation_profile = ActivationProfile(self)
+        self._auto_checkpoint = {}
+        return self._activation_profile
+
+    def checkpoint_layers(self, batch_size, num_frames):
+        """Indices of the layers self.checkpoint_policy checkpoints for a (batch_size, num_frames) clip."""
+        if self.checkpoint_policy != "auto":
+            return select_layers(self, self.checkpoint_policy)
+        key = (batch_size, num_frames)
+        if key not in self._auto_checkpoint:
+            if self._activation_profile is None:
+                # Measured once (its probe forwards run with explicit layer sets, not "auto")
+                self.profile_activations()
+            self._auto_checkpoint[key] = select_layers(
+                self, "auto", batch_size, num_frames, self.checkpoint_budget, self._activation_profile
+            )
+        return self._auto_checkpoint[key]
+
+    # rearrange that counts, in self.layout_copies, the conversions that had to copy
+    _relayout = relayout
+
+    def forward_features(self, x, inference_params: Optional[List[Optional[Tensor]]] = None, num_temporal_states=1):
+        if inference_params is not None and inference_params.conv_state_ring:
+            # seqlen_offset counts frames here, not the tokens the temporal layers' conv states are written at
+            raise ValueError("EndoMamba keeps its conv states linear: conv_state_ring is not supported")
+        # Selected first: the "auto" policy may run its probe forwards here, which set the attributes below
+        checkpointed = self.checkpoint_layers(x.shape[0], x.shape[2]) if torch.is_grad_enabled() else ()
+        self.layout_copies = 0
         x = self.patch_embed(x)
         B, C, T, H, W = x.shape
-        x = x.permute(0, 2, 3, 4, 1).reshape(B * T, H * W, C)  # (B*T, N, C)
+        x = self._relayout(x, 'b c t h w -> (b t) (h w) c')  # (B*T, N, C)
 
         if self.with_cls_token:
             cls_token = self.cls_token.expand(B * T, -1, -1)  # (B*T, 1, C) stole cls_tokens impl from Phil Wang, thanks
             x = torch.cat((cls_token, x), dim=1)  # (B*T, N+1, C)
 
-        x = x + self.pos_embed
-
-        if self.with_cls_token:
-            cls_tokens = x[:B * T, :1, :]
-            x = x[:, 1:]
-
-        x = rearrange(x, '(b t) n c -> (b n) t c', b=B, t=T)  # (B*N, T, C)
+        x = x + (self.pos_embed if self.with_cls_token else self.pos_embed[:, 1:])  # row 0 is the cls token's
 
-        if inference_params is not None:
-            temporal_pos = self.temporal_pos_embedding.encoding[inference_params.seqlen_offset: inference_params.seqlen_offset + T, :].unsqueeze(0).to(x.device)
-            x = x + temporal_pos  # (B*N, T, C) + (1, T, C)
+        # The temporal positional encoding is broadcast over the (B, T, N, C) view, only the patch tokens get it
+        if inference_params is not None and inference_params.lengths_per_sample is not None:
+            # Per-row offsets: row b continues at frame lengths_per_sample[b], its rows are computed directly
+            positions = inference_params.lengths_per_sample.to(x.device)[:, None] + torch.arange(T, device=x.device)
+            temporal_pos = self.temporal_pos_embedding.gather(positions)  # (B, T, C)
+        elif inference_params is not None:
+            temporal_pos = self.temporal_pos_embedding.rows(inference_params.seqlen_offset, T)
         else:
-            x = x + self.temporal_pos_embedding(x).unsqueeze(0).to(x.device)  # (B*N, T, C)
-
-        x = rearrange(x, '(b n) t c -> b t n c', b=B, t=T)  # (B, T, N, C)
+            temporal_pos = self.temporal_pos_embedding.rows(0, T)
+        temporal_pos = temporal_pos.view(-1, T, 1, C)
+        x = x.view(B, T, -1, C)
         if self.with_cls_token:
-            cls_tokens = cls_tokens.view(B, T, 1, C) # (B, T, 1, C)
-            x_split = torch.cat((cls_tokens, x), dim=2) 
-            x = rearrange(x_split, 'b t n c -> b t n c')  # (B, T, N+1, C)
+            x = torch.cat((x[:, :, :1], x[:, :, 1:] + temporal_pos), dim=2)  # (B, T, N+1, C)
+        else:
+            x = x + temporal_pos  # (B, T, N, C)
 
         x = self.pos_drop(x)
         
         residual = None
-        hidden_states = x  # (B, N+1, T, C)
+        hidden_states = x  # (B, T, N+1, C)
+        layout = 'b t n m'
         
-        self.intermediate_features = []
+        # Features of this call, set on the module that runs it (each nn.DataParallel replica keeps its own)
+        taps = self.feature_taps.by_layer
+        self.tap_features = features = {}
         
-        # Iterate over all layers
-        for idx, layer in enumerate(self.layers):
-            if layer.bimamba:
-                # continue
-                # Spatial processing: reshape to (B*T, N, C)
-                hidden_states = rearrange(hidden_states, 'b t n m -> (b t) n m')  # (B*T, N, M)
-                current_inference_param = None  # Spatial blocks do not use inference_params
-                if residual is not None:
-                    residual = rearrange(residual, 'b t n m -> (b t) n m')  # (B*T, N, m)
-            else:
-                hidden_states = rearrange(hidden_states, 'b t n m -> b (t n) m')  # (B*N, T, M)
-                # Retrieve the corresponding inference_param for this temporal block
-                # temporal_layer_idx = self.temporal_layer_indices.index(idx)
-                current_inference_param = inference_params
+        # Consecutive layers of the same kind run as one stage in their layout, the layout is only
+        # converted between stages (these conversions are views of the contiguous layer outputs)
+        fanned_out = num_temporal_states == 1
+        for bimamba, layer_indices in self.layer_stages:
+            if not bimamba and not fanned_out:
+                # Spatial layers are stateless: their output is computed once and shared by the K temporal
+                # states, row b of the input feeding rows b * K .. b * K + K - 1
+                hidden_states = self._relayout(hidden_states, f'{layout} -> b t n m', b=B, t=T)
+                hidden_states = hidden_states.repeat_interleave(num_temporal_states, dim=0)
                 if residual is not None:
-                    residual = rearrange(residual, 'b t n m -> b (t n) m')  # (B*N, T, m)
-                    
-            hidden_states, residual = layer(hidden_states, residual, inference_params=current_inference_param)
-
-            if self.return_last_state and not layer.bimamba:
-                hidden_states, inference_params = hidden_states
-
-            if layer.bimamba:
-                # Reshape back to (B, N, T, C)
-                hidden_states = rearrange(hidden_states, '(b t) n m -> b t n m', b=B, t=T)
-                if residual is not None:
-                    residual = rearrange(residual, '(b t) n m -> b t n m', b=B, t=T) 
-            else:
-                # Reshape back to (B, N, T, C)
-                hidden_states = rearrange(hidden_states, 'b (t n) m -> b t n m', n=x.shape[2], t=T)
-                if residual is not None:
-                    residual = rearrange(residual, 'b (t n) m -> b t n m', n=x.shape[2], t=T)
-                    
-            if idx == len(self.layers) // 3 or idx == 2 * len(self.layers) // 3 or idx == len(self.layers) - 1:
-                self.intermediate_features.append(hidden_states)
+                    residual = self._relayout(residual, f'{layout} -> b t n m', b=B, t=T)
+                    residual = residual.repeat_interleave(num_temporal_states, dim=0)
+                layout = 'b t n m'
+                B = B * num_temporal_states
+                fanned_out = True
+            # Spatial layers scan each frame: (B*T, N, M); temporal layers scan the whole clip: (B, T*N, M)
+            stage_layout = '(b t) n m' if bimamba else 'b (t n) m'
+            hidden_states = self._relayout(hidden_states, f'{layout} -> {stage_layout}', b=B, t=T)
+            if residual is not None:
+                residual = self._relayout(residual, f'{layout} -> {stage_layout}', b=B, t=T)
+            layout = stage_layout
+            # Spatial blocks do not use inference_params
+            current_inference_param = None if bimamba else inference_params
+
+            for idx in layer_indices:
+                hidden_states, residual = self.layers[idx](
+                    hidden_states, residual, inference_params=current_inference_param, use_checkpoint=idx in checkpointed
+                )
+
+                if self.return_last_state and not bimamba:
+                    hidden_states, inference_params = hidden_states
+                        
+                if idx in taps:
+                    self.feature_taps.capture(
+                        features, idx, self._relayout(hidden_states, f'{layout} -> b t n m', b=B, t=T), self.with_cls_token
+                    )
 
         # # Final normalization
         if not self.fused_add_norm:
@@ -463,15 +536,31 @@ class EndoMamba(nn.Module):
                 residual_in_fp32=self.residual_in_fp32,
             )
 
-        # Reshape back to (B, N, T, C) for final pooling
-        # hidden_states = rearrange(hidden_states, 'b n t c -> b t n c')
+        # Reshape back to (B, T, N, C) for final pooling
+        hidden_states = self._relayout(hidden_states, f'{layout} -> b t n m', b=B, t=T)
 
         # Average over the spatial dimension (N+1*T)
         # frame_features = rearrange(hidden_states, 'b t n c -> b (t n) c', n=x.shape[2], t=T)  # Shape: (B, T*N, C)
         
         return hidden_states, inference_params
 
-    def forward(self, x, inference_params: Optional[List[Optional[Tensor]]] = None):
+    def _pool(self, x):
+        if self.only_cls_token:
+            return x[:, :, 0, :]  # take only cls token
+        return x.mean(dim=2)  #  (B, T, N, C) --> (B, T, C)
+
+    def _grow_positions(self, inference_params, T):
+        # The streaming entry points grow the temporal table ahead of the frames, forward only reads it
+        if inference_params.lengths_per_sample is None:
+            self.temporal_pos_embedding.grow(inference_params.seqlen_offset + T)
+
+    def _advance(self, inference_params, T):
+        if inference_params.lengths_per_sample is not None:
+            inference_params.lengths_per_sample += T
+        else:
+            inference_params.seqlen_offset += T
+
+    def forward(self, x, inference_params: Optional[List[Optional[Tensor]]] = None, num_temporal_states=1):
         """
         Forward pass of the model.
 
@@ -480,27 +569,86 @@ class EndoMamba(nn.Module):
             inference_params (List[Optional[Tensor]]): A list of inference parameters for temporal blocks.
                                                      The length should be equal to the number of temporal layers.
                                                      Each entry corresponds to a temporal block's cache.
+                                                     Frames are placed at temporal position seqlen_offset,
+                                                     or at lengths_per_sample[b] for each row b if it is set
+                                                     (a (B,) long tensor, for rows at different positions).
+            num_temporal_states (int): K > 1 runs the spatial layers once and the temporal layers on K copies of
+                                       their output, i.e. K independent recurrent states per input row
+                                       (output row b * K + k, see StaggeredStateStreamer).
 
         Returns:
-            Tensor: Output logits of shape (B, T, num_classes).
+            Tensor: Output logits of shape (B * num_temporal_states, T, num_classes).
             Optional inference_params if provided.
         """
-        x, inference_params = self.forward_features(x, inference_params)
+        x, inference_params = self.forward_features(x, inference_params, num_temporal_states)
         if self.with_head:
-            # x = x.mean(dim=2)
-            if self.only_cls_token:
-                x = x[:, :, 0, :]  # take only cls token
-            else:
-                x = x.mean(dim=2)  #  (B, T, N, C) --> (B, T, C)
-            # x = rearrange(x, 'b t n c -> b (t n) c', n=x.shape[2], t=T)  # Shape: (B, T*N, C)
-            x = self.head(self.head_drop(x))
+            x = self.head(self.head_drop(self._pool(x)))
         if inference_params is not None:
             return x, inference_params
         else:
             return x
         
+    def forward_stream(self, x, inference_params):
+        """
+        Recurrent step over the next T >= 1 frames of each stream, then advances their temporal position by T.
+
+        The spatial layers see the B * T frames as one batch and every temporal layer runs one scan over the
+        T * N new tokens, starting from the cached conv_state / ssm_state; the result equals T single-frame
+        steps, at close to parallel-mode throughput for bursts of frames (decoder catch-up, offline replay).
+
+        Args:
+            x (Tensor): (B, C, T, H, W), the next frames.
+            inference_params (InferenceParams): recurrent states, updated inplace.
+
+        Returns:
+            Tensor: (B, T, num_classes), and inference_params.
+        """
+        assert self.return_last_state, "forward_stream needs a model built with return_last_state=True"
+        self._grow_positions(inference_params, x.shape[2])
+        out, inference_params = self.forward(x, inference_params)
+        self._advance(inference_params, x.shape[2])
+        return out, inference_params
+
+    @torch.no_grad()
+    def forward_chunked(self, x, chunk_size, inference_params=None):
+        """
+        Parallel-mode inference over a long clip, chunk_size frames at a time (chunked prefill).
+
+        Each chunk runs the backbone from the states left by the previous one, so the activations are only
+        ever materialized for B * chunk_size frames and the peak memory does not grow with T. The result is
+        bit-identical to forward(x) in one call: the temporal scans and the causal conv carry their state
+        exactly across chunk boundaries and the other layers work per frame. The pooled (B, T, C) features
+        are kept and go through the head at once, since a GEMM over fewer rows may round differently.
+        get_features() only holds the features of the last chunk.
+
+        Args:
+            x (Tensor): (B, C, T, H, W).
+            chunk_size (int): number of frames per backbone forward.
+            inference_params (InferenceParams): states to continue from; a fresh one (clip start) if None.
+
+        Returns:
+            Tensor: (B, T, num_classes) ((B, T, N, C) without a head), and inference_params, positioned
+                after the clip.
+        """
+        assert self.return_last_state, "forward_chunked needs a model built with return_last_state=True"
+        B, T = x.shape[0], x.shape[2]
+        if inference_params is None:
+            inference_params = InferenceParams(max_seqlen=T, max_batch_size=B)
+        self._grow_positions(inference_params, T)
+        outs = []
+        for start in range(0, T, chunk_size):
+            chunk = x[:, :, start:start + chunk_size]
+            out, inference_params = self.forward_features(chunk, inference_params)
+            self._advance(inference_params, chunk.shape[2])
+            outs.append(self._pool(out) if self.with_head else out)
+        out = torch.cat(outs, dim=1)
+        if self.with_head:
+            out = self.head(self.head_drop(out))
+        return out, inference_params
+
     def get_features(self):
-        return self.intermediate_features
+        """Features of the registered taps (self.feature_taps) from the last forward, in registration order."""
+        return self.feature_taps.get(self.tap_features)
     
     @torch.jit.ignore
     def no_weight_decay(self):
@@ -531,14 +679,18 @@ def inflate_weight(weight_2d, time_dim, center=True):
     return weight_3d
 
 
-def load_state_dict(model, state_dict, center=True):
+def convert_state_dict(model, state_dict, center=True):
     """
-    Load a state dict into the model, handling 2D to 3D weight inflation if necessary.
+    Convert a pretraining state dict to the model: keep the 'encoder.' keys without the prefix, inflate
+    2D weights to 3D, drop mismatched embeddings and the head weights.
 
     Args:
-        model (nn.Module): The model to load the state dict into.
-        state_dict (dict): The state dictionary.
+        model (nn.Module): The model the state dict is for (may be on the meta device).
+        state_dict (dict): The pretraining state dictionary.
         center (bool): Whether to center the inflated weights.
+
+    Returns:
+        dict: The state dictionary to load into the model.
     """
     state_dict_3d = model.state_dict()
     
@@ -575,34 +727,71 @@ def load_state_dict(model, state_dict, center=True):
         del state_dict['head.weight']
     if 'head.bias' in state_dict:
         del state_dict['head.bias']
+    return state_dict
+
 
-    # Load state dict
-    msg = model.load_state_dict(state_dict, strict=False)
+def load_state_dict(model, state_dict, center=True):
+    """
+    Load a state dict into the model, handling 2D to 3D weight inflation if necessary.
+
+    Args:
+        model (nn.Module): The model to load the state dict into.
+        state_dict (dict): The state dictionary.
+        center (bool): Whether to center the inflated weights.
+    """
+    state_dict = convert_state_dict(model, state_dict, center=center)
+
+    # Load state dict (a model built on the meta device is allocated and filled from it)
+    if is_meta(model):
+        msg = materialize(model, state_dict, init=segm_init_weights)
+    else:
+        msg = model.load_state_dict(state_dict, strict=False)
     print(msg)
 
 
-@register_model
-def endomamba_tiny(pretrained=False, **kwargs):
+def _default_cfg():
+    from timm.models.vision_transformer import _cfg
+
+    return _cfg()
+
+
+def register_timm_models():
+    """
+    Registers endomamba_tiny, endomamba_small and endomamba_middle in timm's model registry, for
+    timm.models.create_model. Importing this module does not import timm: the training entry points call this
+    after their imports. Calling it again is a no-op.
+    """
+    from timm.models import is_model, register_model
+
+    for fn in (endomamba_tiny, endomamba_small, endomamba_middle):
+        if not is_model(fn.__name__):
+            register_model(fn)
+
+
+def endomamba_tiny(pretrained=False, skip_init=False, **kwargs):
     """
     Create a tiny VisionMamba model.
 
     Args:
         pretrained (bool): Whether to load pretrained weights.
+        skip_init (bool): With pretrained, build the model on the meta device and allocate it from the
+            checkpoint, without random initialization (see fast_init.py).
         **kwargs: Additional arguments.
 
     Returns:
         VisionMamba: The VisionMamba tiny model.
     """
-    model = EndoMamba(
-        patch_size=16, 
-        embed_dim=192, 
-        depth=24, 
-        rms_norm=True, 
-        residual_in_fp32=True, 
-        fused_add_norm=True, 
-        **kwargs
-    )
-    model.default_cfg = _cfg()
+    with meta_device(pretrained and skip_init):
+        model = EndoMamba(
+            patch_size=16, 
+            embed_dim=192, 
+            depth=24, 
+            rms_norm=True, 
+            residual_in_fp32=True, 
+            fused_add_norm=True, 
+            **kwargs
+        )
+    model.default_cfg = _default_cfg()
     if pretrained:
         print('Loading pretrained weights...')
         state_dict = torch.load(_MODELS["videomamba_t16_in1k"], map_location='cpu')
@@ -612,27 +801,29 @@ def endomamba_tiny(pretrained=False, **kwargs):
     return model
 
 
-@register_model
-def endomamba_small(pretrained=False, **kwargs):
+def endomamba_small(pretrained=False, skip_init=False, **kwargs):
     """
     Create a small VisionMamba model.
 
     Args:
         pretrained (bool): Whether to load pretrained weights.
+        skip_init (bool): With pretrained, build the model on the meta device and allocate it from the
+            checkpoint, without random initialization (see fast_init.py).
         **kwargs: Additional arguments.
 
     Returns:
         VisionMamba: The VisionMamba small model.
     """
-    model = EndoMamba(
-        embed_dim=384, 
-        depth=24, 
-        rms_norm=True, 
-        residual_in_fp32=True, 
-        fused_add_norm=True, 
-        **kwargs
-    )
-    model.default_cfg = _cfg()
+    with meta_device(pretrained and skip_init):
+        model = EndoMamba(
+            embed_dim=384, 
+            depth=24, 
+            rms_norm=True, 
+            residual_in_fp32=True, 
+            fused_add_norm=True, 
+            **kwargs
+        )
+    model.default_cfg = _default_cfg()
     if pretrained:
         print('Loading pretrained weights...')
         state_dict = torch.load(_MODELS["videomamba_s16_in1k"], map_location='cpu')
@@ -642,28 +833,30 @@ def endomamba_small(pretrained=False, **kwargs):
     return model
 
 
-@register_model
-def endomamba_middle(pretrained=False, **kwargs):
+def endomamba_middle(pretrained=False, skip_init=False, **kwargs):
     """
     Create a middle-sized VisionMamba model with support for recurrent inference.
 
     Args:
         pretrained (bool): Whether to load pretrained weights.
+        skip_init (bool): With pretrained, build the model on the meta device and allocate it from the
+            checkpoint, without random initialization (see fast_init.py).
         **kwargs: Additional arguments.
 
     Returns:
         VisionMamba: The VisionMamba middle model.
     """
-    model = EndoMamba(
-        patch_size=16, 
-        embed_dim=576, 
-        depth=32, 
-        rms_norm=True, 
-        residual_in_fp32=True, 
-        fused_add_norm=True, 
-        **kwargs
-    )
-    model.default_cfg = _cfg()
+    with meta_device(pretrained and skip_init):
+        model = EndoMamba(
+            patch_size=16, 
+            embed_dim=576, 
+            depth=32, 
+            rms_norm=True, 
+            residual_in_fp32=True, 
+            fused_add_norm=True, 
+            **kwargs
+        )
+    model.default_cfg = _default_cfg()
     if pretrained:
         print('Loading pretrained weights...')
         state_dict = torch.load(_MODELS["videomamba_m16_in1k"], map_location='cpu')
@@ -1,5 +1,4 @@
 import os
-from sympy import N
 import torch
 import torch.nn as nn
 from functools import partial
@@ -21,7 +20,7 @@ import sys, os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
 # sys.path.append('/home/tqy/VideoMamba/videomamba/')
 from _mamba.mamba_ssm.modules.mamba_simple import Mamba
-from _mamba.mamba_ssm.ops.triton.layernorm import RMSNorm, layer_norm_fn, rms_norm_fn
+from _mamba.mamba_ssm.ops.backend import RMSNorm, layer_norm_fn, rms_norm_fn
 
 from video_sm.models.positional_encoding import PositionalEncoding
 
@@ -217,6 +216,26 @@ class PatchEmbed(nn.Module):
         x = self.proj(x)
         return x
 
+    def grid(self, x):
+        """(T, H, W) patch grid of a clip x (B, C, T, H, W)."""
+        return x.shape[2] // self.tubelet_size, x.shape[3] // self.patch_size[0], x.shape[4] // self.patch_size[1]
+
+    def forward_visible(self, x, index):
+        """
+        Embeds only the patches of index (B, N_vis), positions in the (t h w) order of the grid: their pixels
+        are gathered from unfolded views of x, laid side by side in one row and projected by the same strided
+        conv, so the tokens are those of forward at these positions (same values, same kernel) without the
+        cost of the masked patches. Returns (B, N_vis, embed_dim).
+        """
+        B, C = x.shape[:2]
+        (k, p, q), (T, H, W) = self.proj.kernel_size, self.grid(x)
+        patches = x.unfold(2, k, k).unfold(3, p, p).unfold(4, q, q).permute(0, 2, 3, 4, 1, 5, 6, 7)  # (B, T, H, W, C, k, p, q)
+        batch = torch.arange(B, device=x.device).unsqueeze(1)
+        visible = patches[batch, index // (H * W), index // W % H, index % W]  # (B, N_vis, C, k, p, q)
+        N = visible.shape[1]
+        row = visible.permute(0, 2, 3, 4, 1, 5).reshape(B, C, k, p, N * q)
+        return self.proj(row).view(B, -1, N).transpose(1, 2)
+
 
 class EndoMamba(nn.Module):
     """ VisionMamba adapted for MAE Pretraining """
@@ -345,6 +364,36 @@ class EndoMamba(nn.Module):
     def load_pretrained(self, checkpoint_path, prefix=""):
         _load_weights(self, checkpoint_path, prefix)
 
+    def embed(self, x, mask: Optional[torch.Tensor] = None):
+        """
+        Patch tokens of x (B, C, T, H, W) with their spatial and temporal positional embeddings: (B, T, N, C),
+        or with mask (B, T * N, True where masked, the same number of visible patches in every frame) only
+        the visible ones, (B, T, N_vis, C), in order. Only the visible patches are then embedded: the same
+        tokens as the full path followed by x[~mask], without the cost of the masked patches.
+        """
+        if mask is not None:
+            B = x.shape[0]
+            T, H, W = self.patch_embed.grid(x)
+            index = (~mask).nonzero()[:, 1].view(B, -1)  # visible positions in (t n) order, Shape: (B, N_vis)
+            x = self.patch_embed.forward_visible(x, index)  # Shape: (B, N_vis, C)
+            x = x + self.pos_embed[0, index % (H * W)]
+            x = x + self.temporal_pos_embedding.rows(0, T)[index // (H * W)]
+            x = x.reshape(B, T, -1, x.shape[-1])  # Shape: (B, T, N_vis / T, C)
+        else:
+            x = self.patch_embed(x)  # Shape: (B, embed_dim, T, H', W')
+            B, C, T, H, W = x.shape
+
+            x = x.permute(0, 2, 3, 4, 1).reshape(B * T, H * W, C)  # Shape: (B*T, N, C)
+            x = x + self.pos_embed  # Shape: (B*T, N, C)
+            x = rearrange(x, '(b t) n c -> (b n) t c', b=B, t=T)  # Shape: (B*N, T, C)
+
+            temporal_pos = self.temporal_pos_embedding(x).unsqueeze(0).to(x.device)  # Shape: (1, T, C)
+            x = x + temporal_pos  # Shape: (B*N, T, C)
+
+            x = rearrange(x, '(b n) t c -> b t n c', b=B, t=T)  # Shape: (B, T, N, C)
+
+        return x
+
     def forward_features(self, x, mask: Optional[torch.Tensor] = None, tubelet_size=2):
         """
         Extract features from the input tensor with support for masking.
@@ -362,46 +411,8 @@ class EndoMamba(nn.Module):
                 - inference_params (List[Optional[Tensor]]): Updated inference parameters.
         """
         
-        x = self.patch_embed(x)  # Shape: (B, embed_dim, T, H', W')
-        B, C, T, H, W = x.shape
-        
-        x = x.permute(0, 2, 3, 4, 1).reshape(B * T, H * W, C)  # Shape: (B*T, N, C)
-
-        # Expand and concatenate CLS token
-        # cls_token = self.cls_token.expand(B * T, -1, -1)  # Shape: (B*T, 1, C)
-        # x = torch.cat((cls_token, x), dim=1)  # Shape: (B*T, N+1, C)
-
-        x = x + self.pos_embed  # Shape: (B*T, N+1, C) 64, 196, 576
-
-        # Separate CLS tokens and patch tokens
-        # cls_tokens = x[:, :, :1, :].reshape(B, T, 1, C)  # Shape: (B, T, 1, C)
-        # x = x[:, :, 1:, :]  # Shape: (B, T, num_visible_patches, C)
-
-        x = rearrange(x, '(b t) n c -> (b n) t c', b=B, t=T)  # Shape: (B*N, T, C)
-
-        temporal_pos = self.temporal_pos_embedding(x).unsqueeze(0).to(x.device)  # Shape: (1, T, C)
-        x = x + temporal_pos  # Shape: (B*N, T, C)
-
-        x = rearrange(x, '(b n) t c -> b t n c', b=B, t=T)  # Shape: (B, T, N, C)
-        
-        # cls_tokens = cls_tokens.view(B, T, 1, C)  # Shape: (B, T, 1, C)
-        
-        # x_split = torch.cat((cls_tokens, x), dim=2)  # Shape: (B, T, N+1, C)
-        # x = rearrange(x_split, 'b t n c -> b t n c')  # Shape remains (B, T, N+1, C)
-        
-        if mask is not None:
-            x = rearrange(x, 'b t n c -> b (t n) c', b=B, t=T)
-            
-            x = x[~mask].reshape(B, T, -1, C)
-            
-            # x = rearrange(x, 'b (t n) c -> b t n c', t=T)
-            
-            # Create a mask for CLS tokens (always unmasked)
-            # cls_mask = torch.zeros((B * T, 1), dtype=torch.bool, device=x.device)  # Shape: (B*T, 1)
-
-        else:
-            x = x.reshape(B, T, -1, C)  # Shape: (B, T, N+1, C)
-
+        x = self.embed(x, mask)  # Shape: (B, T, N, C)
+        B, T = x.shape[:2]
         x = self.pos_drop(x)
 
         residual = None
@@ -0,0 +1,103 @@
+"""
+Export of EndoMamba's recurrent mode as a single-frame step with explicit states, for deployment
+outside of Python (TorchScript, ONNX Runtime):
+
+    (frame (B, C, H, W), offset (B,) long, *states) -> (logits (B, num_classes), *new_states)
+
+states are the (conv_state (B, d_inner, d_conv), ssm_state (B, d_inner, d_state)) pairs of the temporal
+layers, flattened in layer order, and offset is the temporal position of the frame (the number of frames
+the stream has seen). The caller feeds the new states and offset + 1 back at the next frame. The step is
+a pure function: it never writes to its inputs. RecurrentPrefill runs a whole clip from a stream start and
+returns the states to continue from:
+
+    clip (B, C, T, H, W) -> (logits (B, T, num_classes), *states)
+
+Only the CPU reference ops can be traced (the CUDA extensions are opaque to both exporters), so the step
+is exported from a model on CPU, under torch.no_grad (see selective_scan_recompute_fn):
+
+    step = RecurrentStep(endomamba_small(num_classes=7, return_last_state=True).eval())
+    traced = trace_step(step)
+    export_onnx(step, "endomamba_small_step.onnx")  # needs the onnx package
+    states = step.initial_states()
+    logits, *states = traced(frame, offset, *states)
+"""
+import torch
+import torch.nn as nn
+
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+
+
+class RecurrentStep(nn.Module):
+    def __init__(self, model):
+        """
+        Args:
+            model (EndoMamba): model built with return_last_state=True, in eval mode.
+        """
+        super().__init__()
+        assert model.return_last_state, "RecurrentStep needs a model built with return_last_state=True"
+        self.model = model
+        self.temporal_layer_indices = [i for i, layer in enumerate(model.layers) if not layer.bimamba]
+
+    @property
+    def state_names(self):
+        return [f"{name}_{i}" for i in self.temporal_layer_indices for name in ("conv_state", "ssm_state")]
+
+    def initial_states(self, batch_size=1):
+        """Zero states of a stream start, flattened as forward takes them."""
+        return [
+            state for i in self.temporal_layer_indices
+            for state in self.model.layers[i].allocate_inference_cache(batch_size, 1)
+        ]
+
+    def example_inputs(self, batch_size=1):
+        """(frame, offset, *states) of a stream start, e.g. for tracing."""
+        device = next(self.model.parameters()).device
+        img_size = self.model.patch_embed.img_size
+        frame = torch.zeros(batch_size, self.model.patch_embed.proj.in_channels, *img_size, device=device)
+        offset = torch.zeros(batch_size, dtype=torch.long, device=device)
+        return (frame, offset, *self.initial_states(batch_size))
+
+    def forward(self, frame, offset, *states):
+        inference_params = InferenceParams(max_seqlen=1, max_batch_size=frame.shape[0], lengths_per_sample=offset)
+        for k, i in enumerate(self.temporal_layer_indices):
+            # conv_state is updated inplace by the layer: work on a copy
+            inference_params.key_value_memory_dict[i] = (states[2 * k].clone(), states[2 * k + 1])
+        out, inference_params = self.model(frame.unsqueeze(2), inference_params)
+        new_states = [state for i in self.temporal_layer_indices for state in inference_params.key_value_memory_dict[i]]
+        return (out[:, 0], *new_states)
+
+
+class RecurrentPrefill(RecurrentStep):
+    def example_inputs(self, batch_size=1, num_frames=8):
+        frame = super().example_inputs(batch_size)[0]
+        return (frame.unsqueeze(2).expand(-1, -1, num_frames, -1, -1).contiguous(),)
+
+    def forward(self, clip):
+        inference_params = InferenceParams(max_seqlen=clip.shape[2], max_batch_size=clip.shape[0])
+        out, inference_params = self.model(clip, inference_params)
+        states = [state for i in self.temporal_layer_indices for state in inference_params.key_value_memory_dict[i]]
+        return (out, *states)
+
+
+@torch.no_grad()
+def trace_step(step, batch_size=1):
+    """TorchScript (torch.jit.trace) of the step, for a fixed batch size and frame size."""
+    return torch.jit.trace(step, step.example_inputs(batch_size), check_trace=False)
+
+
+@torch.no_grad()
+def export_onnx(step, path, batch_size=1, opset_version=17):
+    """
+    Exports the step to path with the TorchScript-based ONNX exporter, for a fixed frame size. The batch
+    dimension is dynamic. Inputs: frame, offset and the state names; outputs: logits and new_ + state names.
+    """
+    state_names = step.state_names
+    dynamic_axes = {name: {0: "batch"} for name in ["frame", "offset", "logits"] + state_names}
+    dynamic_axes.update({f"new_{name}": {0: "batch"} for name in state_names})
+    torch.onnx.export(
+        step, step.example_inputs(batch_size), path,
+        input_names=["frame", "offset"] + state_names,
+        output_names=["logits"] + [f"new_{name}" for name in state_names],
+        dynamic_axes=dynamic_axes, opset_version=opset_version, dynamo=False,
+    )
+    return path
@@ -0,0 +1,89 @@
+"""
+Fast construction of models whose weights come from a checkpoint.
+
+Building EndoMamba initializes every parameter at random (trunc_normal_, kaiming, the Mamba dt / A
+initializations) only for the checkpoint to overwrite them. Under meta_device the model is built on the
+meta device instead (no allocation, no initialization); materialize then takes its tensors from the
+checkpoint, on the target device:
+
+    with meta_device():
+        model = endomamba_small(num_classes=7)
+    materialize(model, state_dict, init=segm_init_weights)
+
+The factories do this with endomamba_small(pretrained=True, skip_init=True), and load_state_dict of
+endomamba.py materializes a meta model. Tensors the checkpoint does not cover (the head, which
+load_state_dict drops) are allocated and initialized by init, module by module, after their
+reset_parameters; it is only done for plain layers (Linear, norms, convolutions) outside the Mamba
+mixers, whose initialization lives in their constructor: a checkpoint missing anything else needs a
+model built on a real device.
+Non-persistent buffers are not in checkpoints, so they must be built when their module leaves the meta
+device (e.g. the table of PositionalEncoding, built by its _apply).
+"""
+from contextlib import contextmanager
+
+import torch
+
+
+@contextmanager
+def meta_device(enabled=True):
+    """Modules built in this context are on the meta device (without enabled, a no-op)."""
+    if not enabled:
+        yield
+        return
+    with torch.device("meta"):
+        yield
+
+
+def is_meta(model):
+    return any(p.is_meta for p in model.parameters())
+
+
+def materialize(model, state_dict, device="cpu", init=None, strict=False):
+    """
+    Fills the meta model from state_dict: its tensors become those of state_dict, moved to device and
+    the parameter dtype (load_state_dict(assign=True), without a copy when they already match). The
+    tensors missing from state_dict are allocated on device and initialized by reset_parameters then
+    init (applied to their module). Returns the result of load_state_dict.
+    """
+    for name, buffer in model.named_buffers():
+        module_name, _, buffer_name = name.rpartition(".")
+        module = model.get_submodule(module_name)
+        if buffer_name in module._non_persistent_buffers_set and buffer.numel() > 0:
+            raise ValueError(f"{name} is a non-persistent buffer, it would not be restored from the checkpoint")
+
+    # Assigning replaces the parameters: their attributes (_no_weight_decay, _no_reinit) are carried over
+    attributes = {name: dict(p.__dict__) for name, p in model.named_parameters()}
+    expected = model.state_dict()
+    state_dict = {
+        k: v.to(device=device, dtype=expected[k].dtype) if k in expected and expected[k].shape == v.shape else v
+        for k, v in state_dict.items()
+    }
+    msg = model.load_state_dict(state_dict, strict=strict, assign=True)
+    missing = set(msg.missing_keys)
+
+    for module_name, module in model.named_modules():
+        prefix = f"{module_name}." if module_name else ""
+        direct = [prefix + n for n, _ in module.named_parameters(recurse=False)]
+        direct += [prefix + n for n, _ in module.named_buffers(recurse=False) if n not in module._non_persistent_buffers_set]
+        if not any(t.is_meta for t in (*module.parameters(recurse=False), *module.buffers(recurse=False))):
+            continue
+        if not missing.intersection(direct):
+            module.to_empty(device=device, recurse=False)  # only non-persistent (empty) buffers left on meta
+            continue
+        if not hasattr(module, "reset_parameters") or ".mixer." in f".{module_name}.":
+            raise ValueError(
+                f"{sorted(missing.intersection(direct))} are missing from the checkpoint and {module_name or 'the model'} "
+                "cannot be initialized after construction, build the model on a real device"
+            )
+        module.to_empty(device=device, recurse=False)
+        with torch.no_grad():
+            module.reset_parameters()
+            if init is not None:
+                init(module)
+        # reset_parameters covers all the tensors of the module, those in the checkpoint are loaded again
+        loaded = {k[len(prefix):]: state_dict[k] for k in direct if k not in missing}
+        module.load_state_dict(loaded, strict=False)
+
+    for name, p in model.named_parameters():
+        p.__dict__.update(attributes[name])
+    return msg
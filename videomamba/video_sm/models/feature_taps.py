@@ -0,0 +1,66 @@
+"""
+Opt-in intermediate features of EndoMamba.
+
+Callers declare which layers they need and which tokens of them, and forward_features only keeps those:
+
+    name = model.feature_taps.add(layer=8, tokens="patches")
+    out = model(x)
+    features = model.tap_features[name]  # (B, T, N, C), the patch tokens after layer 8
+
+tokens is "all" (B, T, N+1, C), "cls" (B, T, C) or "patches" (B, T, N, C). A tap of all tokens is a view
+of the layer output, as the former intermediate_features were; a cls or patches tap is copied out, so
+that it does not hold the whole layer output alive (during training, until backward). Without taps,
+forward_features does not look at the layers at all.
+
+FeatureTaps only holds the registrations. The features go into a dict created by every forward_features
+call and set on the model that ran it, so the replicas of nn.DataParallel, which share the FeatureTaps of
+the model, each keep their own.
+"""
+from collections import OrderedDict
+
+TOKENS = ("all", "cls", "patches")
+
+
+class FeatureTaps:
+    def __init__(self):
+        self.taps = OrderedDict()  # name -> (layer, tokens), in registration order
+        self.by_layer = {}  # layer -> [(name, tokens)]
+
+    def __len__(self):
+        return len(self.taps)
+
+    def add(self, layer, tokens="all", name=None):
+        """Registers a tap on the output of layer (its index in model.layers). Returns its name."""
+        if tokens not in TOKENS:
+            raise ValueError(f"Unknown tokens {tokens!r}, expected one of {TOKENS}")
+        name = f"layer{layer}_{tokens}" if name is None else name
+        if name in self.taps:
+            raise ValueError(f"Feature tap {name!r} already registered")
+        self.taps[name] = (layer, tokens)
+        self.by_layer.setdefault(layer, []).append((name, tokens))
+        return name
+
+    def remove(self, name):
+        layer, tokens = self.taps.pop(name)
+        self.by_layer[layer].remove((name, tokens))
+        if not self.by_layer[layer]:
+            del self.by_layer[layer]
+
+    def clear(self):
+        self.taps.clear()
+        self.by_layer.clear()
+
+    def capture(self, features, layer, hidden_states, with_cls_token=True):
+        """Keeps the taps of layer from its output hidden_states, (B, T, N(+1), C), in features (name -> tensor)."""
+        for name, tokens in self.by_layer[layer]:
+            if tokens == "all":
+                features[name] = hidden_states
+            elif tokens == "cls":
+                assert with_cls_token, "cls feature taps need a model with a cls token"
+                features[name] = hidden_states[:, :, 0].contiguous()
+            else:
+                features[name] = (hidden_states[:, :, 1:] if with_cls_token else hidden_states).contiguous()
+
+    def get(self, features):
+        """The tensors of features (of one forward), in registration order."""
+        return [features[name] for name in self.taps if name in features]
@@ -0,0 +1,105 @@
+"""
+Inference checkpoints: the converted weights of one model in a flat, memory-mappable file.
+
+A pretraining checkpoint holds the optimizer, the scaler and the teacher next to the weights, and every
+entry point loads it all and converts the weights again (convert_state_dict of endomamba.py: 'encoder.'
+prefix, 2D to 3D inflation, embeddings, head). export_inference_checkpoint does it once and writes only
+the converted tensors, in the safetensors layout: the header size (8 bytes, little-endian), a JSON header
+(dtype, shape and [begin, end) byte offsets of every tensor, the model name and arguments in
+__metadata__), then the tensor data. load_inference_checkpoint maps the file privately: the weights of
+the model are views of the mapping, read on first use and shared by all the processes of a host that
+load the same file (a process writing to its weights gets its own copies of the written pages).
+
+    export_inference_checkpoint("checkpoint-499.pth", "endomamba_small.safetensors", "endomamba_small", num_classes=7)
+    model = load_inference_checkpoint("endomamba_small.safetensors")
+"""
+import json
+import os
+import struct
+
+import torch
+
+from video_sm.models.fast_init import materialize, meta_device
+
+DTYPES = {
+    torch.float64: "F64", torch.float32: "F32", torch.float16: "F16", torch.bfloat16: "BF16", torch.int64: "I64",
+    torch.int32: "I32", torch.int16: "I16", torch.int8: "I8", torch.uint8: "U8", torch.bool: "BOOL",
+}
+DTYPE_NAMES = {name: dtype for dtype, name in DTYPES.items()}
+
+
+def save_tensors(tensors, path, metadata=None):
+    """Writes tensors (name -> tensor) in the safetensors layout, with metadata (str -> str) in the header."""
+    # Wider dtypes first: the data starts 8-byte aligned, so every tensor is aligned to its element size
+    names = sorted(tensors, key=lambda name: (-tensors[name].element_size(), name))
+    header, offset = {}, 0
+    for name in names:
+        tensor = tensors[name]
+        nbytes = tensor.numel() * tensor.element_size()
+        header[name] = {"dtype": DTYPES[tensor.dtype], "shape": list(tensor.shape), "data_offsets": [offset, offset + nbytes]}
+        offset += nbytes
+    if metadata:
+        header["__metadata__"] = metadata
+    encoded = json.dumps(header, separators=(",", ":")).encode()
+    encoded += b" " * (-len(encoded) % 8)
+    with open(path, "wb") as f:
+        f.write(struct.pack("<Q", len(encoded)))
+        f.write(encoded)
+        for name in names:
+            f.write(tensors[name].detach().cpu().contiguous().reshape(-1).view(torch.uint8).numpy())
+
+
+def load_tensors(path):
+    """Maps a file written by save_tensors. Returns the tensors (name -> view of the mapping) and the metadata."""
+    with open(path, "rb") as f:
+        header_size, = struct.unpack("<Q", f.read(8))
+        header = json.loads(f.read(header_size))
+    metadata = header.pop("__metadata__", {})
+    storage = torch.UntypedStorage.from_file(path, shared=False, nbytes=os.path.getsize(path))
+    start = 8 + header_size
+    tensors = {}
+    for name, info in header.items():
+        dtype = DTYPE_NAMES[info["dtype"]]
+        itemsize = torch.empty((), dtype=dtype).element_size()
+        begin = start + info["data_offsets"][0]
+        if begin % itemsize:
+            raise ValueError(f"{name} is not aligned in {path}, it cannot be mapped")
+        tensors[name] = torch.empty(0, dtype=dtype).set_(storage, begin // itemsize, info["shape"])
+    return tensors, metadata
+
+
+def export_inference_checkpoint(checkpoint, path, model_name, from_pretraining=True, center=True, **model_kwargs):
+    """
+    Writes the weights of checkpoint (a path or a loaded checkpoint, its 'model' or 'module' entry if any)
+    for model_name(**model_kwargs) of endomamba.py to path. A pretraining checkpoint is converted by
+    convert_state_dict, otherwise (a finetuned checkpoint) its keys are taken as they are. Only the tensors
+    of the model are kept. Returns the keys of the model the file does not cover (initialized at load).
+    """
+    from video_sm.models import endomamba
+
+    if isinstance(checkpoint, (str, os.PathLike)):
+        checkpoint = torch.load(checkpoint, map_location="cpu", mmap=True, weights_only=False)
+    state_dict = checkpoint.get("model", checkpoint.get("module", checkpoint))
+    with meta_device():
+        model = getattr(endomamba, model_name)(**model_kwargs)
+    expected = model.state_dict()
+    if from_pretraining:
+        state_dict = endomamba.convert_state_dict(model, state_dict, center=center)
+    tensors = {k: v for k, v in state_dict.items() if k in expected and v.shape == expected[k].shape}
+    save_tensors(tensors, path, {"model_name": model_name, "model_kwargs": json.dumps(model_kwargs)})
+    return sorted(set(expected) - set(tensors))
+
+
+def load_inference_checkpoint(path, device="cpu", **model_kwargs):
+    """
+    Builds the model of an inference checkpoint (model_kwargs override the saved arguments) in eval mode.
+    On CPU its weights are the mapped tensors of the file, elsewhere they are copied to device.
+    """
+    from video_sm.models import endomamba
+
+    tensors, metadata = load_tensors(path)
+    kwargs = {**json.loads(metadata["model_kwargs"]), **model_kwargs}
+    with meta_device():
+        model = getattr(endomamba, metadata["model_name"])(**kwargs)
+    materialize(model, tensors, device=device, init=endomamba.segm_init_weights)
+    return model.eval()
@@ -0,0 +1,30 @@
+"""
+Layouts of the EndoMamba hidden states, shared by the models that run their layers as stages.
+
+Spatial (bimamba) layers scan each frame, (B*T, N, M); temporal layers scan the whole clip, (B, T*N, M).
+Consecutive layers of the same kind form one stage, run in its layout: the hidden states and the residual
+are only converted at the stage boundaries, and these conversions are views of the contiguous layer outputs.
+"""
+import torch
+from einops import rearrange
+
+
+def layer_stages(layers):
+    """Runs of consecutive spatial / temporal layers: [(bimamba, [layer indices]), ...], in order."""
+    stages = []
+    for i, layer in enumerate(layers):
+        if stages and stages[-1][0] == layer.bimamba:
+            stages[-1][1].append(i)
+        else:
+            stages.append((layer.bimamba, [i]))
+    return stages
+
+
+def relayout(module, x, pattern, **axes_lengths):
+    """rearrange that counts, in module.layout_copies, the conversions that had to copy (not under torch.compile)."""
+    out = rearrange(x, pattern, **axes_lengths)
+    if torch.compiler.is_compiling():
+        return out
+    if out.untyped_storage().data_ptr() != x.untyped_storage().data_ptr():
+        module.layout_copies += 1
+    return out
@@ -10,41 +10,67 @@ from torch import nn
 class PositionalEncoding(nn.Module):
     """
     compute sinusoid encoding.
+
+    The table (encoding) is a non-persistent buffer: it follows the module across devices and dtypes and
+    is not saved in checkpoints. Its max_len rows are built in the constructor (on the meta device, when
+    the module leaves it). Rows past its end are computed on every call; the table itself only grows
+    from grow(), which the streaming entry points call outside the forward: a table reassigned in forward
+    would be thrown away with an nn.DataParallel replica, and its size is a guard under torch.compile.
+    gather computes the rows of arbitrary positions (e.g. per-sample stream offsets) directly, without
+    the table.
     """
 
-    def __init__(self, d_model, max_len, device):
+    def __init__(self, d_model, max_len=8192, device=None):
         """
         constructor of sinusoid encoding class
 
         :param d_model: dimension of model
-        :param max_len: max sequence length
+        :param max_len: rows of the table (see grow)
         :param device: hardware device setting
         """
         super(PositionalEncoding, self).__init__()
+        self.d_model = d_model
+        self.max_len = max_len
+        self.register_buffer("encoding", self._table(max_len, device), persistent=False)
 
-        # same size with input matrix (for adding with input matrix)
-        self.encoding = torch.zeros(max_len, d_model, device=device)
-        self.encoding.requires_grad = False  # we don't need to compute gradient
+    def _table(self, length, device=None, dtype=torch.float32):
+        positions = torch.arange(length, device=device)
+        if positions.is_meta:
+            return torch.empty(0, self.d_model, device=positions.device, dtype=dtype)
+        return self.encode(positions).to(dtype)
 
-        pos = torch.arange(0, max_len, device=device)
-        pos = pos.float().unsqueeze(dim=1)
-        # 1D => 2D unsqueeze to represent word's position
+    def _apply(self, fn, recurse=True):
+        super()._apply(fn, recurse)
+        if self.encoding.numel() == 0 and not self.encoding.is_meta:
+            # Off the meta device (to_empty): build the table
+            self.encoding = self._table(self.max_len, self.encoding.device, self.encoding.dtype)
+        return self
 
-        _2i = torch.arange(0, d_model, step=2, device=device).float()
-        # 'i' means index of d_model (e.g. embedding size = 50, 'i' = [0,50])
-        # "step=2" means 'i' multiplied with two (same with 2 * i)
+    def encode(self, positions):
+        """Sinusoid rows of positions (an integer tensor of any shape): (*positions.shape, d_model), in fp32."""
+        pos = positions.float().unsqueeze(-1)
+        _2i = torch.arange(0, self.d_model, step=2, device=positions.device).float()
+        # 'i' means index of d_model, "step=2" means 'i' multiplied with two (same with 2 * i)
+        angles = pos / (10000 ** (_2i / self.d_model))
+        return torch.stack((torch.sin(angles), torch.cos(angles)), dim=-1).flatten(-2)  # sin on even, cos on odd
 
-        self.encoding[:, 0::2] = torch.sin(pos / (10000 ** (_2i / d_model)))
-        self.encoding[:, 1::2] = torch.cos(pos / (10000 ** (_2i / d_model)))
-        # compute positional encoding to consider positional information of words
+    def grow(self, length):
+        """Extends the table to at least length rows, doubling it; not from within forward (see above)."""
+        size = self.encoding.shape[0]
+        if length > size:
+            capacity = max(length, 2 * size, self.max_len)
+            self.encoding = torch.cat((self.encoding, self.gather(torch.arange(size, capacity, device=self.encoding.device))))
 
-    def forward(self, x):
-        # self.encoding
-        # [max_len = 512, d_model = 512]
+    def rows(self, start, length):
+        """Rows start to start + length: (length, d_model), a view of the table unless they run past its end."""
+        if start + length <= self.encoding.shape[0]:
+            return self.encoding[start:start + length]
+        return self.gather(torch.arange(start, start + length, device=self.encoding.device))
 
-        seq_len = x.size(1)
-        # [batch_size = 128, seq_len = 30]
+    def gather(self, positions):
+        """Rows of positions (an integer tensor of any shape, e.g. (B, T) per-sample frame indices): (*positions.shape, d_model)."""
+        return self.encode(positions.to(self.encoding.device)).to(self.encoding.dtype)
 
-        return self.encoding[:seq_len, :]
-        # [seq_len = 30, d_model = 512]
-        # it will add with tok_emb : [128, 30, 512]
\ No newline at end of file
+    def forward(self, x):
+        # x: [batch_size, seq_len, ...], returns [seq_len, d_model], added to the input
+        return self.rows(0, x.size(1))
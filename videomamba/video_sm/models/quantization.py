@@ -0,0 +1,235 @@
+"""
+int8 CPU inference for the EndoMamba family (endomamba_tiny / small / middle).
+
+Quantized layers (QuantizedLinear, per-output-channel symmetric int8 weights):
+
+- in_proj / out_proj of every Mamba mixer, the PatchEmbed Conv3d (a GEMM over the flattened tubelets)
+  and the head: "dynamic" (activations quantized per call, int8 GEMM) or "weight_only";
+- x_proj / dt_proj: always weight-only, since the fused Mamba ops consume their raw weights
+  (they are also the smallest GEMMs, where per-call activation quantization would not pay off).
+
+Calibration runs clips through the fp32 model, records the inputs of every quantizable layer and
+keeps in fp32 the layers whose relative output error when quantized exceeds max_error. The plan
+(layer name -> mode) is saved with the int8 state dict, and load_quantized rebuilds the model from it:
+
+    model = endomamba_small(num_classes=7, return_last_state=True).eval()
+    plan, errors = calibrate(model, load_clip_folder("clips/", num_frames=8, img_size=224))
+    quantize_model(model, plan)
+    save_quantized(model, plan, "endomamba_small_int8.pth", "endomamba_small", num_classes=7, return_last_state=True)
+    model = load_quantized("endomamba_small_int8.pth")
+"""
+import os
+
+import numpy as np
+import torch
+import torch.nn as nn
+import torch.nn.functional as F
+
+from _mamba.mamba_ssm.modules.quantized_linear import QuantizedLinear, quantize_weight
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+
+try:
+    import decord
+except ImportError:
+    decord = None
+
+DYNAMIC, WEIGHT_ONLY = "dynamic", "weight_only"
+# Read as raw weights by the fused ops, so only their storage can be int8
+WEIGHT_ONLY_LAYERS = ("x_proj", "dt_proj")
+IMAGENET_MEAN, IMAGENET_STD = (0.485, 0.456, 0.406), (0.229, 0.224, 0.225)
+VIDEO_EXTENSIONS = (".mp4", ".avi", ".mkv", ".mov", ".webm")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp")
+
+
+class QuantizedPatchConv3d(nn.Module):
+    """int8 Conv3d whose stride equals its kernel (patch embedding): one GEMM over the flattened tubelets."""
+
+    def __init__(self, conv, dynamic=True):
+        super().__init__()
+        assert conv.stride == conv.kernel_size and conv.padding == (0, 0, 0) and conv.groups == 1, \
+            "only non-overlapping patch convolutions are supported"
+        self.kernel_size = conv.kernel_size
+        self.in_channels, self.out_channels = conv.in_channels, conv.out_channels
+        linear = nn.Linear(conv.weight[0].numel(), conv.out_channels, bias=conv.bias is not None)
+        with torch.no_grad():
+            linear.weight.copy_(conv.weight.flatten(1))
+            if conv.bias is not None:
+                linear.bias.copy_(conv.bias)
+        self.linear = QuantizedLinear.from_float(linear, dynamic=dynamic)
+
+    @property
+    def weight(self):
+        return self.linear.weight.view(self.out_channels, self.in_channels, *self.kernel_size)
+
+    @property
+    def bias(self):
+        return self.linear.bias
+
+    def forward(self, x):
+        B, C, T, H, W = x.shape
+        kt, kh, kw = self.kernel_size
+        x = x.view(B, C, T // kt, kt, H // kh, kh, W // kw, kw).permute(0, 2, 4, 6, 1, 3, 5, 7)
+        out = self.linear(x.reshape(B, T // kt, H // kh, W // kw, -1))
+        return out.permute(0, 4, 1, 2, 3)
+
+
+def quantizable_layers(model):
+    """name -> layer for every layer quantize_model can convert."""
+    layers = {}
+    for name, module in model.named_modules():
+        if name.endswith((".in_proj", ".out_proj", ".x_proj", ".dt_proj")) and isinstance(module, nn.Linear):
+            layers[name] = module
+    if isinstance(model.patch_embed.proj, nn.Conv3d):
+        layers["patch_embed.proj"] = model.patch_embed.proj
+    if getattr(model, "with_head", False) and isinstance(model.head, nn.Linear):
+        layers["head"] = model.head
+    return layers
+
+
+def default_plan(model, mode=DYNAMIC):
+    """Every quantizable layer in mode (weight-only for x_proj / dt_proj)."""
+    return {name: WEIGHT_ONLY if name.endswith(WEIGHT_ONLY_LAYERS) else mode for name in quantizable_layers(model)}
+
+
+def _quantize_layer(layer, mode):
+    if isinstance(layer, nn.Conv3d):
+        return QuantizedPatchConv3d(layer, dynamic=mode == DYNAMIC)
+    return QuantizedLinear.from_float(layer, dynamic=mode == DYNAMIC)
+
+
+def quantize_model(model, plan=None, mode=DYNAMIC):
+    """Replaces, inplace, the layers of plan (name -> "dynamic" / "weight_only" / None for fp32). Returns model."""
+    plan = default_plan(model, mode) if plan is None else plan
+    layers = quantizable_layers(model)
+    for name, layer_mode in plan.items():
+        if layer_mode is None:
+            continue
+        parent_name, _, attr = name.rpartition(".")
+        parent = model.get_submodule(parent_name) if parent_name else model
+        setattr(parent, attr, _quantize_layer(layers[name], layer_mode))
+    return model
+
+
+def _read_clip(path, num_frames):
+    """(T, H, W, 3) uint8 frames sampled uniformly from a video file or a folder of frame images."""
+    if os.path.isdir(path):
+        from PIL import Image
+        names = sorted(name for name in os.listdir(path) if name.lower().endswith(IMAGE_EXTENSIONS))
+        indices = np.linspace(0, len(names) - 1, num_frames).round().astype(int)
+        return np.stack([np.asarray(Image.open(os.path.join(path, names[i])).convert("RGB")) for i in indices])
+    if decord is None:
+        raise ImportError(f"decord is needed to read {path}; use folders of frames instead")
+    reader = decord.VideoReader(path, num_threads=1, ctx=decord.cpu(0))
+    indices = np.linspace(0, len(reader) - 1, num_frames).round().astype(int)
+    return reader.get_batch(indices).asnumpy()
+
+
+def load_clip_folder(clip_dir, num_frames=8, img_size=224, max_clips=None):
+    """
+    Yields the clips of clip_dir as normalized (1, 3, num_frames, img_size, img_size) tensors.
+
+    Every entry of clip_dir is a video file (read with decord) or a folder of frame images.
+    """
+    entries = sorted(
+        entry for entry in os.listdir(clip_dir)
+        if os.path.isdir(os.path.join(clip_dir, entry)) or entry.lower().endswith(VIDEO_EXTENSIONS)
+    )
+    mean = torch.tensor(IMAGENET_MEAN).view(3, 1, 1, 1)
+    std = torch.tensor(IMAGENET_STD).view(3, 1, 1, 1)
+    for entry in entries[:max_clips]:
+        frames = torch.from_numpy(_read_clip(os.path.join(clip_dir, entry), num_frames))
+        frames = frames.permute(0, 3, 1, 2).float().div_(255)  # (T, 3, H, W)
+        frames = F.interpolate(frames, size=(img_size, img_size), mode="bilinear", align_corners=False)
+        yield ((frames.permute(1, 0, 2, 3) - mean) / std).unsqueeze(0)
+
+
+class _InputRecorder(nn.Module):
+    """Runs layer and keeps up to max_rows random rows of its input (flattened as the GEMM sees it)."""
+
+    def __init__(self, layer, max_rows, generator):
+        super().__init__()
+        self.layer, self.max_rows, self.generator = layer, max_rows, generator
+        self.inputs = []
+
+    def forward(self, x):
+        rows = x
+        if isinstance(self.layer, nn.Conv3d):
+            B, C, T, H, W = x.shape
+            kt, kh, kw = self.layer.kernel_size
+            rows = x.view(B, C, T // kt, kt, H // kh, kh, W // kw, kw).permute(0, 2, 4, 6, 1, 3, 5, 7)
+        rows = rows.reshape(-1, self.layer.weight[0].numel())
+        self.inputs.append(rows[torch.randperm(rows.shape[0], generator=self.generator)[:self.max_rows]].float())
+        return self.layer(x)
+
+
+@torch.no_grad()
+def calibrate(model, clips, mode=DYNAMIC, max_error=0.05, max_rows=4096):
+    """
+    Picks which layers to quantize from their error on real inputs.
+
+    Runs the clips through the fp32 model (parallel mode), keeps up to max_rows input rows of every
+    quantizable layer and measures ||quantized(x) - layer(x)|| / ||layer(x)|| on them. x_proj / dt_proj
+    are never called as layers (the fused ops read their weights), so they get the relative error of
+    their int8 weight instead.
+
+    Returns:
+        plan (dict): name -> mode, or None for the layers over max_error (left in fp32).
+        errors (dict): name -> relative error.
+    """
+    layers = quantizable_layers(model)
+    generator = torch.Generator().manual_seed(0)
+    recorders = {}
+    for name, layer in layers.items():
+        if not name.endswith(WEIGHT_ONLY_LAYERS):
+            parent_name, _, attr = name.rpartition(".")
+            recorders[name] = _InputRecorder(layer, max_rows, generator)
+            setattr(model.get_submodule(parent_name) if parent_name else model, attr, recorders[name])
+    try:
+        for clip in clips:
+            if model.return_last_state:  # its temporal layers need states to write to
+                model(clip, InferenceParams(max_seqlen=clip.shape[2], max_batch_size=clip.shape[0]))
+            else:
+                model(clip)
+    finally:
+        for name, recorder in recorders.items():
+            parent_name, _, attr = name.rpartition(".")
+            setattr(model.get_submodule(parent_name) if parent_name else model, attr, recorder.layer)
+
+    plan, errors = {}, {}
+    for name, layer in layers.items():
+        layer_mode = WEIGHT_ONLY if name.endswith(WEIGHT_ONLY_LAYERS) else mode
+        weight = layer.weight.flatten(1)
+        if name in recorders and recorders[name].inputs:
+            x = torch.cat(recorders[name].inputs)[:max_rows]
+            linear = nn.Linear(weight.shape[1], weight.shape[0], bias=layer.bias is not None)
+            linear.weight.data = weight
+            if layer.bias is not None:
+                linear.bias.data = layer.bias
+            reference = linear(x)
+            quantized = QuantizedLinear.from_float(linear, dynamic=layer_mode == DYNAMIC)
+            errors[name] = ((quantized(x) - reference).norm() / reference.norm().clamp(min=1e-12)).item()
+        else:
+            qweight, scale = quantize_weight(weight)
+            errors[name] = ((qweight.float() * scale[:, None] - weight).norm() / weight.norm()).item()
+        plan[name] = layer_mode if errors[name] <= max_error else None
+    return plan, errors
+
+
+def save_quantized(model, plan, path, model_name, **model_kwargs):
+    """Saves the quantized state dict, the plan and how to build the fp32 skeleton (model_name, model_kwargs)."""
+    torch.save({
+        "model": model.state_dict(),
+        "quantization": {"plan": plan, "model_name": model_name, "model_kwargs": model_kwargs},
+    }, path)
+
+
+def load_quantized(path, map_location="cpu"):
+    """Rebuilds a model saved by save_quantized, in eval mode."""
+    from video_sm.models import endomamba
+
+    checkpoint = torch.load(path, map_location=map_location, weights_only=False)
+    config = checkpoint["quantization"]
+    model = getattr(endomamba, config["model_name"])(**config["model_kwargs"])
+    quantize_model(model, config["plan"])
+    model.load_state_dict(checkpoint["model"])
+    return model.eval()
@@ -0,0 +1,301 @@
+"""
+Batched recurrent inference for many concurrent video streams (e.g. several OR cameras on one box).
+
+EndoMamba's recurrent mode (return_last_state=True + InferenceParams, see tests/endomamba_demo.py)
+carries, for every temporal layer, a conv_state (B, d_inner, d_conv) and an ssm_state
+(B, d_inner, d_state). StreamingEngine keeps these states for up to max_streams streams in a
+preallocated slot pool. At every tick the streams that have a new frame are gathered into one
+batched forward, each row at its own temporal position (InferenceParams.lengths_per_sample), and
+their updated states are scattered back into their slots. Streams join and leave by taking /
+releasing a slot, so the pool is never reallocated. With state_dtype (torch.bfloat16, torch.float16 or
+torch.int8, see _mamba/mamba_ssm/utils/state_cache.py) the pool is kept in reduced precision and only
+the states of the current tick are expanded to fp32.
+
+    engine = StreamingEngine(endomamba_small(return_last_state=True, num_classes=7), max_streams=8)
+    engine.join("or-1")
+    logits = engine.step({"or-1": frame})["or-1"]  # frame: (C, H, W)
+    engine.leave("or-1")
+"""
+import torch
+import torch.nn as nn
+
+from _mamba.mamba_ssm.modules.mamba_static import StaticMamba
+from _mamba.mamba_ssm.ops.backend import RMSNorm
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from _mamba.mamba_ssm.utils.inference_state import InferenceStateManager
+from _mamba.mamba_ssm.utils.state_cache import load_states, state_nbytes, store_states_
+from _mamba.mamba_ssm.utils.workspace import Workspace
+
+
+class StreamingEngine:
+    def __init__(self, model, max_streams, state_dtype=None):
+        """
+        Args:
+            model (EndoMamba): model built with return_last_state=True, in eval mode.
+            max_streams (int): number of slots in the state pool.
+            state_dtype (torch.dtype): storage dtype of the state pool, None for the model dtype.
+        """
+        assert model.return_last_state, "StreamingEngine needs a model built with return_last_state=True"
+        self.model = model
+        self.max_streams = max_streams
+        self.device = next(model.parameters()).device
+
+        # Only the temporal layers carry state from one frame to the next
+        self.temporal_layer_indices = [i for i, layer in enumerate(model.layers) if not layer.bimamba]
+        self.state_dtype = state_dtype
+        # layer -> stored states, (conv_state, ssm_state) or with int8 (conv_state, ssm_state, conv_scale, ssm_scale)
+        self.states = {
+            i: model.layers[i].allocate_inference_cache(max_streams, 1, dtype=state_dtype)
+            for i in self.temporal_layer_indices
+        }
+        # Number of frames each slot has seen, i.e. its temporal position
+        self.offsets = torch.zeros(max_streams, dtype=torch.long, device=self.device)
+
+        self.slots = {}  # stream_id -> slot
+        self.free_slots = list(reversed(range(max_streams)))
+
+    @property
+    def num_streams(self):
+        return len(self.slots)
+
+    @property
+    def state_nbytes_per_stream(self):
+        return sum(state_nbytes(states) for states in self.states.values()) // self.max_streams
+
+    def join(self, stream_id):
+        """Assigns a free slot, with zeroed states, to a new stream. Returns the slot."""
+        if stream_id in self.slots:
+            raise ValueError(f"Stream {stream_id!r} already joined")
+        if not self.free_slots:
+            raise RuntimeError(f"All {self.max_streams} stream slots are in use")
+        slot = self.free_slots.pop()
+        for states in self.states.values():
+            for state in states:
+                state[slot].zero_()
+        self.offsets[slot] = 0
+        self.slots[stream_id] = slot
+        return slot
+
+    def leave(self, stream_id):
+        """Releases the slot of a stream; its states are dropped."""
+        self.free_slots.append(self.slots.pop(stream_id))
+
+    @torch.no_grad()
+    def step(self, frames):
+        """
+        Runs one tick.
+
+        Args:
+            frames (dict): stream_id -> frame of shape (C, H, W), or a burst of K frames (C, K, H, W), for the
+                streams that have new frames.
+
+        Returns:
+            dict: stream_id -> model output for the frame(s) (the logits (num_classes,), or (K, num_classes)
+                for a burst, with a head).
+        """
+        # Streams with the same number of new frames share one forward
+        groups = {}
+        for stream_id, frame in frames.items():
+            groups.setdefault(frame.shape[1] if frame.dim() == 4 else None, []).append(stream_id)
+
+        outputs = {}
+        for num_frames, stream_ids in groups.items():
+            x = torch.stack([frames[stream_id] for stream_id in stream_ids]).to(self.device)
+            out = self._forward(stream_ids, x if num_frames is not None else x.unsqueeze(2))  # (B, C, K, H, W)
+            outputs.update(zip(stream_ids, out if num_frames is not None else out[:, 0]))
+        return outputs
+
+    def _forward(self, stream_ids, x):
+        slot_index = torch.tensor([self.slots[stream_id] for stream_id in stream_ids], device=self.device)
+
+        # Gather the states of these streams; each row keeps its own temporal position
+        lengths_per_sample = self.offsets[slot_index]
+        inference_params = InferenceParams(
+            max_seqlen=int(lengths_per_sample.max()) + x.shape[2], max_batch_size=len(stream_ids),
+            lengths_per_sample=lengths_per_sample,
+        )
+        stored_states = {}
+        for i, states in self.states.items():
+            stored_states[i] = tuple(state.index_select(0, slot_index) for state in states)
+            inference_params.key_value_memory_dict[i] = (
+                load_states(stored_states[i]) if self.state_dtype is not None else stored_states[i]
+            )
+
+        out, inference_params = self.model.forward_stream(x, inference_params)
+
+        # Scatter the updated states (rounded to the storage dtype) and positions back into the pool
+        for i, states in self.states.items():
+            new_states = inference_params.key_value_memory_dict[i]
+            if self.state_dtype is not None:
+                new_states = store_states_(stored_states[i], new_states)
+            for state, new_state in zip(states, new_states):
+                state.index_copy_(0, slot_index, new_state.to(state.dtype))
+        self.offsets.index_copy_(0, slot_index, inference_params.lengths_per_sample)
+        return out
+
+
+class StaggeredStateStreamer:
+    """
+    Windowed-memory streaming: K recurrent states per stream, reset in turn, over one spatial pass.
+
+    State k is reset every reset_period frames, at phase k * reset_period // K (after the first
+    reset_period frames), so at any time one state has seen between reset_period - reset_period // K
+    and reset_period frames; its output is the one returned. The spatial layers run once per frame and
+    the temporal layers on K copies of their output (EndoMamba num_temporal_states), instead of running
+    the whole network on a K-times repeated batch.
+    The temporal positional encoding stays at inference_params.seqlen_offset for every frame.
+
+    With num_states=2 this is the smart test of downstream phase recognition.
+    """
+
+    def __init__(self, model, num_states=2, reset_period=16, batch_size=1):
+        assert model.return_last_state, "StaggeredStateStreamer needs a model built with return_last_state=True"
+        self.model = model
+        self.num_states = num_states
+        self.reset_period = reset_period
+        self.batch_size = batch_size
+        self.phases = [k * reset_period // num_states for k in range(num_states)]
+        self.inference_params = InferenceParams(max_seqlen=reset_period, max_batch_size=batch_size * num_states)
+        self.states = InferenceStateManager(self.inference_params)
+        self.last_reset = [-1] * num_states  # -1: never reset
+        self.current_state = 0
+        self.frame_idx = 0
+
+    @torch.no_grad()
+    def step(self, x):
+        """x: (batch_size, C, 1, H, W). Returns the output of the current state, (batch_size, 1, num_classes)."""
+        if self.frame_idx > self.reset_period:
+            for k, phase in enumerate(self.phases):
+                if (self.frame_idx - phase) % self.reset_period == 0:
+                    self.states.reset([b * self.num_states + k for b in range(self.batch_size)])
+                    self.last_reset[k] = self.frame_idx
+        # Read from the state with the longest history
+        self.current_state = min(range(self.num_states), key=lambda k: self.last_reset[k])
+        out, self.inference_params = self.model(x, self.inference_params, num_temporal_states=self.num_states)
+        self.frame_idx += x.shape[2]
+        return out.view(self.batch_size, self.num_states, *out.shape[1:])[:, self.current_state]
+
+
+class StaticFrameRunner:
+    """
+    Single-frame recurrent inference with static shapes: every intermediate tensor is preallocated for
+    (batch_size, img_size) and reused from frame to frame.
+
+    A step of forward_stream allocates its activations, the pos_embed / cls concatenation, the temporal
+    positional encoding, the layout conversions and the projections afresh. Here the patch embedding is
+    a GEMM on the unfolded frame, the norms are inplace and every mixer runs through StaticMamba, all
+    into buffers of one Workspace, shared by the layers. After the first step a step does not allocate
+    (workspace.num_allocations stays constant, AllocationCounter counts 0).
+
+    The batch_size streams advance together; the temporal states are (B, d_inner, d_conv) /
+    (B, d_inner, d_state) per temporal layer, as in InferenceParams. Supports EndoMamba with RMSNorm (fused
+    add + norm or not, the same math), with or without the cls token and head, tubelet kernel_size 1, in fp32.
+
+        runner = StaticFrameRunner(endomamba_small(num_classes=7).eval(), batch_size=1)
+        logits = runner.step(frame)  # frame: (1, C, H, W); logits: (1, num_classes), overwritten by the next step
+    """
+
+    def __init__(self, model, batch_size=1):
+        assert isinstance(model.norm_f, RMSNorm), "StaticFrameRunner needs RMSNorm"
+        assert model.patch_embed.tubelet_size == 1, "StaticFrameRunner runs one frame per step"
+        self.model = model
+        self.batch_size = batch_size
+        self.device = next(model.parameters()).device
+        self.workspace = Workspace(self.device)
+        self.mixers = [StaticMamba(layer.mixer, self.workspace) for layer in model.layers]
+        self.temporal_layer_indices = [i for i, layer in enumerate(model.layers) if not layer.bimamba]
+        self.states = {i: model.layers[i].allocate_inference_cache(batch_size, 1) for i in self.temporal_layer_indices}
+        self.offset = 0
+        self.constants = {}
+
+        with torch.no_grad():
+            proj = model.patch_embed.proj
+            self.patch_weight = proj.weight.flatten(1).t()  # (C * p * p, embed_dim)
+            # The conv bias and pos_embed are added together, the cls token gets no temporal encoding
+            pos_embed = model.pos_embed[0]
+            self.patch_pos = pos_embed[1:] + (proj.bias if proj.bias is not None else 0)
+            self.cls_pos = model.cls_token[0] + pos_embed[:1] if model.with_cls_token else None
+            self.head = model.head if model.with_head and isinstance(model.head, nn.Linear) else None
+            self.head_weight = self.head.weight.t() if self.head is not None else None
+
+    def reset(self):
+        """Zeroes the temporal states: the next frame starts a new clip."""
+        for conv_state, ssm_state in self.states.values():
+            conv_state.zero_()
+            ssm_state.zero_()
+        self.offset = 0
+
+    def _constant(self, value):
+        # Python scalars in tensor ops are wrapped into freshly allocated tensors, so constants are cached
+        if value not in self.constants:
+            self.constants[value] = torch.tensor(value, device=self.device)
+        return self.constants[value]
+
+    def _mean(self, x, dim, out):
+        torch.sum(x, dim=dim, keepdim=out.dim() == x.dim(), out=out)
+        return out.mul_(self._constant(1 / x.shape[dim]))
+
+    def _rms_norm(self, x, weight, eps, out):
+        ws = self.workspace
+        square = ws.get("norm_square", x.shape)
+        torch.mul(x, x, out=square)
+        rstd = self._mean(square, -1, out=ws.get("norm_rstd", x.shape[:-1] + (1,)))
+        rstd.add_(self._constant(eps)).rsqrt_()
+        torch.mul(x, rstd, out=out)
+        out.mul_(weight)
+        return out
+
+    @torch.no_grad()
+    def step(self, frame):
+        """
+        frame: (batch_size, C, H, W), the next frame of every stream.
+
+        Returns the logits (batch_size, num_classes), or the pooled features (batch_size, embed_dim)
+        without a head. The returned tensor is a workspace buffer, overwritten by the next step.
+        """
+        ws = self.workspace
+        model = self.model
+        B, C, H, W = frame.shape
+        p = model.patch_embed.patch_size[0]
+        h, w = H // p, W // p
+        num_cls = int(model.with_cls_token)
+        N, D = h * w + num_cls, model.embed_dim
+
+        # Patch embedding: unfold the frame into (B, h * w, C * p * p), one GEMM
+        patches = ws.get("patches", (B, h * w, C * p * p))
+        patches.view(B, h, w, C, p, p).copy_(frame.view(B, C, h, p, w, p).permute(0, 2, 4, 1, 3, 5))
+        embedded = ws.get("embedded", (B, h * w, D))
+        torch.mm(patches.view(-1, C * p * p), self.patch_weight, out=embedded.view(-1, D))
+        tokens = ws.get("tokens", (B, N, D))
+        torch.add(embedded, self.patch_pos, out=tokens[:, num_cls:])
+        model.temporal_pos_embedding.grow(self.offset + 1)  # in blocks, past the end of the table
+        tokens[:, num_cls:].add_(model.temporal_pos_embedding.rows(self.offset, 1)[0])
+        if num_cls:
+            tokens[:, :1].copy_(self.cls_pos)
+
+        # Blocks: residual += hidden; hidden = mixer(norm(residual))
+        residual = ws.get("residual", (B, N, D))
+        hidden = ws.get("hidden", (B, N, D))
+        normed = ws.get("normed", (B, N, D))
+        residual.copy_(tokens)
+        for i, (layer, mixer) in enumerate(zip(model.layers, self.mixers)):
+            if i > 0:
+                residual.add_(hidden)
+            self._rms_norm(residual, layer.norm.weight, layer.norm.eps, out=normed)
+            mixer(normed, hidden, *self.states.get(i, ()))
+        residual.add_(hidden)
+        self._rms_norm(residual, model.norm_f.weight, model.norm_f.eps, out=normed)
+        self.offset += 1
+
+        pooled = ws.get("pooled", (B, D))
+        if model.only_cls_token:
+            pooled.copy_(normed[:, 0])
+        else:
+            self._mean(normed, 1, out=pooled)
+        if self.head is None:
+            return pooled
+        logits = ws.get("logits", (B, self.head.out_features))
+        torch.mm(pooled, self.head_weight, out=logits)
+        if self.head.bias is not None:
+            logits.add_(self.head.bias)
+        return logits
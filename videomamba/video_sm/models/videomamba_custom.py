@@ -1,7 +1,6 @@
 # Copyright (c) 2015-present, Facebook, Inc.
 # All rights reserved.
 import os
-from sympy import N
 import torch
 import torch.nn as nn
 from functools import partial
@@ -342,7 +341,7 @@ class VisionMamba(nn.Module):
         x = rearrange(x, '(b t) n m -> (b n) t m', b=B, t=T)
         
         if inference_params is not None:
-            temporal_pos = self.temporal_pos_embedding.encoding[inference_params.seqlen_offset: inference_params.seqlen_offset + T, :].unsqueeze(0).to(x.device)  # (1, T_n, C)
+            temporal_pos = self.temporal_pos_embedding.rows(inference_params.seqlen_offset, T).unsqueeze(0)  # (1, T_n, C)
             x = x + temporal_pos  # (B*n, T, C) + (1, T, C) 
         else:
             x = x + self.temporal_pos_embedding(x).unsqueeze(0).to(x.device)
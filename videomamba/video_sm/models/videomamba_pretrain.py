@@ -186,6 +186,26 @@ class PatchEmbed(nn.Module):
         x = self.proj(x)
         return x
 
+    def grid(self, x):
+        """(T, H, W) patch grid of a clip x (B, C, T, H, W)."""
+        return x.shape[2] // self.tubelet_size, x.shape[3] // self.patch_size[0], x.shape[4] // self.patch_size[1]
+
+    def forward_visible(self, x, index):
+        """
+        Embeds only the patches of index (B, N_vis), positions in the (t h w) order of the grid: their pixels
+        are gathered from unfolded views of x, laid side by side in one row and projected by the same strided
+        conv, so the tokens are those of forward at these positions (same values, same kernel) without the
+        cost of the masked patches. Returns (B, N_vis, embed_dim).
+        """
+        B, C = x.shape[:2]
+        (k, p, q), (T, H, W) = self.proj.kernel_size, self.grid(x)
+        patches = x.unfold(2, k, k).unfold(3, p, p).unfold(4, q, q).permute(0, 2, 3, 4, 1, 5, 6, 7)  # (B, T, H, W, C, k, p, q)
+        batch = torch.arange(B, device=x.device).unsqueeze(1)
+        visible = patches[batch, index // (H * W), index // W % H, index % W]  # (B, N_vis, C, k, p, q)
+        N = visible.shape[1]
+        row = visible.permute(0, 2, 3, 4, 1, 5).reshape(B, C, k, p, N * q)
+        return self.proj(row).view(B, -1, N).transpose(1, 2)
+
 
 class Linear_Decoder(nn.Module):
     def __init__(self, output_dim=768, embed_dim=768, 
@@ -365,7 +385,23 @@ class VisionMamba(nn.Module):
     def load_pretrained(self, checkpoint_path, prefix=""):
         _load_weights(self, checkpoint_path, prefix)
 
-    def forward_features(self, x, mask=None):
+    def embed(self, x, mask=None):
+        """
+        CLS token and patch tokens of x with their positional embeddings, (B, 1 + T * N, C), or with mask
+        (B, 1 + T * N, True where masked, the CLS token visible) only the visible ones, in order. Only the
+        visible patches are then embedded: the same tokens as the full path followed by x[~mask], without
+        the cost of the masked patches.
+        """
+        if mask is not None:
+            B = x.shape[0]
+            T, H, W = self.patch_embed.grid(x)
+            index = (~mask[:, 1:]).nonzero()[:, 1].view(B, -1)  # visible patches in (t n) order
+            x = self.patch_embed.forward_visible(x, index)
+            x = x + self.pos_embed[0, 1 + index % (H * W)]
+            x = x + self.temporal_pos_embedding[0, index // (H * W)]
+            cls_tokens = (self.cls_token + self.pos_embed[:, :1]).expand(B, -1, -1)
+            return torch.cat((cls_tokens, x), dim=1)
+
         x = self.patch_embed(x)
         B, C, T, H, W = x.shape
         x = x.permute(0, 2, 3, 4, 1).reshape(B * T, H * W, C)
@@ -380,10 +416,11 @@ class VisionMamba(nn.Module):
         x = rearrange(x, '(b t) n m -> (b n) t m', b=B, t=T)
         x = x + self.temporal_pos_embedding
         x = rearrange(x, '(b n) t m -> b (t n) m', b=B, t=T)
-        x = torch.cat((cls_tokens, x), dim=1)
+        return torch.cat((cls_tokens, x), dim=1)
 
-        # mask
-        x_vis = x[~mask].reshape(B, -1, C) # ~mask means visible
+    def forward_features(self, x, mask=None):
+        # mask, ~mask means visible
+        x_vis = self.embed(x, mask)
         x_clip_vis = []
 
         # mamba impl
@@ -23,6 +23,9 @@ from utils import multiple_samples_collate
 import utils
 import contextlib
 from models import *
+from models.endomamba import register_timm_models
+
+register_timm_models()  # endomamba_* for create_model
 
 
 def get_args():
@@ -21,6 +21,9 @@ import contextlib
 # from models.endomamba import *
 from models.videomamba import *
 from models import modeling_pretrain
+from models.endomamba import register_timm_models
+
+register_timm_models()  # endomamba_* for create_model (e.g. --teacher_model)
 
 def get_args():
     parser = argparse.ArgumentParser('EndoMamba pre-training script', add_help=False)
@@ -0,0 +1,36 @@
+"""
+Converts a pretraining (or, with --finetuned, a finetuned) checkpoint to an inference checkpoint: the
+converted weights of the model only, in a file load_inference_checkpoint memory-maps (see
+inference_checkpoint.py).
+
+    python video_sm/tools/export_inference_checkpoint.py --model small --checkpoint checkpoint-499.pth \
+        --num-classes 7 --output endomamba_small.safetensors
+"""
+import argparse
+import os
+import sys
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models.inference_checkpoint import export_inference_checkpoint
+
+
+parser = argparse.ArgumentParser(description="EndoMamba inference checkpoint export")
+parser.add_argument("--model", type=str, default="small", choices=["tiny", "small", "middle"])
+parser.add_argument("--checkpoint", type=str, required=True)
+parser.add_argument("--finetuned", action="store_true", help="the keys are the model's, no pretraining conversion")
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--return-last-state", action="store_true")
+parser.add_argument("--output", type=str, required=True)
+args = parser.parse_args()
+
+model_kwargs = dict(num_classes=args.num_classes, img_size=args.img_size)
+if args.return_last_state:
+    model_kwargs["return_last_state"] = True
+missing = export_inference_checkpoint(
+    args.checkpoint, args.output, f"endomamba_{args.model}", from_pretraining=not args.finetuned, **model_kwargs
+)
+print(f"Saved {args.output} ({os.path.getsize(args.output) / 2 ** 20:.1f} MB, "
+      f"from {os.path.getsize(args.checkpoint) / 2 ** 20:.1f} MB)")
+if missing:
+    print(f"Not in the checkpoint, initialized at load: {', '.join(missing)}")
@@ -0,0 +1,114 @@
+"""
+Exports EndoMamba's single-frame recurrent step (see export.py) to TorchScript and, if the onnx package
+is installed, to ONNX, then checks both against the eager recurrent path (forward_stream) on a stream of
+--frames frames: largest |logits difference| and largest |state difference| after the last frame, and
+the per-frame latency of each path after --warmup frames. The ONNX model is run with onnxruntime when
+it is installed.
+
+    python video_sm/tools/export_recurrent_step.py --model small --img-size 224 --out endomamba_small_step
+"""
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from _mamba.mamba_ssm.utils.inference_params import InferenceParams
+from video_sm.models.endomamba import endomamba_tiny, endomamba_small
+from video_sm.models.export import RecurrentStep, export_onnx, trace_step
+
+try:
+    import onnx
+except ImportError:
+    onnx = None
+
+try:
+    import onnxruntime
+except ImportError:
+    onnxruntime = None
+
+
+parser = argparse.ArgumentParser(description="Export and check the recurrent step")
+parser.add_argument("--model", type=str, default="tiny", choices=["tiny", "small"])
+parser.add_argument("--checkpoint", type=str, default=None)
+parser.add_argument("--frames", type=int, default=20)
+parser.add_argument("--warmup", type=int, default=3, help="frames left out of the latency (TorchScript profiles its first runs)")
+parser.add_argument("--batch-size", type=int, default=1)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--out", type=str, default=None, help="path prefix of the .pt / .onnx files")
+parser.add_argument("--threads", type=int, default=None)
+args = parser.parse_args()
+
+if args.threads is not None:
+    torch.set_num_threads(args.threads)
+torch.manual_seed(0)
+
+build = endomamba_tiny if args.model == "tiny" else endomamba_small
+model = build(img_size=args.img_size, num_classes=args.num_classes, return_last_state=True).eval()
+if args.checkpoint is not None:
+    model.load_state_dict(torch.load(args.checkpoint, map_location="cpu")["model"], strict=False)
+step = RecurrentStep(model)
+frames = torch.randn(args.frames, args.batch_size, 3, args.img_size, args.img_size)
+
+start = time.perf_counter()
+traced = trace_step(step, args.batch_size)
+print(f"traced in {time.perf_counter() - start:.1f} s")
+runners = {"traced": traced}
+if args.out is not None:
+    traced.save(args.out + ".pt")
+if onnx is not None:
+    onnx_path = export_onnx(step, (args.out or args.model + "_step") + ".onnx", args.batch_size)
+    print(f"exported {onnx_path}")
+    if onnxruntime is not None:
+        session = onnxruntime.InferenceSession(onnx_path, providers=["CPUExecutionProvider"])
+        input_names = [i.name for i in session.get_inputs()]
+
+        def run_onnx(*inputs):
+            outputs = session.run(None, {name: x.numpy() for name, x in zip(input_names, inputs)})
+            return [torch.from_numpy(out) for out in outputs]
+
+        runners["onnxruntime"] = run_onnx
+else:
+    print("onnx is not installed, ONNX export skipped")
+
+
+@torch.no_grad()
+def run_eager():
+    inference_params = InferenceParams(max_seqlen=args.frames, max_batch_size=args.batch_size)
+    outputs, latencies = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        out, inference_params = model.forward_stream(frame.unsqueeze(2), inference_params)
+        latencies.append(time.perf_counter() - start)
+        outputs.append(out[:, 0])
+    states = [state for i in step.temporal_layer_indices for state in inference_params.key_value_memory_dict[i]]
+    return torch.stack(outputs), states, np.array(latencies[args.warmup:]) * 1e3
+
+
+@torch.no_grad()
+def run_step(runner):
+    states, offset = step.initial_states(args.batch_size), torch.zeros(args.batch_size, dtype=torch.long)
+    outputs, latencies = [], []
+    for frame in frames:
+        start = time.perf_counter()
+        out, *states = runner(frame, offset, *states)
+        latencies.append(time.perf_counter() - start)
+        outputs.append(out)
+        offset = offset + 1
+    return torch.stack(outputs), states, np.array(latencies[args.warmup:]) * 1e3
+
+
+print(f"EndoMamba-{args.model} {args.img_size}px, batch {args.batch_size}, {args.frames} frames, "
+      f"{torch.get_num_threads()} threads")
+print(f"{'path':>12} | {'mean ms':>8} {'p50':>8} | {'max |logits diff|':>17} {'max |state diff|':>16}")
+reference, reference_states, latency = run_eager()
+print(f"{'eager':>12} | {latency.mean():>8.1f} {np.percentile(latency, 50):>8.1f} |")
+for name, runner in runners.items():
+    outputs, states, latency = run_step(runner)
+    state_diff = max((state - state_ref).abs().max().item() for state, state_ref in zip(states, reference_states))
+    print(f"{name:>12} | {latency.mean():>8.1f} {np.percentile(latency, 50):>8.1f} | "
+          f"{(outputs - reference).abs().max().item():>17.2e} {state_diff:>16.2e}")
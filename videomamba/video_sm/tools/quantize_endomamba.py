@@ -0,0 +1,56 @@
+"""
+Calibrates and saves an int8 EndoMamba checkpoint for CPU inference (see quantization.py).
+
+The clips of --clip-dir (video files, or folders of frame images) go through the fp32 model; layers whose
+int8 output error exceeds --max-error stay in fp32. Without --clip-dir, random clips are used, which is
+only meaningful as a smoke test.
+
+    python video_sm/tools/quantize_endomamba.py --model small --checkpoint finetuned.pth --num-classes 7 \
+        --clip-dir clips/ --output endomamba_small_int8.pth
+"""
+import argparse
+import os
+import sys
+
+import torch
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), "../..")))
+from video_sm.models import endomamba
+from video_sm.models.quantization import DYNAMIC, WEIGHT_ONLY, calibrate, load_clip_folder, quantize_model, save_quantized
+
+
+parser = argparse.ArgumentParser(description="EndoMamba int8 calibration")
+parser.add_argument("--model", type=str, default="small", choices=["tiny", "small", "middle"])
+parser.add_argument("--checkpoint", type=str, default=None, help="fp32 weights ('model' / 'module' key or a state dict)")
+parser.add_argument("--num-classes", type=int, default=7)
+parser.add_argument("--img-size", type=int, default=224)
+parser.add_argument("--clip-dir", type=str, default=None)
+parser.add_argument("--num-clips", type=int, default=16)
+parser.add_argument("--frames", type=int, default=8)
+parser.add_argument("--mode", type=str, default=DYNAMIC, choices=[DYNAMIC, WEIGHT_ONLY])
+parser.add_argument("--max-error", type=float, default=0.05)
+parser.add_argument("--output", type=str, required=True)
+args = parser.parse_args()
+
+model_name = f"endomamba_{args.model}"
+model_kwargs = dict(num_classes=args.num_classes, img_size=args.img_size, return_last_state=True)
+model = getattr(endomamba, model_name)(**model_kwargs).eval()
+if args.checkpoint is not None:
+    state_dict = torch.load(args.checkpoint, map_location="cpu")
+    state_dict = state_dict.get("model", state_dict.get("module", state_dict))
+    print(model.load_state_dict(state_dict, strict=False))
+
+if args.clip_dir is not None:
+    clips = load_clip_folder(args.clip_dir, args.frames, args.img_size, args.num_clips)
+else:
+    clips = (torch.randn(1, 3, args.frames, args.img_size, args.img_size) for _ in range(args.num_clips))
+plan, errors = calibrate(model, clips, mode=args.mode, max_error=args.max_error)
+
+for name, error in sorted(errors.items(), key=lambda item: -item[1])[:10]:
+    print(f"{name:>32}: relative error {error:.4f} -> {plan[name] or 'fp32'}")
+kept = [name for name, mode in plan.items() if mode is None]
+print(f"{len(plan) - len(kept)} / {len(plan)} layers quantized" + (f", fp32: {', '.join(kept)}" if kept else ""))
+
+quantize_model(model, plan)
+save_quantized(model, plan, args.output, model_name, **model_kwargs)
+print(f"Saved {args.output} ({os.path.getsize(args.output) / 2 ** 20:.1f} MB)")